@@ -0,0 +1,269 @@
+"""Benchmarks for CorMat. Times the pairwise distance functions (numpy and torch-on-CPU), DTW, correlation matrix
+construction and calculatePairwiseDistances across problem sizes and settings, and checks each fast path against a
+reference result. The import suite times importing the package (and each lazily imported part) in fresh interpreters. Results are written as JSON, one record per case, along with the commit and library versions, so runs
+from different commits or machines can be compared.
+
+Usage:
+    python benchmarks/benchmark.py                      # Full sweep, written to benchmarks/results/<commit>-<time>.json
+    python benchmarks/benchmark.py --quick              # Small sizes only
+    python benchmarks/benchmark.py --suite pairwise --dims 20 90 --sizes 20 100 --output out.json
+    python benchmarks/benchmark.py --suite import        # Import time and peak memory only
+    python benchmarks/benchmark.py --compare old.json new.json
+
+Each record has the suite, the case name, its parameters, 'seconds' (best time per call over the repeats, from
+timeit's autorange), and where a reference exists, 'maxAbsError' against it."""
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")) # Benchmark this checkout
+from CorMat import utils, batched
+from CorMat.dtw import dtw
+from CorMat.distances import distances
+
+metricNames = ["BuresDistance", "BuresAngle", "AffineInvariant", "LogFrobenius", "Euclidean"]
+
+
+def bestTime(func, repeat: int = 3) -> float:
+    """Best time per call, in seconds, over repeat runs of as many calls as take at least 0.2 s."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def cohort(numArrays: int, dim: int, numSamples: int = None, seed: int = 0, trace1: bool = False) -> np.ndarray:
+    """Stack of random full-rank correlation matrices (from timeseries of 2*dim samples by default)."""
+    rng = np.random.default_rng(seed)
+    timeseries = rng.standard_normal((numArrays, dim, numSamples if numSamples is not None else 2 * dim))
+    mats = utils.batchTStoCM(timeseries)
+    return mats / dim if trace1 else mats
+
+
+def pairInputs(name: str, mats: np.ndarray) -> dict:
+    """Keyword inputs of the precomputed variant of a pairwise distance, for the first two matrices."""
+    if name in ("BuresDistance", "BuresAngle"):
+        halves = batched.sqrtm(mats[:2])
+        return {'Ahalf': halves[0], 'Bhalf': halves[1]}
+    if name == "AffineInvariant":
+        return {'Ahalf': batched.sqrtm(mats[:1])[0], 'A_neghalf': batched.invsqrtm(mats[:1])[0]}
+    return {}
+
+
+def benchDistances(dims, **_):
+    """Per-pair distances.*, with and without precomputed square roots, and with fastMode."""
+    for dim in dims:
+        for name in metricNames:
+            mats = cohort(2, dim, trace1=(name == "BuresAngle"))
+            func = getattr(distances, name)
+            precomputed = pairInputs(name, mats)
+            reference = func(mats[0], mats[1], **precomputed)
+            for precompute in ([True, False] if precomputed else [False]):
+                for fastMode in ([False, True] if name in ("BuresDistance", "BuresAngle") else [False]):
+                    kwargs = dict(precomputed if precompute else {}, fastMode=fastMode) # Without Ahalf etc., scipy computes them per call
+                    value = func(mats[0], mats[1], **kwargs)
+                    yield {'case': f"distances.{name}", 'params': {'dim': dim, 'precompute': precompute, 'fastMode': fastMode},
+                           'seconds': bestTime(lambda: func(mats[0], mats[1], **kwargs)), 'maxAbsError': float(abs(value - reference))}
+
+
+def benchTorchDistances(dims, **_):
+    """Per-pair gpu.distances.* on the CPU torch device (skipped if torch is not installed)."""
+    try:
+        import torch
+        from CorMat.gpu import distances as torchDistances, linalg as torchLinalg
+    except ImportError:
+        return
+    for dim in dims:
+        for name in metricNames:
+            mats = cohort(2, dim, trace1=(name == "BuresAngle"))
+            A, B = torch.as_tensor(mats[0]), torch.as_tensor(mats[1])
+            precomputed = {}
+            if name in ("BuresDistance", "BuresAngle", "AffineInvariant"):
+                precomputed = {'Ahalf': torchLinalg.fractional_mat_power(A, 1/2), 'Bhalf': torchLinalg.fractional_mat_power(B, 1/2)}
+            reference = getattr(distances, name)(mats[0], mats[1], **pairInputs(name, mats))
+            func = getattr(torchDistances, name)
+            for precompute in ([True, False] if precomputed else [False]):
+                for fastMode in ([False, True] if name in ("BuresDistance", "BuresAngle") else [False]):
+                    kwargs = dict(precomputed if precompute else {}, fastMode=fastMode)
+                    value = float(func(A, B, **kwargs))
+                    yield {'case': f"gpu.distances.{name}", 'params': {'dim': dim, 'precompute': precompute, 'fastMode': fastMode,
+                                                                        'device': 'cpu', 'threads': torch.get_num_threads()},
+                           'seconds': bestTime(lambda: func(A, B, **kwargs)), 'maxAbsError': float(abs(value - reference))}
+
+
+def benchDTW(lengths, **_):
+    """dtw.dtw_distance with compiled and Python feature distances, with and without a Sakoe-Chiba window."""
+    rng = np.random.default_rng(0)
+    for length in lengths:
+        X, Y = rng.standard_normal((length, 10)), rng.standard_normal((length, 10))
+        reference = dtw.compute_accumulated_cost_matrix(dtw.compute_cost_matrix(X, Y))[-1, -1]
+        dtw.dtw_distance(X[:5], Y[:5]) # Compile (or load the cached compilation) outside the timings
+        cases = [("euclidean", None, None), ("euclidean", "sakoe-chiba", max(1, length // 10)),
+                 (lambda x, y: np.linalg.norm(x - y), None, None)]
+        for featureDist, window, windowSize in cases:
+            if callable(featureDist) and length > 300:
+                continue # The Python feature distance takes minutes at this length
+            value = dtw.dtw_distance(X, Y, DTWfeatureDist=featureDist, window=window, windowSize=windowSize)
+            yield {'case': "dtw.dtw_distance", 'params': {'length': length, 'features': 10, 'window': window, 'windowSize': windowSize,
+                                                           'DTWfeatureDist': "callable" if callable(featureDist) else featureDist},
+                   'seconds': bestTime(lambda: dtw.dtw_distance(X, Y, DTWfeatureDist=featureDist, window=window, windowSize=windowSize)),
+                   'maxAbsError': None if window is not None else float(abs(value - reference))}
+
+
+def benchTStoCM(dims, sizes, **_):
+    """utils.TStoCM per subject against utils.batchTStoCM for a cohort, in float64 and float32."""
+    rng = np.random.default_rng(0)
+    for dim in dims:
+        for numArrays in sizes:
+            timeseries = rng.standard_normal((numArrays, dim, 300))
+            reference = np.array([utils.TStoCM(ts) for ts in timeseries])
+            yield {'case': "utils.TStoCM", 'params': {'dim': dim, 'subjects': numArrays, 'samples': 300},
+                   'seconds': bestTime(lambda: [utils.TStoCM(ts) for ts in timeseries]), 'maxAbsError': 0.0}
+            for dtype in (np.float64, np.float32):
+                value = utils.batchTStoCM(timeseries, dtype=dtype)
+                yield {'case': "utils.batchTStoCM", 'params': {'dim': dim, 'subjects': numArrays, 'samples': 300, 'dtype': np.dtype(dtype).name},
+                       'seconds': bestTime(lambda: utils.batchTStoCM(timeseries, dtype=dtype)), 'maxAbsError': float(abs(value - reference).max())}
+
+
+def benchPairwise(dims, sizes, loopLimit, **_):
+    """utils.calculatePairwiseDistances: the pairwise loop (for cohorts up to loopLimit) against the vectorized engine,
+    with fastMode and dtype variants. The vectorized variants are timed with bestTime, after a first (warm-up) call whose
+    result is checked; the slow loop is timed once. Errors are measured off the diagonal, against the original pairwise
+    loop over the first loopLimit matrices (the whole cohort, for cohorts up to loopLimit)."""
+    for dim in dims:
+        for numArrays in sizes:
+            for name in metricNames:
+                mats = cohort(numArrays, dim, trace1=(name == "BuresAngle"))
+                func = getattr(distances, name)
+                common = dict(assumeDistIsSymmetric=True, silent=True)
+                loop = dict(vectorize=False, fastMode=False, dtype=np.float64, precomputeHalves=True,
+                            precomputeNeghalves=(name == "AffineInvariant"))
+                numReference = min(numArrays, loopLimit)
+                start = time.perf_counter()
+                reference = utils.calculatePairwiseDistances(mats[:numReference], func, **common, **loop)
+                seconds = time.perf_counter() - start
+                if numArrays <= loopLimit: # The reference is the loop over the whole cohort, so report its time (and no error)
+                    params = {'dim': dim, 'subjects': numArrays, **{key: (np.dtype(val).name if key == 'dtype' else val) for key, val in loop.items()}}
+                    yield {'case': f"utils.calculatePairwiseDistances.{name}", 'params': params, 'seconds': seconds,
+                           'pairsPerSecond': numArrays * (numArrays + 1) / 2 / seconds}
+                offDiagonal = ~np.eye(numReference, dtype=bool)
+                variants = [dict(vectorize=True, fastMode=False, dtype=np.float64), dict(vectorize=True, fastMode=False, dtype=np.float32)]
+                if name in ("BuresDistance", "BuresAngle"):
+                    variants.append(dict(vectorize=True, fastMode=True, dtype=np.float64))
+                for variant in variants:
+                    value = utils.calculatePairwiseDistances(mats, func, **common, **variant)
+                    seconds = bestTime(lambda: utils.calculatePairwiseDistances(mats, func, **common, **variant))
+                    value = np.asarray(value, dtype=np.float64)[:numReference, :numReference]
+                    params = {'dim': dim, 'subjects': numArrays, **{key: (np.dtype(val).name if key == 'dtype' else val) for key, val in variant.items()}}
+                    yield {'case': f"utils.calculatePairwiseDistances.{name}", 'params': params, 'seconds': seconds,
+                           'pairsPerSecond': numArrays * (numArrays + 1) / 2 / seconds,
+                           'maxAbsError': float(np.nanmax(abs(value - reference)[offDiagonal]))}
+
+
+importStatements = ["import CorMat", "from CorMat import utils, distances", "import CorMat; CorMat.dtw",
+                    "import CorMat; CorMat.plots", "import CorMat; CorMat.gpu"]
+heavyModules = ["numba", "matplotlib", "torch"]
+importProbe = """import sys, json, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+maxRSS = None
+if sys.platform.startswith("linux"): # Peak RSS of this process image; ru_maxrss would include the parent's, inherited across exec
+    with open("/proc/self/status") as f:
+        maxRSS = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+elif sys.platform == "darwin":
+    import resource
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': seconds, 'maxRSS': maxRSS, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))"""
+
+
+def benchImport(repeat: int = 5, **_):
+    """Time (and peak memory) to import CorMat in a fresh interpreter, and to then touch each lazily imported part. Plain
+    "import CorMat" should load none of numba, matplotlib or torch; 'heavyModules' lists those that were loaded."""
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    for statement in importStatements:
+        code = importProbe.format(src=src, statement=statement, heavy=heavyModules)
+        runs = [json.loads(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+                for _ in range(repeat)]
+        best = min(runs, key=lambda run: run['seconds'])
+        if statement == "import CorMat" and best['loaded']:
+            print("Warning: import CorMat loaded", ", ".join(best['loaded']), file=sys.stderr)
+        yield {'case': "import", 'params': {'statement': statement}, 'seconds': best['seconds'], 'maxRSS': best['maxRSS'],
+               'heavyModules': best['loaded']}
+
+
+suites = {'distances': benchDistances, 'torch': benchTorchDistances, 'dtw': benchDTW, 'TStoCM': benchTStoCM, 'pairwise': benchPairwise,
+          'import': benchImport}
+
+
+def environment() -> dict:
+    """Commit, versions and machine details stored with every run."""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    versions = {'python': platform.python_version(), 'numpy': np.__version__}
+    for module in ("scipy", "numba", "torch"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return {'commit': commit, 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'versions': versions,
+            'machine': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def compare(oldPath: str, newPath: str):
+    """Prints the speed ratio of every case present in both result files."""
+    def load(path):
+        with open(path) as f:
+            return {(rec['suite'], rec['case'], json.dumps(rec['params'], sort_keys=True)): rec for rec in json.load(f)['results']}
+    old, new = load(oldPath), load(newPath)
+    for key in sorted(set(old) & set(new)):
+        ratio = old[key]['seconds'] / new[key]['seconds']
+        print(f"{ratio:8.2f}x  {key[1]}  {key[2]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", nargs="+", choices=list(suites), default=list(suites), help="Suites to run (default: all).")
+    parser.add_argument("--dims", nargs="+", type=int, help="Matrix dimensions (regions).")
+    parser.add_argument("--sizes", nargs="+", type=int, help="Cohort sizes.")
+    parser.add_argument("--lengths", nargs="+", type=int, help="DTW timeseries lengths.")
+    parser.add_argument("--loop-limit", type=int, default=40, help="Largest cohort timed with the pairwise loop (default: 40).")
+    parser.add_argument("--quick", action="store_true", help="Small sizes only.")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/<commit>-<time>.json).")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files instead of running.")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    settings = {'dims': args.dims or ([20, 90] if args.quick else [20, 90, 200, 400]),
+                'sizes': args.sizes or ([20] if args.quick else [20, 100, 400]),
+                'lengths': args.lengths or ([100] if args.quick else [100, 1000, 5000]),
+                'loopLimit': args.loop_limit}
+    env = environment()
+    results = []
+    for suite in args.suite:
+        for record in suites[suite](**settings):
+            record = {'suite': suite, **record}
+            results.append(record)
+            print(f"{record['seconds']:12.6f} s  {record['case']}  {json.dumps(record['params'])}", flush=True)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"{env['commit'][:10]}-{env['time'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({'environment': env, 'settings': settings, 'results': results}, f, indent=1)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    main()
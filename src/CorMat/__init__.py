@@ -1,14 +1,38 @@
-__all__ = ["__version__", "distances", "plots", "colors", "utils", "dtw", "gpu"] # What gets imported when using from _____ import *
+__all__ = ["__version__", "distances", "plots", "Plots", "colors", "utils", "dtw", "DTW", "gpu", "batched", "parallel", "checkpoint", "streaming", "storage", "landmarks", "neighbors", "progress", "cache"] # What gets imported when using from _____ import *
 # TODO: Fix the __version__ attribute. Not sure what is wrong with it
 
+import importlib
+
 # Use if files have classes inside; this imports as Object (from within files)
 # Allows access as CorMat.plots.Plots or as CorMat.Plots
 from .distances import distances
-from .plots import plots
 from .colors import colors
 from .utils import utils
-from .dtw import dtw
-from CorMat import gpu
+from .batched import batched
+from .parallel import parallel
+from .checkpoint import checkpoint
+from .streaming import streaming
+from .storage import storage
+from .landmarks import landmarks
+from .neighbors import neighbors
+from .progress import progress
+from .cache import cache
+
+# plots (matplotlib), dtw (numba) and gpu (torch) are slow to import, so they are only imported on first access.
+# CorMat.plots and CorMat.dtw are the submodules (importing them binds them on the package), and their classes are
+# CorMat.Plots and CorMat.DTW
+_lazyModules = ("plots", "dtw", "gpu")
+_lazyClasses = {"Plots": "plots", "DTW": "dtw"} # Class: submodule holding a class named after the submodule
+
+def __getattr__(name):
+    if name in _lazyModules:
+        return importlib.import_module("." + name, __name__)
+    if name in _lazyClasses:
+        return getattr(importlib.import_module("." + _lazyClasses[name], __name__), _lazyClasses[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazyModules) | set(_lazyClasses))
 
 ## This imports files as filename.Object
 # from CorMat import distances, plots, colors, utils, testModule
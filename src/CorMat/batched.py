@@ -0,0 +1,627 @@
+import time
+import numpy as np
+from typing import Callable, Iterable
+from CorMat.distances import distances
+from CorMat.storage import storage
+from CorMat.cache import cache
+from CorMat.progress import progress
+
+class batched():
+    """Vectorized engine behind CorMat.utils.calculatePairwiseDistances. Per-matrix quantities (square roots, etc.) are
+    computed once per matrix from a symmetric eigendecomposition and stacked into arrays. Pairs are then evaluated a
+    whole block at a time using stacked matmuls and batched LAPACK calls, rather than one Python call per pair.
+
+    Tolerance: for correlation matrices, off-diagonal results match the pairwise loop to roughly 1e-12 relative to the
+    matrix traces. Distances between (nearly) identical matrices, e.g. the diagonal, are the square root of a rounding-level
+    quantity in both implementations, so either may report values up to about sqrt(1e-16 * trace) there. The square roots here come from numpy's eigh (eigenvalues clipped at 0) rather than scipy's
+    fractional_matrix_power; this is also better behaved on rank-deficient correlation matrices, where the Schur
+    method can return small imaginary parts."""
+
+    blockMemory = 2**27 # Approximate number of bytes of stacked intermediates allowed per block of pairs
+    factorRatio = 0.9 # With useFactors="auto", Bures distances use thin factors when the numerical rank is at most this fraction of the dimension
+    rankTol = 10**-12 # Eigenvalues below rankTol times the largest are rounding error, for numericalRank and factors
+
+    def stack(Matrices: Iterable) -> np.ndarray:
+        """Stacks an iterable of equally-sized square matrices into a single (N, d, d) float array."""
+        if isinstance(Matrices, np.ndarray) and Matrices.ndim == 3:
+            return Matrices if Matrices.dtype == np.float64 else Matrices.astype(np.float64)
+        return np.asarray([np.asarray(mat) for mat in Matrices], dtype=np.float64)
+
+    def eigh(Matrices: Iterable):
+        """Symmetric eigendecomposition of every matrix in the stack. Input is symmetrized first to remove rounding asymmetry.
+
+        Returns:
+            (np.ndarray, np.ndarray): Eigenvalues of shape (N, d) and eigenvectors of shape (N, d, d).
+        """
+        mats = batched.stack(Matrices)
+        return np.linalg.eigh((mats + np.swapaxes(mats, -1, -2)) / 2)
+
+    def eigenFunction(evals: np.ndarray, evecs: np.ndarray, func: Callable) -> np.ndarray:
+        """Given stacked eigendecompositions, returns the stack of matrices V @ diag(func(w)) @ V^T."""
+        return (evecs * func(evals)[..., None, :]) @ np.swapaxes(evecs, -1, -2)
+
+    def sqrtm(Matrices: Iterable = None, evals: np.ndarray = None, evecs: np.ndarray = None) -> np.ndarray:
+        """Stacked principal square roots of symmetric PSD matrices. Negative eigenvalues (rounding error) are clipped to 0.
+        Supply either Matrices, or a precomputed eigendecomposition (evals, evecs)."""
+        if evals is None:
+            evals, evecs = batched.eigh(Matrices)
+        return batched.eigenFunction(evals, evecs, lambda w: np.sqrt(np.clip(w, 0, None)))
+
+    def invsqrtm(Matrices: Iterable = None, evals: np.ndarray = None, evecs: np.ndarray = None) -> np.ndarray:
+        """Stacked inverse principal square roots of symmetric positive definite matrices.
+        Supply either Matrices, or a precomputed eigendecomposition (evals, evecs)."""
+        if evals is None:
+            evals, evecs = batched.eigh(Matrices)
+        if np.any(evals <= 0):
+            raise ValueError('Inverse square root requires SPD matrices; found a non-positive eigenvalue.')
+        return batched.eigenFunction(evals, evecs, lambda w: 1 / np.sqrt(w))
+
+    def logm(Matrices: Iterable = None, evals: np.ndarray = None, evecs: np.ndarray = None) -> np.ndarray:
+        """Stacked principal matrix logarithms of symmetric positive definite matrices.
+        Supply either Matrices, or a precomputed eigendecomposition (evals, evecs)."""
+        if evals is None:
+            evals, evecs = batched.eigh(Matrices)
+        if np.any(evals <= 0):
+            raise ValueError('Matrix logarithm requires SPD matrices; found a non-positive eigenvalue.')
+        return batched.eigenFunction(evals, evecs, np.log)
+
+    decompositions = {'half': sqrtm, 'neghalf': invsqrtm, 'log': logm} # Per-matrix quantities derived from eigh, as stored by cachedDecompositions
+
+    def cachedDecompositions(Matrices: Iterable, names: Iterable, cacheDir: str, useFactors=False) -> dict:
+        """Stacked eigendecompositions ('evals', 'evecs') and the derived quantities in names (keys of batched.decompositions)
+        of every matrix, read from the persistent cache in cacheDir where present (see CorMat.cache). Whatever is missing is
+        computed, with one batched eigh over the matrices not yet cached, and stored; the cache is then trimmed to
+        cache.sizeLimit. 'half' is skipped when useFactors means prepare will use thin factors instead (see useFactorsFor)."""
+        mats = batched.stack(Matrices)
+        names = list(names)
+        keys = [cache.key(mat) for mat in mats]
+        entries = [cache.load(cacheDir, key, ['evals', 'evecs'] + names) for key in keys]
+        computed = [{} for _ in keys]
+        missing = [i for i, entry in enumerate(entries) if 'evals' not in entry or 'evecs' not in entry]
+        if missing:
+            evals, evecs = batched.eigh(mats[missing])
+            for k, i in enumerate(missing):
+                entries[i] = computed[i] = {'evals': evals[k], 'evecs': evecs[k]}
+        out = {'evals': np.stack([entry['evals'] for entry in entries]), 'evecs': np.stack([entry['evecs'] for entry in entries])}
+        if 'half' in names and batched.useFactorsFor(out['evals'], useFactors):
+            names.remove('half')
+        for name in names:
+            lacking = [i for i, entry in enumerate(entries) if name not in entry]
+            if lacking:
+                values = batched.decompositions[name](evals=out['evals'][lacking], evecs=out['evecs'][lacking])
+                for k, i in enumerate(lacking):
+                    entries[i][name] = computed[i][name] = values[k]
+            out[name] = np.stack([entry[name] for entry in entries])
+        for key, arrays in zip(keys, computed):
+            if arrays:
+                cache.store(cacheDir, key, arrays)
+        if any(computed):
+            cache.evict(cacheDir)
+        return out
+
+    def numericalRank(evals: np.ndarray, tol: float = None) -> np.ndarray:
+        """Per-matrix numerical ranks from stacked eigenvalues: the number above tol (default: rankTol) times the largest."""
+        tol = tol if tol is not None else batched.rankTol
+        return np.sum(evals > tol * np.max(evals, axis=-1, keepdims=True), axis=-1)
+
+    def useFactorsFor(evals: np.ndarray, useFactors=False) -> bool:
+        """Whether prepare replaces square roots with thin factors, given the eigenvalues of every matrix: always with
+        useFactors=True, and with "auto" only if the largest numerical rank is at most factorRatio times the dimension."""
+        if not useFactors:
+            return False
+        rank = max(1, int(np.max(batched.numericalRank(evals))))
+        return useFactors != "auto" or rank <= batched.factorRatio * evals.shape[-1]
+
+    def factors(Matrices: Iterable = None, evals: np.ndarray = None, evecs: np.ndarray = None, rank: int = None) -> np.ndarray:
+        """Stacked thin factors F, with F @ F^T equal to each PSD matrix: the leading rank eigenvectors, scaled by the square
+        roots of their eigenvalues. rank defaults to the largest numerical rank in the stack, so for lower-rank matrices the
+        extra columns are (close to) 0. Supply either Matrices, or a precomputed eigendecomposition (evals, evecs).
+
+        Returns:
+            np.ndarray: Factors of shape (N, d, rank).
+        """
+        if evals is None:
+            evals, evecs = batched.eigh(Matrices)
+        rank = rank if rank is not None else max(1, int(np.max(batched.numericalRank(evals))))
+        return evecs[..., -rank:] * np.sqrt(np.clip(evals[..., None, -rank:], 0, None))
+
+    def stackFactors(Factors: Iterable) -> np.ndarray:
+        """Stacks thin factors (d x r_i arrays, e.g. from utils.batchTStoFactors) into one (N, d, max r_i) array, padding
+        narrower ones with columns of zeros, which do not change F @ F^T. Factors wider than d are replaced by the d x d
+        factors R^T from QR decompositions of their transposes, so no factor is wider than the matrices."""
+        if isinstance(Factors, np.ndarray):
+            out = np.asarray(Factors, dtype=np.float64)
+        else:
+            Factors = [np.asarray(F, dtype=np.float64) for F in Factors]
+            out = np.zeros((len(Factors), Factors[0].shape[0], max(F.shape[1] for F in Factors)))
+            for i, F in enumerate(Factors):
+                out[i, :, :F.shape[1]] = F
+        if out.shape[2] > out.shape[1]: # F^T = QR gives F F^T = R^T R
+            out = np.swapaxes(np.linalg.qr(np.swapaxes(out, 1, 2), mode='r'), 1, 2)
+        return out
+
+    def autoBlockSize(dim: int, copies: int = 3, memory: int = None) -> int:
+        """Number of rows (and columns) per block such that a block of stacked dim x dim intermediates fits in memory bytes
+        (defaults to blockMemory). Use copies=0 for distances which need only a few scalars per pair (e.g. those computed from a Gram matrix)."""
+        memory = memory if memory is not None else batched.blockMemory
+        bytesPerPair = max(copies * dim * dim, 4) * 8
+        return max(1, int(np.sqrt(memory / bytesPerPair)))
+
+    def tiles(numArrays: int, blockSize: int, assumeDistIsSymmetric: bool = False):
+        """Yields (rows, cols) pairs of slices covering the pairwise matrix, or only its lower triangle if assumeDistIsSymmetric."""
+        for rowStart in range(0, numArrays, blockSize):
+            rows = slice(rowStart, min(rowStart + blockSize, numArrays))
+            colStop = rows.stop if assumeDistIsSymmetric else numArrays
+            for colStart in range(0, colStop, blockSize):
+                yield rows, slice(colStart, min(colStart + blockSize, colStop))
+
+    def RootBuresFidelityBlock(Ahalfs: np.ndarray, Bhalfs: np.ndarray, fastMode: bool = False) -> np.ndarray:
+        """Block version of distances.faster_RootBuresFidelity; returns an (len(Ahalfs), len(Bhalfs)) array."""
+        return batched.rootFidelities(Ahalfs[:, None] @ Bhalfs[None, :], fastMode=fastMode)
+
+    def rootFidelities(mats: np.ndarray, fastMode: bool = False) -> np.ndarray:
+        """Root Bures fidelities from a stack of products A^(1/2) B^(1/2) (or F^T G), of any leading shape."""
+        if not fastMode:
+            return np.sum(np.linalg.svd(mats, compute_uv=False), axis=-1)
+        matsT = np.swapaxes(mats, -1, -2)
+        val = np.sum(np.abs(np.linalg.eigvalsh(mats @ matsT))**(1/2), axis=-1)
+        val += np.sum(np.abs(np.linalg.eigvalsh(matsT @ mats))**(1/2), axis=-1) # Average with other direction, as in the pairwise version
+        return val / 2
+
+    def fidelityBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> np.ndarray:
+        """Root Bures fidelities of a tile, from square roots ('half'), or from thin factors ('factor'): for A = F F^T and
+        B = G G^T, the singular values of F^T G are those of A^(1/2) B^(1/2), so only rank x rank products are decomposed."""
+        if 'factor' in feats:
+            return batched.RootBuresFidelityBlock(np.swapaxes(feats['factor'][rows], -1, -2), feats['factor'][cols], fastMode=fastMode)
+        return batched.RootBuresFidelityBlock(feats['half'][rows], feats['half'][cols], fastMode=fastMode)
+
+    def BuresDistanceBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False, zero_tol: float = 10**-10,
+                           fidelity: np.ndarray = None) -> np.ndarray:
+        """Block version of distances.BuresDistance. The tile's fidelities are computed unless already given."""
+        if fidelity is None:
+            fidelity = batched.fidelityBlock(feats, rows, cols, fastMode=fastMode)
+        return batched.buresFromFidelity(feats['trace'][rows, None] + feats['trace'][None, cols], fidelity, fastMode=fastMode,
+                                         zero_tol=zero_tol)
+
+    def buresFromFidelity(traceSums: np.ndarray, fidelity: np.ndarray, fastMode: bool = False, zero_tol: float = 10**-10) -> np.ndarray:
+        """Bures distances sqrt(tr A + tr B - 2 F) from the trace sums and root fidelities F, as in distances.BuresDistance."""
+        val = traceSums - 2 * fidelity
+        tol = 10**6 * zero_tol if fastMode else zero_tol
+        if np.any(val < -tol):
+            raise ValueError('Invalid value encountered in Bures distance.')
+        return np.sqrt(np.clip(val, 0, None))
+
+    def BuresAngleBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False, fidelity: np.ndarray = None) -> np.ndarray:
+        """Block version of distances.BuresAngle. The tile's fidelities are computed unless already given."""
+        if fidelity is None:
+            fidelity = batched.fidelityBlock(feats, rows, cols, fastMode=fastMode)
+        return np.arccos(fidelity)
+
+    def GramDistanceBlock(flats: np.ndarray, normsSq: np.ndarray, rows: slice, cols: slice) -> np.ndarray:
+        """Frobenius distances between flattened matrices, via ||X - Y||^2 = ||X||^2 + ||Y||^2 - 2<X, Y>.
+        Rounding in this expansion is on the order of 1e-16 * ||X||^2, so values are clipped at 0 and an exact 0 is
+        returned wherever a matrix is compared with itself."""
+        val = normsSq[rows, None] + normsSq[None, cols] - 2 * (flats[rows] @ flats[cols].T)
+        block = np.sqrt(np.clip(val, 0, None))
+        rowIdx, colIdx = np.arange(rows.start, rows.stop), np.arange(cols.start, cols.stop)
+        block[rowIdx[:, None] == colIdx[None, :]] = 0
+        return block
+
+    def EuclideanBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> np.ndarray:
+        """Block version of distances.Euclidean."""
+        return batched.GramDistanceBlock(feats['flat'], feats['normSq'], rows, cols)
+
+    def LogFrobeniusBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> np.ndarray:
+        """Block version of distances.LogFrobenius (the Log-Euclidean distance)."""
+        return batched.GramDistanceBlock(feats['logFlat'], feats['logNormSq'], rows, cols)
+
+    def AffineInvariantBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> np.ndarray:
+        """Block version of distances.AffineInvariant. The eigenvalues of A^(-1/2) B A^(-1/2) are the generalized eigenvalues
+        of (B, A), so ||logm(A^(-1/2) B A^(-1/2))|| is the root-sum-square of their logs; a batched eigvalsh replaces logm."""
+        neghalfs = feats['neghalf'][rows, None]
+        return batched.affineInvariantFrom(neghalfs @ feats['mats'][None, cols] @ neghalfs)
+
+    def affineInvariantFrom(congruences: np.ndarray) -> np.ndarray:
+        """AffineInvariant distances from a stack of products A^(-1/2) B A^(-1/2), of any leading shape."""
+        evals = np.linalg.eigvalsh(congruences)
+        if np.any(evals <= 0):
+            raise ValueError('Invalid value encountered in AffineInvariant distance; inputs must be SPD.')
+        return np.sqrt(np.sum(np.log(evals)**2, axis=-1))
+
+    # Vectorized block implementations of the pairwise distances in CorMat.distances, along with the per-matrix quantities they need
+    blockFunctions = {distances.BuresDistance: BuresDistanceBlock,
+                      distances.BuresAngle: BuresAngleBlock,
+                      distances.Euclidean: EuclideanBlock,
+                      distances.LogFrobenius: LogFrobeniusBlock,
+                      distances.AffineInvariant: AffineInvariantBlock}
+    requirements = {distances.BuresDistance: ('half', 'trace'),
+                    distances.BuresAngle: ('half',),
+                    distances.Euclidean: ('flat', 'normSq'),
+                    distances.LogFrobenius: ('logFlat', 'logNormSq'),
+                    distances.AffineInvariant: ('neghalf',)}
+    pairIntermediates = {distances.Euclidean: 0, distances.LogFrobenius: 0} # dim x dim arrays held per pair, if not the default of 3
+    fidelityDistances = (distances.BuresDistance, distances.BuresAngle) # Computed from the root fidelity, so they accept Factors and share fidelityBlock
+
+    def supports(distance: Callable) -> bool:
+        """True if the distance has a vectorized block implementation."""
+        return distance in batched.blockFunctions
+
+    def prepare(Matrices: Iterable, required: Iterable, Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                useFactors=False, cacheDir: str = None) -> dict:
+        """Computes the stacked per-matrix quantities named in <required>, sharing a single eigendecomposition between them.
+        Supplied precomputations (Mats_half, Mats_neghalf) are used as-is instead of being recomputed.
+        With useFactors=True, a required 'half' is replaced by thin 'factor's (see factors); with "auto", only if the largest
+        numerical rank is at most factorRatio times the dimension, as for correlation matrices of short timeseries.
+        With cacheDir, eigendecompositions, square roots, inverse square roots and logarithms are read from (and added to)
+        the persistent cache in that folder; see cachedDecompositions."""
+        mats = batched.stack(Matrices)
+        numArrays = mats.shape[0]
+        feats = {'mats': mats}
+        needsEigh = (('half' in required and Mats_half is None) or ('neghalf' in required and Mats_neghalf is None)
+                     or 'logFlat' in required or 'factor' in required)
+        cached = {}
+        if needsEigh and cacheDir is not None:
+            derived = [name for name, needed in (('half', 'half' in required and Mats_half is None),
+                                                 ('neghalf', 'neghalf' in required and Mats_neghalf is None),
+                                                 ('log', 'logFlat' in required)) if needed]
+            cached = batched.cachedDecompositions(mats, derived, cacheDir, useFactors=useFactors)
+            evals, evecs = cached['evals'], cached['evecs']
+        else:
+            evals, evecs = batched.eigh(mats) if needsEigh else (None, None)
+        if 'half' in required and Mats_half is None and batched.useFactorsFor(evals, useFactors):
+            required = ['factor' if name == 'half' else name for name in required]
+        if 'trace' in required:
+            feats['trace'] = np.trace(mats, axis1=-2, axis2=-1)
+        if 'factor' in required:
+            feats['factor'] = batched.factors(evals=evals, evecs=evecs)
+        if 'half' in required:
+            if Mats_half is not None:
+                feats['half'] = batched.stack(Mats_half)
+            else:
+                feats['half'] = cached['half'] if 'half' in cached else batched.sqrtm(evals=evals, evecs=evecs)
+        if 'neghalf' in required:
+            if Mats_neghalf is not None:
+                feats['neghalf'] = batched.stack(Mats_neghalf)
+            else:
+                feats['neghalf'] = cached['neghalf'] if 'neghalf' in cached else batched.invsqrtm(evals=evals, evecs=evecs)
+        if 'flat' in required:
+            feats['flat'] = mats.reshape(numArrays, -1)
+            feats['normSq'] = np.sum(feats['flat']**2, axis=1)
+        if 'logFlat' in required:
+            logs = cached['log'] if 'log' in cached else batched.logm(evals=evals, evecs=evecs)
+            feats['logFlat'] = logs.reshape(numArrays, -1)
+            feats['logNormSq'] = np.sum(feats['logFlat']**2, axis=1)
+        return feats
+
+    def prepareFor(distance: Callable, Matrices: Iterable, Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                   cacheDir: str = None) -> dict:
+        """Per-matrix inputs for evaluateTile. Distances with a block implementation get their stacked requirements (see prepare);
+        any other callable gets the matrices (and any supplied halves) as given, since they may not be stackable, e.g. timeseries for DTW."""
+        if batched.supports(distance):
+            return batched.prepare(Matrices, batched.requirements[distance], Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                   cacheDir=cacheDir)
+        feats = {'mats': Matrices}
+        if Mats_half is not None:
+            feats['half'] = Mats_half
+        if Mats_neghalf is not None:
+            feats['neghalf'] = Mats_neghalf
+        return feats
+
+    def pairLoopBlock(distance: Callable, feats: dict, rows: slice, cols: slice, fastMode: bool = False,
+                      DTWfeatureDist: Callable = None, assumeDistIsSymmetric: bool = False) -> np.ndarray:
+        """Fallback for distances without a block implementation; calls distance once per pair in the tile with the same inputs
+        as the pairwise loop in CorMat.utils.calculatePairwiseDistances. On a diagonal tile with assumeDistIsSymmetric, only
+        the lower triangle is evaluated."""
+        Mats, Mats_half, Mats_neghalf = feats['mats'], feats.get('half'), feats.get('neghalf')
+        block = np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=float)
+        for i in range(rows.start, rows.stop):
+            Ahalf = Mats_half[i] if Mats_half is not None else None
+            A_neghalf = Mats_neghalf[i] if Mats_neghalf is not None else None
+            colStop = min(cols.stop, i + 1) if assumeDistIsSymmetric else cols.stop
+            for j in range(cols.start, colStop):
+                Bhalf = Mats_half[j] if Mats_half is not None else None
+                block[i - rows.start, j - cols.start] = distance(Mats[i], Mats[j], Ahalf=Ahalf, Bhalf=Bhalf, A_neghalf=A_neghalf,
+                                                                 DTWfeatureDist=DTWfeatureDist, fastMode=fastMode)
+        return block
+
+    def evaluateTile(distance: Callable, feats: dict, rows: slice, cols: slice, fastMode: bool = False,
+                     DTWfeatureDist: Callable = None, assumeDistIsSymmetric: bool = False) -> np.ndarray:
+        """Distances between matrices[rows] and matrices[cols], using the block implementation of distance if one exists.
+        On a diagonal tile with assumeDistIsSymmetric, the lower triangle is mirrored into the upper, as in the pairwise loop."""
+        if batched.supports(distance):
+            block = batched.blockFunctions[distance](feats, rows, cols, fastMode=fastMode)
+        else:
+            block = batched.pairLoopBlock(distance, feats, rows, cols, fastMode=fastMode, DTWfeatureDist=DTWfeatureDist,
+                                          assumeDistIsSymmetric=assumeDistIsSymmetric)
+        if assumeDistIsSymmetric and rows == cols:
+            block = np.tril(block) + np.tril(block, -1).T
+        return block
+
+    def evaluatePairs(distance: Callable, feats: dict, first: np.ndarray, second: np.ndarray, fastMode: bool = False,
+                      DTWfeatureDist: Callable = None, blockSize: int = None) -> np.ndarray:
+        """Distances between matrices[first[k]] and matrices[second[k]] for every k: scattered entries of the pairwise matrix,
+        evaluated blockSize pairs at a time (default: as many as one square tile) as in the block implementations, rather
+        than as 1 x 1 tiles. Distances without a block implementation are called once per pair, as in pairLoopBlock."""
+        first, second = np.asarray(first, dtype=int), np.asarray(second, dtype=int)
+        blockSize = blockSize if blockSize is not None else batched.defaultBlockSize(distance, feats) ** 2
+        if len(first) > blockSize:
+            return np.concatenate([batched.evaluatePairs(distance, feats, first[start:start + blockSize], second[start:start + blockSize],
+                                                         fastMode=fastMode, DTWfeatureDist=DTWfeatureDist, blockSize=blockSize)
+                                   for start in range(0, len(first), blockSize)])
+        if distance in batched.fidelityDistances:
+            if 'factor' in feats:
+                fidelity = batched.rootFidelities(np.swapaxes(feats['factor'][first], -1, -2) @ feats['factor'][second], fastMode=fastMode)
+            else:
+                fidelity = batched.rootFidelities(feats['half'][first] @ feats['half'][second], fastMode=fastMode)
+            if distance == distances.BuresAngle:
+                return np.arccos(fidelity)
+            return batched.buresFromFidelity(feats['trace'][first] + feats['trace'][second], fidelity, fastMode=fastMode)
+        if distance in (distances.Euclidean, distances.LogFrobenius):
+            flats = feats['flat'] if distance == distances.Euclidean else feats['logFlat']
+            dists = np.linalg.norm(flats[first] - flats[second], axis=1)
+            dists[first == second] = 0
+            return dists
+        if distance == distances.AffineInvariant:
+            return batched.affineInvariantFrom(feats['neghalf'][first] @ feats['mats'][second] @ feats['neghalf'][first])
+        Mats, Mats_half, Mats_neghalf = feats['mats'], feats.get('half'), feats.get('neghalf')
+        return np.array([distance(Mats[i], Mats[j], Ahalf=Mats_half[i] if Mats_half is not None else None,
+                                  Bhalf=Mats_half[j] if Mats_half is not None else None,
+                                  A_neghalf=Mats_neghalf[i] if Mats_neghalf is not None else None,
+                                  DTWfeatureDist=DTWfeatureDist, fastMode=fastMode) for i, j in zip(first, second)], dtype=float)
+
+    def writeTile(pairwiseDists: np.ndarray, rows: slice, cols: slice, block: np.ndarray, assumeDistIsSymmetric: bool = False):
+        """Stores a tile from evaluateTile in the pairwise matrix, mirroring it across the diagonal if assumeDistIsSymmetric.
+        A 1-D pairwiseDists is taken to be in the condensed layout of CorMat.storage."""
+        if pairwiseDists.ndim == 1:
+            storage.writeCondensedTile(pairwiseDists, rows, cols, block)
+            return
+        pairwiseDists[rows, cols] = block
+        if assumeDistIsSymmetric:
+            pairwiseDists[cols, rows] = block.T
+
+    def defaultBlockSize(distance: Callable, feats: dict, memory: int = None) -> int:
+        """Tile size from autoBlockSize for distances with a block implementation; small tiles for per-pair fallbacks."""
+        if not batched.supports(distance):
+            return 16
+        if 'factor' in feats: # Per-pair intermediates are rank x rank
+            return batched.autoBlockSize(feats['factor'].shape[-1], memory=memory)
+        return batched.autoBlockSize(feats['mats'].shape[-1], copies=batched.pairIntermediates.get(distance, 3), memory=memory)
+
+    def calculatePairwiseDistances(Matrices: Iterable, distance: Callable, Mats_half: Iterable = None,
+                                   Mats_neghalf: Iterable = None, fastMode: bool = False, assumeDistIsSymmetric: bool = False,
+                                   blockSize: int = None, silent: bool = False,
+                                   outputFormat: str = "square", dtype=np.float64,
+                                   reporter: Callable = None, profile: int = 0,
+                                   Factors: Iterable = None, useFactors="auto", cacheDir: str = None) -> np.ndarray:
+        """Vectorized equivalent of CorMat.utils.calculatePairwiseDistances for distances with a block implementation
+        (see batched.supports). Square roots and logarithms are computed once per matrix, then the pairwise matrix is
+        filled one blockSize x blockSize tile at a time. For LogFrobenius and Euclidean, each tile is a single Gram
+        matrix product of the flattened (log-)matrices; for AffineInvariant, it is one batched generalized eigenvalue problem.
+
+        Args:
+            Matrices (Iterable): Equally-sized symmetric matrices.
+            distance (Callable): A distance from CorMat.distances with an entry in batched.blockFunctions.
+            Mats_half (Iterable, optional): Precomputed square roots of Matrices. Computed via eigh if None and required.
+            Mats_neghalf (Iterable, optional): Precomputed inverse square roots of Matrices. Computed via eigh if None and required.
+            fastMode (bool, optional): Same meaning as in CorMat.distances. Defaults to False.
+            assumeDistIsSymmetric (bool, optional): Only evaluate the lower triangle and mirror it. Defaults to False.
+            blockSize (int, optional): Rows/columns per tile. Defaults to a size chosen from batched.blockMemory.
+            silent (bool, optional): Suppress progress printing. Defaults to False.
+            outputFormat (str, optional): "square", or "condensed" (requires assumeDistIsSymmetric); see CorMat.storage. Defaults to "square".
+            dtype (optional): dtype of the result, e.g. np.float32 to halve its size. Defaults to np.float64.
+            reporter (Callable, optional): Receives progress reports; see CorMat.progress. Defaults to printing unless silent.
+            profile (int, optional): Number of slowest tiles to record in the final report. Defaults to 0.
+            Factors (Iterable, optional): For BuresDistance and BuresAngle only: thin factors F of the matrices (A = F F^T),
+                                          e.g. standardized timeseries from utils.batchTStoFactors, used instead of Matrices
+                                          (which may then be None). No square roots are formed; each pair costs one SVD of
+                                          a rank x rank product, where rank is the widest factor. See batched.fidelityBlock.
+            useFactors (bool or str, optional): Whether to factor Matrices for BuresDistance and BuresAngle instead of taking
+                                                square roots; "auto" does so when they are rank-deficient. See prepare. Defaults to "auto".
+            cacheDir (str, optional): Folder of the persistent cache of per-matrix decompositions (see CorMat.cache), so
+                                      repeated runs on the same matrices, with this or another distance, skip them.
+
+        Returns:
+            np.ndarray: An N x N matrix of pairwise distances, or its condensed form.
+        """
+        if not batched.supports(distance):
+            raise ValueError(f"No vectorized implementation exists for distance: {getattr(distance, '__name__', distance)}")
+        if Factors is not None and distance not in batched.fidelityDistances:
+            raise ValueError("Factors can only be used with BuresDistance and BuresAngle.")
+        numArrays = len(Factors) if Factors is not None else len(Matrices)
+        tracker = progress.start(progress.totalPairs(numArrays, assumeDistIsSymmetric), reporter=reporter, silent=silent, profile=profile)
+        if Factors is not None:
+            factorStack = batched.stackFactors(Factors)
+            feats = {'factor': factorStack, 'trace': np.sum(factorStack**2, axis=(1, 2))}
+        else:
+            feats = batched.prepare(Matrices, batched.requirements[distance], Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                    useFactors=useFactors, cacheDir=cacheDir)
+        if blockSize is None:
+            blockSize = batched.defaultBlockSize(distance, feats)
+        pairwiseDists = storage.allocate(numArrays, outputFormat, dtype=dtype, assumeDistIsSymmetric=assumeDistIsSymmetric)
+        progress.stage(tracker, 'pairs')
+        for rows, cols in batched.tiles(numArrays, blockSize, assumeDistIsSymmetric):
+            tileStart = time.perf_counter() if tracker is not None else None
+            block = batched.evaluateTile(distance, feats, rows, cols, fastMode=fastMode, assumeDistIsSymmetric=assumeDistIsSymmetric)
+            batched.writeTile(pairwiseDists, rows, cols, block, assumeDistIsSymmetric)
+            if tracker is not None:
+                progress.update(tracker, progress.tilePairs(rows, cols, assumeDistIsSymmetric), rows, cols, time.perf_counter() - tileStart)
+        progress.finish(tracker)
+        return pairwiseDists
+
+    def evaluateTiles(distanceList: Iterable, feats: dict, rows: slice, cols: slice, fastMode: bool = False,
+                      assumeDistIsSymmetric: bool = False) -> dict:
+        """evaluateTile for several distances with block implementations at once, from features prepared for all of them.
+        When more than one of them is computed from the root fidelity (see fidelityDistances), the tile's fidelities are
+        computed once and shared.
+
+        Returns:
+            dict: The tile of each distance, keyed by distance.
+        """
+        shared = {}
+        if sum(distance in batched.fidelityDistances for distance in distanceList) > 1:
+            shared['fidelity'] = batched.fidelityBlock(feats, rows, cols, fastMode=fastMode)
+        blocks = {}
+        for distance in distanceList:
+            kwargs = shared if distance in batched.fidelityDistances else {}
+            block = batched.blockFunctions[distance](feats, rows, cols, fastMode=fastMode, **kwargs)
+            if assumeDistIsSymmetric and rows == cols:
+                block = np.tril(block) + np.tril(block, -1).T
+            blocks[distance] = block
+        return blocks
+
+    def calculateMultiplePairwiseDistances(Matrices: Iterable, distanceList: Iterable, Mats_half: Iterable = None,
+                                           Mats_neghalf: Iterable = None, fastMode: bool = False,
+                                           assumeDistIsSymmetric: bool = False, blockSize: int = None, silent: bool = False,
+                                           outputFormat: str = "square", dtype=np.float64,
+                                           reporter: Callable = None, profile: int = 0,
+                                           Factors: Iterable = None, useFactors="auto", cacheDir: str = None) -> dict:
+        """calculatePairwiseDistances for several distances in a single pass. The per-matrix quantities all of them need
+        come from one eigendecomposition of each matrix (see prepare), and each tile is evaluated for every distance
+        before moving on, sharing the root fidelities between BuresDistance and BuresAngle (see evaluateTiles).
+
+        Args:
+            Matrices (Iterable): Equally-sized symmetric matrices.
+            distanceList (Iterable): Distances from CorMat.distances with an entry in batched.blockFunctions.
+            Factors (Iterable, optional): Thin factors of the matrices, used instead of Matrices; only if every distance is
+                                          in batched.fidelityDistances.
+            blockSize (int, optional): Rows/columns per tile. Defaults to the smallest of the distances' default sizes.
+            Other inputs are as in batched.calculatePairwiseDistances, and apply to every distance.
+
+        Returns:
+            dict: The pairwise matrix (or its condensed form) of each distance, keyed by distance.
+        """
+        distanceList = list(dict.fromkeys(distanceList))
+        unsupported = [getattr(distance, '__name__', distance) for distance in distanceList if not batched.supports(distance)]
+        if unsupported:
+            raise ValueError(f"No vectorized implementation exists for distances: {unsupported}")
+        if Factors is not None and any(distance not in batched.fidelityDistances for distance in distanceList):
+            raise ValueError("Factors can only be used with BuresDistance and BuresAngle.")
+        numArrays = len(Factors) if Factors is not None else len(Matrices)
+        tracker = progress.start(progress.totalPairs(numArrays, assumeDistIsSymmetric), reporter=reporter, silent=silent, profile=profile)
+        if Factors is not None:
+            factorStack = batched.stackFactors(Factors)
+            feats = {'factor': factorStack, 'trace': np.sum(factorStack**2, axis=(1, 2))}
+        else:
+            required = list(dict.fromkeys(name for distance in distanceList for name in batched.requirements[distance]))
+            feats = batched.prepare(Matrices, required, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                    useFactors=useFactors, cacheDir=cacheDir)
+        if blockSize is None:
+            blockSize = min(batched.defaultBlockSize(distance, feats) for distance in distanceList)
+        results = {distance: storage.allocate(numArrays, outputFormat, dtype=dtype, assumeDistIsSymmetric=assumeDistIsSymmetric)
+                   for distance in distanceList}
+        progress.stage(tracker, 'pairs')
+        for rows, cols in batched.tiles(numArrays, blockSize, assumeDistIsSymmetric):
+            tileStart = time.perf_counter() if tracker is not None else None
+            blocks = batched.evaluateTiles(distanceList, feats, rows, cols, fastMode=fastMode, assumeDistIsSymmetric=assumeDistIsSymmetric)
+            for distance, block in blocks.items():
+                batched.writeTile(results[distance], rows, cols, block, assumeDistIsSymmetric)
+            if tracker is not None:
+                progress.update(tracker, progress.tilePairs(rows, cols, assumeDistIsSymmetric), rows, cols, time.perf_counter() - tileStart)
+        progress.finish(tracker)
+        return results
+
+    def appendTiles(numOld: int, numArrays: int, blockSize: int, assumeDistIsSymmetric: bool = False):
+        """Yields the (rows, cols) tiles covering every pair that involves at least one of the matrices numOld..numArrays-1."""
+        for rowStart in range(numOld, numArrays, blockSize):
+            rows = slice(rowStart, min(rowStart + blockSize, numArrays))
+            colStop = rows.start if assumeDistIsSymmetric else numArrays
+            for colStart in range(0, colStop, blockSize):
+                yield rows, slice(colStart, min(colStart + blockSize, colStop))
+            if assumeDistIsSymmetric: # Tiles must not straddle the diagonal, other than diagonal tiles themselves
+                yield rows, rows
+        if not assumeDistIsSymmetric: # Old rows against new columns
+            for rowStart in range(0, numOld, blockSize):
+                rows = slice(rowStart, min(rowStart + blockSize, numOld))
+                for colStart in range(numOld, numArrays, blockSize):
+                    yield rows, slice(colStart, min(colStart + blockSize, numArrays))
+
+    def checkFeatures(feats: dict, Matrices: Iterable, required: Iterable, numSamples: int = 4, rtol: float = 10**-6, seed: int = 0):
+        """Checks that stored per-matrix quantities (from prepare) belong to Matrices: the counts must agree, and for a random
+        sample of numSamples matrices, the stored matrix and every stored quantity must match a fresh computation to within
+        rtol (relative Frobenius error).
+
+        Raises:
+            ValueError: On any mismatch.
+        """
+        numArrays = len(Matrices)
+        for name, arr in feats.items():
+            if len(arr) != numArrays:
+                raise ValueError(f"Stored '{name}' has {len(arr)} entries, but there are {numArrays} existing matrices.")
+        sample = np.random.default_rng(seed).choice(numArrays, size=min(numSamples, numArrays), replace=False)
+        fresh = batched.prepare([Matrices[idx] for idx in sample], required)
+        for name, arr in fresh.items():
+            if name not in feats:
+                continue
+            stored = np.asarray([np.asarray(feats[name][idx]) for idx in sample], dtype=np.float64)
+            err = np.linalg.norm((stored - arr).reshape(len(sample), -1), axis=1)
+            scale = np.maximum(np.linalg.norm(arr.reshape(len(sample), -1), axis=1), 1)
+            if np.any(err > rtol * scale):
+                raise ValueError(f"Stored '{name}' does not match the existing matrices (subject {sample[np.argmax(err / scale)]}).")
+
+    def appendPairwiseDistances(pairwiseDists: np.ndarray, Matrices: Iterable, newMatrices: Iterable, distance: Callable,
+                                feats: dict = None, Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                                DTWfeatureDist: Callable = None, fastMode: bool = False, assumeDistIsSymmetric: bool = False,
+                                blockSize: int = None, checkSamples: int = 4, filename: str = None, silent: bool = False,
+                                reporter: Callable = None, profile: int = 0):
+        """Grows an existing pairwise distance matrix by a batch of new matrices, evaluating only the pairs that involve a
+        new matrix; O(N*k) distances for k additions to N existing matrices.
+
+        Args:
+            pairwiseDists (np.ndarray): Existing N x N result, or its condensed form (see CorMat.storage); may be an np.memmap.
+            Matrices (Iterable): The N existing matrices, in the order used for pairwiseDists.
+            newMatrices (Iterable): The k matrices to add.
+            distance (Callable): The distance used for pairwiseDists.
+            feats (dict, optional): Stored per-matrix quantities of the existing matrices, as returned by prepare (or by a
+                                    previous call of this function). Computed from Matrices (and Mats_half, Mats_neghalf) if None.
+            checkSamples (int, optional): Number of existing matrices on which the stored quantities are verified against a
+                                          fresh computation (see checkFeatures); 0 skips the check. Defaults to 4.
+            filename (str, optional): Write the grown result to this .npy file as an np.memmap instead of to memory.
+            Other inputs are as in calculatePairwiseDistances.
+
+        Returns:
+            (np.ndarray, dict): The (N+k) x (N+k) result, in the same layout and dtype as pairwiseDists, and the per-matrix
+            quantities of all N+k matrices, to store for the next append.
+        """
+        numOld, numNew = len(Matrices), len(newMatrices)
+        numArrays = numOld + numNew
+        newPairs = progress.totalPairs(numArrays, assumeDistIsSymmetric) - progress.totalPairs(numOld, assumeDistIsSymmetric)
+        tracker = progress.start(newPairs, reporter=reporter, silent=silent, profile=profile)
+        outputFormat = "condensed" if pairwiseDists.ndim == 1 else "square"
+        if pairwiseDists.shape != storage.outputShape(numOld, outputFormat):
+            raise ValueError(f"pairwiseDists has shape {pairwiseDists.shape}, which does not match {numOld} existing matrices.")
+        if batched.supports(distance):
+            required = batched.requirements[distance]
+            if feats is None:
+                feats = batched.prepare(Matrices, required, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf)
+            elif checkSamples > 0:
+                batched.checkFeatures(feats, Matrices, required, numSamples=checkSamples)
+            newFeats = batched.prepare(newMatrices, required)
+            feats = {name: np.concatenate([np.asarray(feats[name]), newFeats[name]]) for name in newFeats}
+        else:
+            feats = feats if feats is not None else batched.prepareFor(distance, Matrices, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf)
+            if 'half' in feats or 'neghalf' in feats:
+                raise ValueError(f"Per-matrix quantities for the new matrices cannot be derived for {getattr(distance, '__name__', distance)}; "
+                                 "recompute them and use calculatePairwiseDistances instead.")
+            feats = {'mats': list(feats['mats']) + list(newMatrices)}
+
+        out = storage.allocate(numArrays, outputFormat, dtype=pairwiseDists.dtype, assumeDistIsSymmetric=True, filename=filename)
+        if outputFormat == "square":
+            for start in range(0, numOld, 256):
+                stop = min(start + 256, numOld)
+                out[start:stop, :numOld] = pairwiseDists[start:stop]
+        else:
+            for i in range(numOld - 1): # Row i's upper-triangle segment keeps its start, and grows by numNew entries
+                oldStart, newStart = storage.condensedIndex(i, i + 1, numOld), storage.condensedIndex(i, i + 1, numArrays)
+                out[newStart:newStart + numOld - i - 1] = pairwiseDists[oldStart:oldStart + numOld - i - 1]
+        if blockSize is None:
+            blockSize = batched.defaultBlockSize(distance, feats)
+        progress.stage(tracker, 'pairs')
+        for rows, cols in batched.appendTiles(numOld, numArrays, blockSize, assumeDistIsSymmetric):
+            tileStart = time.perf_counter() if tracker is not None else None
+            block = batched.evaluateTile(distance, feats, rows, cols, fastMode=fastMode, DTWfeatureDist=DTWfeatureDist,
+                                         assumeDistIsSymmetric=assumeDistIsSymmetric)
+            batched.writeTile(out, rows, cols, block, assumeDistIsSymmetric)
+            if tracker is not None:
+                progress.update(tracker, progress.tilePairs(rows, cols, assumeDistIsSymmetric), rows, cols, time.perf_counter() - tileStart)
+        progress.finish(tracker)
+        return out, feats
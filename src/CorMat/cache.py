@@ -0,0 +1,93 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+
+class cache():
+    """Persistent, content-addressed store of per-matrix decompositions, so repeated runs over the same cohort (with any
+    distance, on the CPU or with torch) skip the eigendecompositions, square roots, inverse square roots and logarithms.
+
+    Each matrix is keyed by a hash of its shape and float64 bytes; its arrays are kept as .npy files in
+    <cacheDir>/<key[:2]>/<key>/ (e.g. evals.npy, evecs.npy, half.npy) and read back memory-mapped. Writes go to a temporary
+    file that is then renamed, so concurrent runs sharing a folder never see partial arrays. An entry's folder is touched
+    whenever it is read, and once the folder exceeds sizeLimit bytes the least recently used entries are deleted."""
+
+    sizeLimit = 2**32 # Bytes kept in a cache folder before least recently used entries are evicted
+
+    def key(matrix: np.ndarray) -> str:
+        """Content hash of a matrix: its shape and float64 bytes."""
+        arr = np.ascontiguousarray(matrix, dtype=np.float64)
+        digest = hashlib.blake2b(str(arr.shape).encode(), digest_size=20)
+        digest.update(arr.data)
+        return digest.hexdigest()
+
+    def entryPath(cacheDir: str, key: str) -> str:
+        return os.path.join(cacheDir, key[:2], key)
+
+    def load(cacheDir: str, key: str, names) -> dict:
+        """The arrays named in names that are stored for key, memory-mapped read-only (missing ones are left out).
+        Marks the entry as recently used."""
+        path = cache.entryPath(cacheDir, key)
+        found = {}
+        for name in names:
+            try:
+                found[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
+            except (FileNotFoundError, ValueError): # Missing, or a file left truncated by a crash; recomputed by the caller
+                continue
+        if found:
+            try:
+                os.utime(path)
+            except FileNotFoundError: # Evicted by a concurrent run; the arrays already mapped stay readable
+                pass
+        return found
+
+    def store(cacheDir: str, key: str, arrays: dict):
+        """Writes arrays (name -> np.ndarray) to the entry for key."""
+        path = cache.entryPath(cacheDir, key)
+        os.makedirs(path, exist_ok=True)
+        for name, arr in arrays.items():
+            tmpPath = os.path.join(path, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(tmpPath, np.asarray(arr))
+            os.replace(tmpPath, os.path.join(path, name + ".npy"))
+
+    def entries(cacheDir: str) -> list:
+        """(last use, bytes, path) of every entry in the folder, least recently used first."""
+        found = []
+        if not os.path.isdir(cacheDir):
+            return found
+        for prefix in os.scandir(cacheDir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    found.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError: # Removed by a concurrent eviction
+                    continue
+        return sorted(found)
+
+    def size(cacheDir: str) -> int:
+        """Total bytes stored in the folder."""
+        return sum(size for _, size, _ in cache.entries(cacheDir))
+
+    def evict(cacheDir: str, limit: int = None) -> int:
+        """Deletes least recently used entries until the folder holds at most limit bytes (default: sizeLimit).
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        limit = limit if limit is not None else cache.sizeLimit
+        entries = cache.entries(cacheDir)
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(cacheDir: str):
+        """Deletes every entry in the folder."""
+        cache.evict(cacheDir, limit=0)
@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import numpy as np
+from typing import Callable, Iterable
+from CorMat.batched import batched
+from CorMat.parallel import parallel
+from CorMat.storage import storage
+from CorMat.progress import progress
+
+class checkpoint():
+    """Resumable pairwise distance computation. The output matrix lives in an np.memmap file inside a checkpoint folder,
+    next to a metadata file and an append-only log of completed tiles. Rerunning with the same inputs and settings skips
+    every logged tile; a fingerprint (content hash) of the inputs and settings is checked before any partial results are reused.
+
+    Files in the checkpoint folder:
+        distances.dat: The output (N x N, or condensed; see CorMat.storage), as a raw np.memmap.
+        checkpoint.json: Fingerprint, shape, dtype, tile size, symmetry and distance name.
+        completed.txt: One "rowStart colStart" line per finished tile, appended only after the tile is flushed to distances.dat."""
+
+    dataFile = "distances.dat"
+    metaFile = "checkpoint.json"
+    logFile = "completed.txt"
+
+    def callableName(func: Callable) -> str:
+        """Stable, human-readable name of a callable, e.g. CorMat.distances.distances.BuresDistance."""
+        if func is None:
+            return "None"
+        return f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', repr(func))}"
+
+    def fingerprint(Matrices: Iterable, distance: Callable, Mats_half: Iterable = None, Mats_neghalf: Iterable = None, **settings) -> str:
+        """SHA-256 over the bytes and shapes of every input matrix (and any supplied halves), the distance and the settings."""
+        digest = hashlib.sha256()
+        for collection in (Matrices, Mats_half, Mats_neghalf):
+            digest.update(b"|" if collection is None else b"#%d" % len(collection))
+            for mat in (collection if collection is not None else []):
+                mat = np.ascontiguousarray(mat)
+                digest.update(str((mat.shape, mat.dtype.str)).encode())
+                digest.update(mat.tobytes())
+        settings = {key: checkpoint.callableName(val) if callable(val) else val for key, val in settings.items()}
+        digest.update(checkpoint.callableName(distance).encode())
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def readCompleted(checkpointDir: str) -> set:
+        """Set of (rowStart, colStart) tiles logged as complete. Ignores a trailing partial line from an interrupted write."""
+        completed = set()
+        path = os.path.join(checkpointDir, checkpoint.logFile)
+        if not os.path.exists(path):
+            return completed
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and line.endswith("\n"):
+                    completed.add((int(parts[0]), int(parts[1])))
+        return completed
+
+    def dropPartialLine(checkpointDir: str):
+        """Truncates a trailing partial line left in the log by an interrupted write, so that the next tile logged starts
+        on a line of its own instead of being appended to the fragment (and then ignored by readCompleted)."""
+        path = os.path.join(checkpointDir, checkpoint.logFile)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+
+    def openOutput(checkpointDir: str, numArrays: int, fingerprint: str, blockSize: int, assumeDistIsSymmetric: bool,
+                   distanceName: str = "", overwrite: bool = False, outputFormat: str = "square", dtype=np.float64):
+        """Opens (or creates) the checkpoint in checkpointDir.
+
+        Returns:
+            (np.memmap, set): The output, in the given layout and dtype, and the set of completed (rowStart, colStart) tiles.
+
+        Raises:
+            ValueError: If an existing checkpoint was made from different inputs or settings, unless overwrite is True.
+        """
+        os.makedirs(checkpointDir, exist_ok=True)
+        metaPath = os.path.join(checkpointDir, checkpoint.metaFile)
+        dataPath = os.path.join(checkpointDir, checkpoint.dataFile)
+        if outputFormat == "condensed" and not assumeDistIsSymmetric:
+            raise ValueError("The condensed output format requires assumeDistIsSymmetric=True.")
+        shape, dtype = storage.outputShape(numArrays, outputFormat), np.dtype(dtype)
+        meta = {"fingerprint": fingerprint, "shape": list(shape), "dtype": dtype.str, "blockSize": blockSize,
+                "assumeDistIsSymmetric": assumeDistIsSymmetric, "distance": distanceName}
+        if os.path.exists(metaPath) and not overwrite:
+            with open(metaPath) as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"Checkpoint in {checkpointDir} was made from different inputs or settings "
+                                 f"(stored distance: {stored.get('distance')}, blockSize: {stored.get('blockSize')}). "
+                                 "Use a different checkpointDir, or overwrite=True to discard it.")
+            if os.path.exists(dataPath):
+                return np.memmap(dataPath, dtype=dtype, mode='r+', shape=shape), checkpoint.readCompleted(checkpointDir)
+        out = np.memmap(dataPath, dtype=dtype, mode='w+', shape=shape)
+        logPath = os.path.join(checkpointDir, checkpoint.logFile)
+        if os.path.exists(logPath):
+            os.remove(logPath)
+        tmpPath = metaPath + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmpPath, metaPath)
+        return out, set()
+
+    def calculatePairwiseDistances(Matrices: Iterable, distance: Callable, checkpointDir: str,
+                                   Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                                   DTWfeatureDist: Callable = None, fastMode: bool = False,
+                                   precomputeHalves: bool = False, precomputeNeghalves: bool = False,
+                                   assumeDistIsSymmetric: bool = False, silent: bool = False,
+                                   blockSize: int = None, nWorkers: int = 1, blasThreads: int = 1,
+                                   backend: str = "process", overwrite: bool = False,
+                                   outputFormat: str = "square", dtype=np.float64,
+                                   reporter: Callable = None, profile: int = 0, cacheDir: str = None) -> np.memmap:
+        """Resumable equivalent of CorMat.utils.calculatePairwiseDistances; inputs shared with that function (and with
+        CorMat.parallel.calculatePairwiseDistances) have the same meaning. If interrupted, rerun with the same arguments to continue.
+
+        Args:
+            checkpointDir (str): Folder holding the memmapped output and the progress record. Created if needed.
+            overwrite (bool, optional): Discard an existing checkpoint made from different inputs instead of raising. Defaults to False.
+            outputFormat (str, optional): "square", or "condensed" (requires assumeDistIsSymmetric); see CorMat.storage. Defaults to "square".
+            dtype (optional): dtype of the result, e.g. np.float32. Defaults to np.float64.
+            reporter (Callable, optional): Receives progress reports (counting only the tiles left to do, with the number of
+                                           tiles already complete as 'resumedTiles' in their 'info'); see CorMat.progress.
+            profile (int, optional): Number of slowest tiles to record in the final report. Defaults to 0.
+            cacheDir (str, optional): Folder of the persistent cache of per-matrix decompositions; see CorMat.cache.
+
+        Returns:
+            np.memmap: The matrix of pairwise distances (or its condensed form), backed by checkpointDir/distances.dat.
+        """
+        numArrays = len(Matrices)
+        tracker = progress.start(0, reporter=reporter, silent=silent, profile=profile)
+        fingerprint = checkpoint.fingerprint(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf, fastMode=fastMode,
+                                             DTWfeatureDist=DTWfeatureDist, precomputeHalves=precomputeHalves,
+                                             precomputeNeghalves=precomputeNeghalves, assumeDistIsSymmetric=assumeDistIsSymmetric)
+        metaPath = os.path.join(checkpointDir, checkpoint.metaFile)
+        if blockSize is None and os.path.exists(metaPath) and not overwrite: # Resume with the tile layout already on disk
+            with open(metaPath) as f:
+                blockSize = json.load(f).get("blockSize")
+        feats = parallel.prepare(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                 precomputeHalves=precomputeHalves, precomputeNeghalves=precomputeNeghalves, cacheDir=cacheDir)
+        if blockSize is None:
+            blockSize = parallel.defaultBlockSize(distance, feats, nWorkers)
+        out, completed = checkpoint.openOutput(checkpointDir, numArrays, fingerprint, blockSize, assumeDistIsSymmetric,
+                                               distanceName=checkpoint.callableName(distance), overwrite=overwrite,
+                                               outputFormat=outputFormat, dtype=dtype)
+        tiles = [(rows, cols) for rows, cols in batched.tiles(numArrays, blockSize, assumeDistIsSymmetric)
+                 if (rows.start, cols.start) not in completed]
+        if completed:
+            progress.note(tracker, resumedTiles=len(completed))
+        progress.setTotal(tracker, sum(progress.tilePairs(rows, cols, assumeDistIsSymmetric) for rows, cols in tiles))
+        progress.stage(tracker, 'pairs')
+        checkpoint.dropPartialLine(checkpointDir)
+        with open(os.path.join(checkpointDir, checkpoint.logFile), "a") as log:
+            def recordTile(rows, cols):
+                out.flush()
+                log.write(f"{rows.start} {cols.start}\n")
+                log.flush()
+                os.fsync(log.fileno())
+            parallel.runTiles(distance, feats, tiles, out, DTWfeatureDist=DTWfeatureDist, fastMode=fastMode,
+                              assumeDistIsSymmetric=assumeDistIsSymmetric, nWorkers=nWorkers, blasThreads=blasThreads,
+                              backend=backend, onTileDone=recordTile, silent=True, tracker=tracker)
+        progress.finish(tracker)
+        return out
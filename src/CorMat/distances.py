@@ -1,6 +1,5 @@
 import numpy as np
 import scipy.linalg as la
-from CorMat.dtw import dtw
 
 class distances():
     """Subpackage of CorMat containing distance functions. Inputs are almost all standardized; this is for
@@ -10,12 +9,18 @@ class distances():
         
     def BuresDistance(A, B, zero_tol=10**-10, *args, **kwargs):
         """Recommended: Compute A^(1/2) (i.e. Ahalf) and pass that into the method. This will be faster for pairwise distance loops.
+        Alternatively, pass thin factors Afactor, Bfactor (A = Afactor @ Afactor.T, e.g. standardized timeseries); see faster_RootBuresFidelity.
         For more, see Rajendra Bhatia, Tanvi Jain, Yongdo Lim.
         Paper Title: On the Bures-Wasserstein distance between positive definite matrices"""
-        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else la.fractional_matrix_power(A, 1/2)
-        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else la.fractional_matrix_power(B, 1/2)
         fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
-        val = np.trace(A) + np.trace(B) - 2 * distances.faster_RootBuresFidelity(A, B, Ahalf=Ahalf, Bhalf=Bhalf, fastMode=fastMode)
+        if kwargs.get('Afactor') is not None and kwargs.get('Bfactor') is not None:
+            Afactor, Bfactor = kwargs['Afactor'], kwargs['Bfactor']
+            traces = np.sum(Afactor**2) + np.sum(Bfactor**2) # trace(F F^T) is the squared Frobenius norm of F
+            val = traces - 2 * distances.faster_RootBuresFidelity(A, B, Afactor=Afactor, Bfactor=Bfactor, fastMode=fastMode)
+        else:
+            Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else la.fractional_matrix_power(A, 1/2)
+            Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else la.fractional_matrix_power(B, 1/2)
+            val = np.trace(A) + np.trace(B) - 2 * distances.faster_RootBuresFidelity(A, B, Ahalf=Ahalf, Bhalf=Bhalf, fastMode=fastMode)
         if val.real >= 0:
             return np.sqrt(val.real) # NOTE: Switching order of A and B inputs appears to only meaningfully affect imaginary part.
         elif np.abs(val) < zero_tol:
@@ -26,11 +31,17 @@ class distances():
             raise ValueError('Invalid value encountered in Bures distance.')
     
     def faster_RootBuresFidelity(A, B, *args, **kwargs):
-        """Faster implementation of Bures Fidelity"""
-        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else la.fractional_matrix_power(A, 1/2)
-        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else la.fractional_matrix_power(B, 1/2)
+        """Faster implementation of Bures Fidelity.
+        Given thin factors Afactor, Bfactor with A = Afactor @ Afactor.T and B = Bfactor @ Bfactor.T (for a correlation matrix,
+        the centered timeseries with rows scaled to unit norm), the fidelity is the nuclear norm of Afactor.T @ Bfactor, which
+        is only samples x samples; no square roots are needed, and A and B may be None."""
         fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
-        mat = Ahalf@Bhalf
+        if kwargs.get('Afactor') is not None and kwargs.get('Bfactor') is not None:
+            mat = kwargs['Afactor'].T @ kwargs['Bfactor']
+        else:
+            Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else la.fractional_matrix_power(A, 1/2)
+            Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else la.fractional_matrix_power(B, 1/2)
+            mat = Ahalf@Bhalf
         if not fastMode:
             val = np.sum(np.linalg.svd(mat, compute_uv=False))
         else:
@@ -40,10 +51,14 @@ class distances():
         return val
 
     def BuresAngle(A, B, *args, **kwargs):
-        """Only applicable to PSD matrices A, B with trace = 1, so that RootBuresFidelity is bounded in [-1,1]"""
+        """Only applicable to PSD matrices A, B with trace = 1, so that RootBuresFidelity is bounded in [-1,1]
+        Accepts thin factors Afactor, Bfactor in place of Ahalf, Bhalf, as in faster_RootBuresFidelity."""
+        fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
+        if kwargs.get('Afactor') is not None and kwargs.get('Bfactor') is not None:
+            val = distances.faster_RootBuresFidelity(A, B, Afactor=kwargs['Afactor'], Bfactor=kwargs['Bfactor'], fastMode=fastMode)
+            return np.arccos(val).real
         Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else la.fractional_matrix_power(A, 1/2)
         Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else la.fractional_matrix_power(B, 1/2)
-        fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
         val = distances.faster_RootBuresFidelity(A, B, Ahalf=Ahalf, Bhalf=Bhalf, fastMode=fastMode)
         return np.arccos(val).real
     
@@ -61,13 +76,21 @@ class distances():
         return np.linalg.norm(la.logm(A) - la.logm(B))
     
     def dtw_distance(A, B, *args, **kwargs):
-        """Alias for CorMat.dtw.dtw_distance; placed here for ease of use.
+        """Alias for CorMat.DTW.dtw_distance; placed here for ease of use.
         Not implemented for use with GPU; as such, no matching method is found in CorMat.gpu.distances.
         Instead, this method is optimized with Numba's @jit decorator.
-        Default feature distance is Euclidean distance. Enter others with featureDist = distance
-        Where distance is a callable and distance(x,y) returns a scalar."""
+        Default feature distance is Euclidean distance. Enter others with DTWfeatureDist = distance
+        Where distance is the name of a compiled metric in CorMat.DTW.featureMetrics (e.g. "cosine"),
+        or a callable such that distance(x,y) returns a scalar.
+        Optional DTWwindow, DTWwindowSize and DTWcutoff are passed on as window, windowSize and cutoff; see CorMat.DTW.dtw_distance.
+        They are not options of calculatePairwiseDistances; bind them first, e.g. 
+        functools.partial(distances.dtw_distance, DTWwindow="sakoe-chiba", DTWwindowSize=10)."""
         DTWfeatureDist = kwargs['DTWfeatureDist'] if 'DTWfeatureDist' in kwargs.keys() else None
-        return dtw.dtw_distance(A,B,DTWfeatureDist=DTWfeatureDist)
+        DTWwindow = kwargs['DTWwindow'] if 'DTWwindow' in kwargs.keys() else None
+        DTWwindowSize = kwargs['DTWwindowSize'] if 'DTWwindowSize' in kwargs.keys() else None
+        DTWcutoff = kwargs['DTWcutoff'] if 'DTWcutoff' in kwargs.keys() else np.inf
+        from CorMat.dtw import dtw # Imported on first use, so numba is only loaded when DTW is needed
+        return dtw.dtw_distance(A,B,DTWfeatureDist=DTWfeatureDist, window=DTWwindow, windowSize=DTWwindowSize, cutoff=DTWcutoff)
     
     # def BuresDistance_old(A, B, Ahalf=None, A_neghalf=None, featureDist=None, zero_tol=10**-10):
     #     """Recommended: Compute A^(1/2) (i.e. Ahalf) and pass that into the method. This will be faster for pairwise distance loops.
@@ -1,24 +1,98 @@
 import numpy as np
 from numba import jit
+from CorMat.progress import progress
 
 class dtw():
-    """Lots of this implementation inspired by: https://www.audiolabs-erlangen.de/resources/MIR/FMP/C3/C3S2_DTWbasic.html#:~:text=This%20leads%20us%20to%20the,%2Dwarping%20path%7D(5)"""
-    
+    """Lots of this implementation inspired by: https://www.audiolabs-erlangen.de/resources/MIR/FMP/C3/C3S2_DTWbasic.html#:~:text=This%20leads%20us%20to%20the,%2Dwarping%20path%7D(5)
+    Jitted functions are cached on disk (cache=True), so they are compiled once rather than in every new process. The cache
+    is kept next to this file, or in numba's user cache folder if that is read-only (see NUMBA_CACHE_DIR)."""
+
+    def _asFeatureArray(X) -> np.ndarray:
+        """Sequence as a contiguous float64 (samples x features) array; 1-D sequences have one feature."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        return X[:, None] if X.ndim == 1 else X.reshape(X.shape[0], -1)
+
+    @jit(nopython=True, cache=True)
+    def euclidean_cost_matrix(X, Y):
+        """Cost matrix of Euclidean distances between the rows of two (samples x features) arrays."""
+        C = np.empty((X.shape[0], Y.shape[0]))
+        for i in range(X.shape[0]):
+            for j in range(Y.shape[0]):
+                total = 0.0
+                for k in range(X.shape[1]):
+                    diff = X[i, k] - Y[j, k]
+                    total += diff * diff
+                C[i, j] = np.sqrt(total)
+        return C
+
+    @jit(nopython=True, cache=True)
+    def sqeuclidean_cost_matrix(X, Y):
+        """Cost matrix of squared Euclidean distances between the rows of two (samples x features) arrays."""
+        C = np.empty((X.shape[0], Y.shape[0]))
+        for i in range(X.shape[0]):
+            for j in range(Y.shape[0]):
+                total = 0.0
+                for k in range(X.shape[1]):
+                    diff = X[i, k] - Y[j, k]
+                    total += diff * diff
+                C[i, j] = total
+        return C
+
+    @jit(nopython=True, cache=True)
+    def manhattan_cost_matrix(X, Y):
+        """Cost matrix of Manhattan (cityblock) distances between the rows of two (samples x features) arrays."""
+        C = np.empty((X.shape[0], Y.shape[0]))
+        for i in range(X.shape[0]):
+            for j in range(Y.shape[0]):
+                total = 0.0
+                for k in range(X.shape[1]):
+                    total += abs(X[i, k] - Y[j, k])
+                C[i, j] = total
+        return C
+
+    def cosine_cost_matrix(X, Y):
+        """Cost matrix of cosine distances (1 - cosine similarity) between the rows of two (samples x features) arrays,
+        as a single matrix product of the normalized rows. As in scipy, rows of all zeros give nan."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            Xn = X / np.linalg.norm(X, axis=1, keepdims=True)
+            Yn = Y / np.linalg.norm(Y, axis=1, keepdims=True)
+        return np.clip(1 - Xn @ Yn.T, 0, 2)
+
+    def correlation_cost_matrix(X, Y):
+        """Cost matrix of correlation distances (1 - Pearson correlation) between the rows of two (samples x features) arrays."""
+        return dtw.cosine_cost_matrix(X - X.mean(axis=1, keepdims=True), Y - Y.mean(axis=1, keepdims=True))
+
+    # Built-in feature metrics, selected by passing one of these names as DTWfeatureDist
+    featureMetrics = {"euclidean": euclidean_cost_matrix,
+                      "sqeuclidean": sqeuclidean_cost_matrix,
+                      "cosine": cosine_cost_matrix,
+                      "correlation": correlation_cost_matrix,
+                      "manhattan": manhattan_cost_matrix,
+                      "cityblock": manhattan_cost_matrix}
+
+    # Built-in feature metrics which the rolling-row kernel evaluates on the fly; cosine and correlation use 1 - <x,y> on prepared rows
+    rollingMetricCodes = {"euclidean": 0, "sqeuclidean": 1, "manhattan": 2, "cityblock": 2, "cosine": 3, "correlation": 3}
+
     def compute_cost_matrix(X, Y, DTWfeatureDist=None):
         """Compute the cost matrix of two feature sequences
 
         Args:
             X (np.ndarray): Sequence 1
             Y (np.ndarray): Sequence 2
-            DTWfeatureDist (func(f1, f2)): A distance function that compares two elements of a feature space; 
-                                    i.e. compares samples in the time series
+            DTWfeatureDist (func(f1, f2) or str): A distance function that compares two elements of a feature space; 
+                                    i.e. compares samples in the time series. Either the name of a built-in metric in 
+                                    dtw.featureMetrics (compiled or vectorized; much faster), or any callable, which is
+                                    evaluated once per pair of samples. Defaults to "euclidean".
 
         Returns:
             C (np.ndarray): Cost matrix
         """
         if DTWfeatureDist is None:
-            def DTWfeatureDist(x,y):
-                return np.linalg.norm(x-y)
+            DTWfeatureDist = "euclidean"
+        if isinstance(DTWfeatureDist, str):
+            if DTWfeatureDist not in dtw.featureMetrics:
+                raise ValueError(f"Unknown DTW feature metric: {DTWfeatureDist}. Use one of {list(dtw.featureMetrics)} or a callable.")
+            return dtw.featureMetrics[DTWfeatureDist](dtw._asFeatureArray(X), dtw._asFeatureArray(Y))
 
         height = int(X.shape[0])
         width = int(Y.shape[0])
@@ -28,7 +102,7 @@ class dtw():
                 C[i,j] = DTWfeatureDist(X[i], Y[j])
         return C
     
-    @jit(nopython=True)
+    @jit(nopython=True, cache=True)
     def compute_accumulated_cost_matrix(C):
         """Compute the accumulated cost matrix given the cost matrix
 
@@ -53,7 +127,134 @@ class dtw():
                 D[n, m] = C[n, m] + min(D[n-1, m], D[n, m-1], D[n-1, m-1])
         return D
     
-    @jit(nopython=True)
+    @jit(nopython=True, cache=True)
+    def compute_windowed_accumulated_cost_matrix(C, lo, hi):
+        """Accumulated cost matrix restricted to a global window: row n may only use columns lo[n] through hi[n] 
+        (see dtw.window_bounds). Cells outside the window are inf, so compute_optimal_warping_path stays inside it."""
+        N = C.shape[0]
+        M = C.shape[1]
+        D = np.full((N, M), np.inf)
+        for n in range(N):
+            for m in range(lo[n], hi[n] + 1):
+                if n == 0 and m == 0:
+                    D[n, m] = C[n, m]
+                    continue
+                best = np.inf
+                if n > 0:
+                    best = D[n-1, m]
+                    if m > 0:
+                        best = min(best, D[n-1, m-1])
+                if m > 0:
+                    best = min(best, D[n, m-1])
+                D[n, m] = C[n, m] + best
+        return D
+
+    @jit(nopython=True, cache=True)
+    def _rolling_dtw(X, Y, metric, lo, hi, cutoff):
+        """Distance-only DTW keeping two rows of the accumulated cost matrix, with costs computed on the fly from the
+        (samples x features) arrays X, Y using a metric code from dtw.rollingMetricCodes. Stops and returns inf once a
+        whole row exceeds cutoff, since costs are nonnegative and every warping path crosses every row; a completed
+        distance above cutoff is returned as inf too."""
+        M = Y.shape[0]
+        prev = np.full(M, np.inf)
+        cur = np.full(M, np.inf)
+        prevLo, prevHi = 0, -1
+        for n in range(X.shape[0]):
+            rowMin = np.inf
+            for m in range(lo[n], hi[n] + 1):
+                total = 0.0
+                for k in range(X.shape[1]):
+                    if metric == 0 or metric == 1:
+                        diff = X[n, k] - Y[m, k]
+                        total += diff * diff
+                    elif metric == 2:
+                        total += abs(X[n, k] - Y[m, k])
+                    else:
+                        total += X[n, k] * Y[m, k]
+                if metric == 0:
+                    total = np.sqrt(total)
+                elif metric == 3:
+                    total = min(max(1.0 - total, 0.0), 2.0)
+                if n == 0 and m == 0:
+                    best = 0.0
+                else:
+                    best = prev[m]
+                    if m > 0:
+                        best = min(best, prev[m-1], cur[m-1])
+                cur[m] = total + best
+                rowMin = min(rowMin, cur[m])
+            if rowMin > cutoff:
+                return np.inf
+            for m in range(prevLo, prevHi + 1):
+                prev[m] = np.inf
+            prev, cur = cur, prev
+            prevLo, prevHi = lo[n], hi[n]
+        return prev[M-1] if prev[M-1] <= cutoff else np.inf
+
+    @jit(nopython=True, cache=True)
+    def _rolling_dtw_from_cost(C, lo, hi, cutoff):
+        """As _rolling_dtw, but reading costs from a precomputed cost matrix C (used for callable feature distances)."""
+        M = C.shape[1]
+        prev = np.full(M, np.inf)
+        cur = np.full(M, np.inf)
+        prevLo, prevHi = 0, -1
+        for n in range(C.shape[0]):
+            rowMin = np.inf
+            for m in range(lo[n], hi[n] + 1):
+                if n == 0 and m == 0:
+                    best = 0.0
+                else:
+                    best = prev[m]
+                    if m > 0:
+                        best = min(best, prev[m-1], cur[m-1])
+                cur[m] = C[n, m] + best
+                rowMin = min(rowMin, cur[m])
+            if rowMin > cutoff:
+                return np.inf
+            for m in range(prevLo, prevHi + 1):
+                prev[m] = np.inf
+            prev, cur = cur, prev
+            prevLo, prevHi = lo[n], hi[n]
+        return prev[M-1] if prev[M-1] <= cutoff else np.inf
+
+    def window_bounds(N: int, M: int, window: str = None, windowSize: float = None):
+        """Column range allowed in each row of an N x M DTW problem under a global constraint.
+
+        Args:
+            N (int): Length of sequence 1 (rows).
+            M (int): Length of sequence 2 (columns).
+            window (str, optional): None for no constraint, "sakoe-chiba" for a band around the (scaled) diagonal, or 
+                                    "itakura" for a parallelogram limiting the local slope of the warping path.
+            windowSize (float, optional): For "sakoe-chiba", the band radius in samples (required). For "itakura", the 
+                                          maximum slope; defaults to 2.
+
+        Returns:
+            (np.ndarray, np.ndarray): Integer arrays lo, hi; row n may use columns lo[n] through hi[n] inclusive.
+        """
+        rows = np.arange(N, dtype=np.float64)
+        if window is None:
+            lo, hi = np.zeros(N), np.full(N, M - 1.0)
+        elif window == "sakoe-chiba":
+            if windowSize is None:
+                raise ValueError("A Sakoe-Chiba window requires windowSize (the band radius in samples).")
+            center = rows * (M - 1) / max(N - 1, 1)
+            lo, hi = np.ceil(center - windowSize), np.floor(center + windowSize)
+        elif window == "itakura":
+            slope = windowSize if windowSize is not None else 2.0
+            if slope < 1:
+                raise ValueError("The maximum slope of an Itakura window must be at least 1.")
+            lo = np.maximum(np.ceil(rows / slope), np.ceil((M - 1) - slope * (N - 1 - rows)))
+            hi = np.minimum(np.floor(slope * rows), np.floor((M - 1) - (N - 1 - rows) / slope))
+        else:
+            raise ValueError(f"Unknown DTW window: {window}. Use None, 'sakoe-chiba' or 'itakura'.")
+        lo, hi = np.clip(lo, 0, M - 1).astype(np.int64), np.clip(hi, 0, M - 1).astype(np.int64)
+        if np.any(lo > hi) or lo[0] != 0 or hi[-1] != M - 1:
+            raise ValueError(f"The {window} window admits no warping path between sequences of lengths {N} and {M}.")
+        for n in range(1, N): # Keep consecutive rows connected, so that some warping path always exists
+            lo[n] = min(lo[n], hi[n-1] + 1)
+        return lo, hi
+
+    @jit(nopython=True, cache=True)
     def compute_optimal_warping_path(D):
         """Compute the warping path given an accumulated cost matrix
 
@@ -88,18 +289,206 @@ class dtw():
         P.reverse()
         return np.array(P)
     
-    def dtw_distance(TS1, TS2, DTWfeatureDist=None):
-        """Returns the cost of the optimal warping path given two timeseries TS1, TS2."""
+    def _rollingFeatures(TS, DTWfeatureDist: str) -> np.ndarray:
+        """Sequence prepared for _rolling_dtw: rows are centered (correlation) and normalized (cosine, correlation)."""
+        X = dtw._asFeatureArray(TS)
+        if DTWfeatureDist == "correlation":
+            X = X - X.mean(axis=1, keepdims=True)
+        if DTWfeatureDist in ("cosine", "correlation"):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                X = X / np.linalg.norm(X, axis=1, keepdims=True)
+        return X
+
+    def dtw_distance(TS1, TS2, DTWfeatureDist=None, window: str = None, windowSize: float = None, cutoff: float = np.inf):
+        """Returns the cost of the optimal warping path given two timeseries TS1, TS2.
+        Only two rows of the accumulated cost matrix are kept, and for built-in feature metrics (see compute_cost_matrix)
+        costs are computed on the fly, so memory is O(len(TS2)) rather than O(len(TS1)*len(TS2)).
+
+        Args:
+            window (str, optional): Global constraint, None, "sakoe-chiba" or "itakura"; see window_bounds.
+            windowSize (float, optional): Band radius or maximum slope of the window; see window_bounds.
+            cutoff (float, optional): Early-abandon threshold. If the distance exceeds cutoff, inf is returned, as soon
+                                      as a whole row of the accumulated cost exceeds it. Defaults to inf (never abandon).
+        """
+        N, M = int(TS1.shape[0]), int(TS2.shape[0])
+        lo, hi = dtw.window_bounds(N, M, window=window, windowSize=windowSize)
+        if DTWfeatureDist is None:
+            DTWfeatureDist = "euclidean"
+        if isinstance(DTWfeatureDist, str) and DTWfeatureDist in dtw.rollingMetricCodes:
+            X, Y = dtw._rollingFeatures(TS1, DTWfeatureDist), dtw._rollingFeatures(TS2, DTWfeatureDist)
+            return dtw._rolling_dtw(X, Y, dtw.rollingMetricCodes[DTWfeatureDist], lo, hi, float(cutoff))
         C = dtw.compute_cost_matrix(TS1, TS2, DTWfeatureDist=DTWfeatureDist)
-        D = dtw.compute_accumulated_cost_matrix(C)
-        return D[-1,-1]
+        return dtw._rolling_dtw_from_cost(C, lo, hi, float(cutoff))
     
-    def simple_optimal_warping_path(TS1, TS2, DTWfeatureDist=None):
+    def simple_optimal_warping_path(TS1, TS2, DTWfeatureDist=None, window: str = None, windowSize: float = None):
         """A wrapper for the three steps of finding the optimal warping path.
         Simply composes the operations of constructing cost matrix, the accumulated cost matrix,
-        and backtracking through the accumulated cost matrix."""
-        C = dtw.compute_cost_matrix(TS1, TS2, featureDist=DTWfeatureDist)
-        D = dtw.compute_accumulated_cost_matrix(C)
+        and backtracking through the accumulated cost matrix. Supports the same windows as dtw_distance."""
+        C = dtw.compute_cost_matrix(TS1, TS2, DTWfeatureDist=DTWfeatureDist)
+        if window is None:
+            D = dtw.compute_accumulated_cost_matrix(C)
+        else:
+            D = dtw.compute_windowed_accumulated_cost_matrix(C, *dtw.window_bounds(C.shape[0], C.shape[1], window=window, windowSize=windowSize))
         P = dtw.compute_optimal_warping_path(D)
         return P
-        
\ No newline at end of file
+        
+    # Feature metrics for which the distance from a point to a bounding box is a lower bound on its distance to every point in the box
+    keoghMetrics = ("euclidean", "sqeuclidean", "manhattan", "cityblock")
+
+    @jit(nopython=True, cache=True)
+    def _envelope(Y, lo, hi):
+        """Per-feature minimum and maximum of Y over rows lo[n] through hi[n], for every n."""
+        lower = np.empty((lo.shape[0], Y.shape[1]))
+        upper = np.empty((lo.shape[0], Y.shape[1]))
+        for n in range(lo.shape[0]):
+            for k in range(Y.shape[1]):
+                low, high = Y[lo[n], k], Y[lo[n], k]
+                for m in range(lo[n] + 1, hi[n] + 1):
+                    low, high = min(low, Y[m, k]), max(high, Y[m, k])
+                lower[n, k], upper[n, k] = low, high
+        return lower, upper
+
+    def envelope(TS, queryLength: int, window: str = None, windowSize: float = None):
+        """Envelope of a reference timeseries for LB_Keogh: for each of the queryLength samples of a query, the per-feature
+        range of the reference samples it may be matched with under the window (see window_bounds).
+
+        Returns:
+            (np.ndarray, np.ndarray): lower and upper, each (queryLength x features).
+        """
+        Y = dtw._asFeatureArray(TS)
+        return dtw._envelope(Y, *dtw.window_bounds(queryLength, Y.shape[0], window=window, windowSize=windowSize))
+
+    def lb_kim(TS, References, DTWfeatureDist="euclidean") -> np.ndarray:
+        """LB_Kim lower bounds on the DTW distance from TS to each reference: every warping path contains the first and
+        the last pair of samples, so their costs bound the distance below. Valid for any feature distance."""
+        X = dtw._asFeatureArray(TS)
+        refs = [dtw._asFeatureArray(Y) for Y in References]
+        first = dtw.compute_cost_matrix(X[:1], np.concatenate([Y[:1] for Y in refs]), DTWfeatureDist=DTWfeatureDist)[0]
+        last = dtw.compute_cost_matrix(X[-1:], np.concatenate([Y[-1:] for Y in refs]), DTWfeatureDist=DTWfeatureDist)[0]
+        sameCell = np.array([X.shape[0] == 1 and Y.shape[0] == 1 for Y in refs]) # A single cell is counted once
+        return first + np.where(sameCell, 0, last)
+
+    def lb_keogh(TS, lower, upper, DTWfeatureDist="euclidean") -> float:
+        """LB_Keogh lower bound on the DTW distance from TS to a reference with the given envelope: each query sample is
+        matched to at least one reference sample inside its envelope box, so it costs at least its distance to the box.
+        Only valid for the feature distances in dtw.keoghMetrics."""
+        X = dtw._asFeatureArray(TS)
+        diff = X - np.clip(X, lower, upper)
+        if DTWfeatureDist in ("euclidean", None):
+            return float(np.sqrt((diff**2).sum(axis=1)).sum())
+        elif DTWfeatureDist == "sqeuclidean":
+            return float((diff**2).sum())
+        elif DTWfeatureDist in ("manhattan", "cityblock"):
+            return float(np.abs(diff).sum())
+        raise ValueError(f"LB_Keogh is only a lower bound for the feature distances {dtw.keoghMetrics}, not {DTWfeatureDist}.")
+
+    def build_index(References, labels=None, DTWfeatureDist="euclidean", window: str = None, windowSize: float = None,
+                    queryLength: int = None) -> dict:
+        """Prepares a labelled reference set for knn_search and knn_classify.
+
+        Args:
+            References (Iterable): Reference timeseries, each (samples x features) or 1-D.
+            labels (Iterable, optional): One label per reference, for knn_classify.
+            DTWfeatureDist (str or func(f1, f2), optional): Feature distance, as in dtw_distance. Defaults to "euclidean".
+            window (str, optional): DTW window, as in dtw_distance.
+            windowSize (float, optional): Band radius or maximum slope of the window, as in dtw_distance.
+            queryLength (int, optional): Length of the queries, used to precompute the LB_Keogh envelopes. Defaults to the 
+                                         references' length if they all have the same length. Envelopes for other query 
+                                         lengths are computed when first needed and kept in the index.
+
+        Returns:
+            dict: The references, labels, settings and envelopes ('envelopes' maps a query length to a list of (lower, upper)).
+        """
+        refs = [dtw._asFeatureArray(Y) for Y in References]
+        if labels is not None and len(labels) != len(refs):
+            raise ValueError(f"Got {len(labels)} labels for {len(refs)} references.")
+        index = {'refs': refs, 'labels': None if labels is None else np.asarray(labels), 'DTWfeatureDist': DTWfeatureDist,
+                 'window': window, 'windowSize': windowSize, 'envelopes': {}, 'bounds': {}}
+        if isinstance(DTWfeatureDist, str) and DTWfeatureDist in dtw.rollingMetricCodes: # Skip per-pair preparation in knn_search
+            index['rolling'] = [dtw._rollingFeatures(Y, DTWfeatureDist) for Y in refs]
+        lengths = {Y.shape[0] for Y in refs}
+        if queryLength is None and len(lengths) == 1:
+            queryLength = lengths.pop()
+        if queryLength is not None and DTWfeatureDist in dtw.keoghMetrics:
+            dtw._indexEnvelopes(index, queryLength)
+        return index
+
+    def _indexEnvelopes(index: dict, queryLength: int) -> list:
+        """The index's envelopes for queries of the given length, computed on first use."""
+        if queryLength not in index['envelopes']:
+            index['envelopes'][queryLength] = [dtw.envelope(Y, queryLength, window=index['window'], windowSize=index['windowSize'])
+                                               for Y in index['refs']]
+        return index['envelopes'][queryLength]
+
+    def knn_search(TS, index: dict, k: int = 1):
+        """k nearest references to TS by DTW distance, using a cascade of lower bounds so that full DTW only runs on
+        candidates that could still be among the k nearest. References are visited in order of LB_Kim; a candidate is
+        discarded as soon as LB_Kim or LB_Keogh (when valid for the feature distance) reaches the k-th best distance so far,
+        which is also passed to dtw_distance as an early-abandon cutoff.
+
+        Args:
+            TS (np.ndarray): Query timeseries.
+            index (dict): Reference set from build_index.
+            k (int, optional): Number of neighbors. Defaults to 1.
+
+        Returns:
+            (np.ndarray, np.ndarray, dict): Indices of the k nearest references and their DTW distances, sorted by distance,
+            and pruning statistics: counts of references 'pruned_kim', 'pruned_keogh', 'abandoned' (full DTW stopped early or ended above the cutoff)
+            and 'full_dtw' (full DTW run to completion), out of 'references'.
+        """
+        X = dtw._asFeatureArray(TS)
+        refs, metric = index['refs'], index['DTWfeatureDist']
+        k = min(k, len(refs))
+        stats = {'references': len(refs), 'pruned_kim': 0, 'pruned_keogh': 0, 'abandoned': 0, 'full_dtw': 0}
+        kim = dtw.lb_kim(X, refs, DTWfeatureDist=metric)
+        envelopes = dtw._indexEnvelopes(index, X.shape[0]) if metric in dtw.keoghMetrics else None
+        Xrolling = dtw._rollingFeatures(X, metric) if 'rolling' in index else None
+        best, bestIdx = np.full(k, np.inf), np.full(k, -1) # Sorted; best[-1] is the cutoff
+        order = np.argsort(kim, kind='stable')
+        for position, ref in enumerate(order):
+            if kim[ref] >= best[-1]: # Visited in order of LB_Kim, so every remaining reference is pruned too
+                stats['pruned_kim'] += len(order) - position
+                break
+            if envelopes is not None and dtw.lb_keogh(X, *envelopes[ref], DTWfeatureDist=metric) >= best[-1]:
+                stats['pruned_keogh'] += 1
+                continue
+            if 'rolling' in index:
+                shape = (X.shape[0], refs[ref].shape[0])
+                if shape not in index['bounds']:
+                    index['bounds'][shape] = dtw.window_bounds(*shape, window=index['window'], windowSize=index['windowSize'])
+                dist = dtw._rolling_dtw(Xrolling, index['rolling'][ref], dtw.rollingMetricCodes[metric], *index['bounds'][shape], best[-1])
+            else:
+                dist = dtw.dtw_distance(X, refs[ref], DTWfeatureDist=metric, window=index['window'], windowSize=index['windowSize'],
+                                        cutoff=best[-1])
+            if dist >= best[-1]:
+                stats['abandoned' if np.isinf(dist) else 'full_dtw'] += 1
+                continue
+            stats['full_dtw'] += 1
+            insert = np.searchsorted(best, dist, side='right')
+            best = np.insert(best, insert, dist)[:k]
+            bestIdx = np.insert(bestIdx, insert, ref)[:k]
+        return bestIdx, best, stats
+
+    def knn_classify(Queries, index: dict, k: int = 1, silent: bool = True, reporter=None):
+        """Labels each query by majority vote among its k nearest references (see knn_search); ties go to the label with
+        the nearest member. Progress, counting queries, goes to reporter (see CorMat.progress); by default it is printed
+        unless silent.
+
+        Returns:
+            (np.ndarray, dict): Predicted labels, and the pruning statistics of knn_search summed over all queries.
+        """
+        if index['labels'] is None:
+            raise ValueError("knn_classify needs an index built with labels.")
+        predictions, totals = [], {}
+        tracker = progress.start(len(Queries), reporter=reporter, silent=silent, stage='queries', unit='queries')
+        for q, TS in enumerate(Queries):
+            neighbors, _, stats = dtw.knn_search(TS, index, k=k)
+            votes = index['labels'][neighbors]
+            values, counts = np.unique(votes, return_counts=True)
+            winners = set(values[counts == counts.max()].tolist())
+            predictions.append(next(label for label in votes if label in winners))
+            totals = {key: totals.get(key, 0) + val for key, val in stats.items()}
+            if tracker is not None:
+                progress.update(tracker, 1)
+        progress.finish(tracker)
+        return np.array(predictions), totals
@@ -1,7 +1,8 @@
-__all__ = ["__version__", "linalg", "distances", 'utils']
+__all__ = ["__version__", "linalg", "distances", 'utils', 'batched']
 
 # Use if files have classes inside; this imports as Object (from within files)
 # Allows access as CorMat.plots.Plots or as CorMat.Plots
 from .linalg import linalg
 from .distances import distances
-from .utils import utils
\ No newline at end of file
+from .utils import utils
+from .batched import batched
\ No newline at end of file
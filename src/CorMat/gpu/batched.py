@@ -0,0 +1,196 @@
+import time
+import numpy as np
+import torch
+from typing import Callable, Iterable
+from CorMat.batched import batched as cpuBatched
+from CorMat.storage import storage
+from CorMat.progress import progress
+from CorMat.gpu.linalg import linalg
+from CorMat.gpu.distances import distances
+
+
+class batched():
+    """Torch counterpart of CorMat.batched. Per-matrix square roots and logarithms come from one batched eigh over the
+    stacked matrices, and pairs are evaluated a whole tile at a time with batched matmuls, svdvals and eigvalsh, so the
+    work is done in a few large kernels on the GPU or, on a CPU device, spread over torch's intra-op threads
+    (torch.set_num_threads). Tiles, block sizes and output layouts are shared with CorMat.batched and CorMat.storage."""
+
+    def stack(Matrices: Iterable, dtype: torch.dtype = torch.float64) -> torch.Tensor:
+        """Stacks equally-sized square matrices (tensors or arrays) into one (N, d, d) tensor on the device."""
+        if isinstance(Matrices, torch.Tensor):
+            return Matrices.to(device=linalg.device, dtype=dtype)
+        if isinstance(Matrices, np.ndarray):
+            return torch.as_tensor(Matrices, dtype=dtype, device=linalg.device)
+        return torch.stack([torch.as_tensor(mat, dtype=dtype, device=linalg.device) for mat in Matrices])
+
+    def RootBuresFidelityBlock(Ahalfs: torch.Tensor, Bhalfs: torch.Tensor, fastMode: bool = False) -> torch.Tensor:
+        """Block version of distances.faster_RootBuresFidelity; returns a (len(Ahalfs), len(Bhalfs)) tensor."""
+        mats = Ahalfs[:, None] @ Bhalfs[None, :]
+        if not fastMode:
+            return torch.sum(torch.linalg.svdvals(mats), dim=-1)
+        matsT = mats.transpose(-1, -2)
+        val = torch.sum(torch.abs(torch.linalg.eigvalsh(mats @ matsT))**(1/2), dim=-1)
+        val += torch.sum(torch.abs(torch.linalg.eigvalsh(matsT @ mats))**(1/2), dim=-1) # Average with other direction, as in the pairwise version
+        return val / 2
+
+    def BuresDistanceBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False, zero_tol: float = 10**-10) -> torch.Tensor:
+        """Block version of distances.BuresDistance."""
+        fidelity = batched.RootBuresFidelityBlock(feats['half'][rows], feats['half'][cols], fastMode=fastMode)
+        val = feats['trace'][rows, None] + feats['trace'][None, cols] - 2 * fidelity
+        tol = 10**6 * zero_tol if fastMode else zero_tol
+        if torch.any(val < -tol):
+            raise ValueError('Invalid value encountered in Bures distance.')
+        return torch.sqrt(torch.clamp(val, min=0))
+
+    def BuresAngleBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> torch.Tensor:
+        """Block version of distances.BuresAngle."""
+        fidelity = batched.RootBuresFidelityBlock(feats['half'][rows], feats['half'][cols], fastMode=fastMode)
+        return torch.arccos(fidelity)
+
+    def GramDistanceBlock(flats: torch.Tensor, normsSq: torch.Tensor, rows: slice, cols: slice) -> torch.Tensor:
+        """Frobenius distances between flattened matrices from one Gram matrix product; see CorMat.batched.GramDistanceBlock."""
+        val = normsSq[rows, None] + normsSq[None, cols] - 2 * (flats[rows] @ flats[cols].T)
+        block = torch.sqrt(torch.clamp(val, min=0))
+        rowIdx = torch.arange(rows.start, rows.stop, device=block.device)
+        colIdx = torch.arange(cols.start, cols.stop, device=block.device)
+        block[rowIdx[:, None] == colIdx[None, :]] = 0
+        return block
+
+    def EuclideanBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> torch.Tensor:
+        """Block version of distances.Euclidean."""
+        return batched.GramDistanceBlock(feats['flat'], feats['normSq'], rows, cols)
+
+    def LogFrobeniusBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> torch.Tensor:
+        """Block version of distances.LogFrobenius (the Log-Euclidean distance)."""
+        return batched.GramDistanceBlock(feats['logFlat'], feats['logNormSq'], rows, cols)
+
+    def AffineInvariantBlock(feats: dict, rows: slice, cols: slice, fastMode: bool = False) -> torch.Tensor:
+        """Block version of distances.AffineInvariant, as the root-sum-square of the logs of the eigenvalues of A^(-1/2) B A^(-1/2)."""
+        neghalfs = feats['neghalf'][rows, None]
+        evals = torch.linalg.eigvalsh(neghalfs @ feats['mats'][None, cols] @ neghalfs)
+        if torch.any(evals <= 0):
+            raise ValueError('Invalid value encountered in AffineInvariant distance; inputs must be SPD.')
+        return torch.sqrt(torch.sum(torch.log(evals)**2, dim=-1))
+
+    # Block implementations of the distances in CorMat.gpu.distances; per-matrix requirements are named as in CorMat.batched
+    blockFunctions = {distances.BuresDistance: BuresDistanceBlock,
+                      distances.BuresAngle: BuresAngleBlock,
+                      distances.Euclidean: EuclideanBlock,
+                      distances.LogFrobenius: LogFrobeniusBlock,
+                      distances.AffineInvariant: AffineInvariantBlock}
+    requirements = {distances.BuresDistance: ('half', 'trace'),
+                    distances.BuresAngle: ('half',),
+                    distances.Euclidean: ('flat', 'normSq'),
+                    distances.LogFrobenius: ('logFlat', 'logNormSq'),
+                    distances.AffineInvariant: ('neghalf',)}
+    pairIntermediates = {distances.Euclidean: 0, distances.LogFrobenius: 0}
+
+    def supports(distance: Callable) -> bool:
+        """True if the distance has a block implementation."""
+        return distance in batched.blockFunctions
+
+    def prepare(Matrices: Iterable, required: Iterable, Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                dtype: torch.dtype = torch.float64, cacheDir: str = None) -> dict:
+        """Stacked per-matrix quantities named in <required>, sharing one batched eigh; see CorMat.batched.prepare.
+        With cacheDir, decompositions are read from (or computed into) the same persistent cache as the numpy engine uses
+        (see CorMat.batched.cachedDecompositions), then moved to the device."""
+        mats = batched.stack(Matrices, dtype=dtype)
+        numArrays = mats.shape[0]
+        feats = {'mats': mats}
+        needsEigh = (('half' in required and Mats_half is None) or ('neghalf' in required and Mats_neghalf is None)
+                     or 'logFlat' in required)
+        cached = {}
+        if needsEigh and cacheDir is not None:
+            derived = [name for name, needed in (('half', 'half' in required and Mats_half is None),
+                                                 ('neghalf', 'neghalf' in required and Mats_neghalf is None),
+                                                 ('log', 'logFlat' in required)) if needed]
+            cached = {name: torch.as_tensor(arr, dtype=dtype, device=linalg.device)
+                      for name, arr in cpuBatched.cachedDecompositions(mats.cpu().numpy(), derived, cacheDir).items()}
+            evals, evecs = cached['evals'], cached['evecs']
+        else:
+            evals, evecs = linalg.eigh(mats) if needsEigh else (None, None)
+        if 'trace' in required:
+            feats['trace'] = torch.diagonal(mats, dim1=-2, dim2=-1).sum(-1)
+        if 'half' in required:
+            if Mats_half is not None:
+                feats['half'] = batched.stack(Mats_half, dtype=dtype)
+            else:
+                feats['half'] = cached['half'] if 'half' in cached else linalg.fractional_mat_power(None, 1/2, evals=evals, evecs=evecs)
+        if 'neghalf' in required:
+            if Mats_neghalf is not None:
+                feats['neghalf'] = batched.stack(Mats_neghalf, dtype=dtype)
+            else:
+                feats['neghalf'] = cached['neghalf'] if 'neghalf' in cached else linalg.fractional_mat_power(None, -1/2, evals=evals, evecs=evecs)
+        if 'flat' in required:
+            feats['flat'] = mats.reshape(numArrays, -1)
+            feats['normSq'] = torch.sum(feats['flat']**2, dim=1)
+        if 'logFlat' in required:
+            logs = cached['log'] if 'log' in cached else linalg.matrixLog(None, evals=evals, evecs=evecs)
+            feats['logFlat'] = logs.reshape(numArrays, -1)
+            feats['logNormSq'] = torch.sum(feats['logFlat']**2, dim=1)
+        return feats
+
+    def writeTile(pairwiseDists: torch.Tensor, rows: slice, cols: slice, block: torch.Tensor, assumeDistIsSymmetric: bool = False):
+        """Stores a tile in the pairwise tensor, as CorMat.batched.writeTile does for arrays. On a diagonal tile with
+        assumeDistIsSymmetric, the lower triangle is mirrored into the upper."""
+        if assumeDistIsSymmetric and rows == cols:
+            block = torch.tril(block) + torch.tril(block, -1).T
+        block = block.to(pairwiseDists.dtype)
+        if pairwiseDists.ndim == 1:
+            numArrays = storage.numArraysFromCondensed(pairwiseDists.shape[0])
+            rowIdx, colIdx = np.arange(rows.start, rows.stop)[:, None], np.arange(cols.start, cols.stop)[None, :]
+            mask = rowIdx > colIdx
+            index = torch.as_tensor(storage.condensedIndex(rowIdx, colIdx, numArrays)[mask], device=pairwiseDists.device)
+            pairwiseDists[index] = block[torch.as_tensor(mask, device=block.device)]
+            return
+        pairwiseDists[rows, cols] = block
+        if assumeDistIsSymmetric:
+            pairwiseDists[cols, rows] = block.T
+
+    def calculatePairwiseDistances(Matrices: Iterable, distance: Callable, Mats_half: Iterable = None,
+                                   Mats_neghalf: Iterable = None, fastMode: bool = False, assumeDistIsSymmetric: bool = False,
+                                   blockSize: int = None, silent: bool = False, outputFormat: str = "square",
+                                   dtype: torch.dtype = torch.float64, numThreads: int = None,
+                                   reporter: Callable = None, profile: int = 0, cacheDir: str = None) -> torch.Tensor:
+        """Block-pairwise equivalent of CorMat.gpu.utils.calculatePairwiseDistances for distances in batched.blockFunctions.
+        Inputs shared with CorMat.batched.calculatePairwiseDistances have the same meaning; computation is in float64.
+
+        Args:
+            numThreads (int, optional): torch intra-op threads to use on a CPU device during this call. Defaults to torch's setting.
+            reporter (Callable, optional): Receives progress reports; see CorMat.progress. Defaults to printing unless silent.
+            profile (int, optional): Number of slowest tiles to record in the final report. On a GPU, tiles are synchronized
+                                     before timing when profiling. Defaults to 0.
+            cacheDir (str, optional): Folder of the persistent cache of per-matrix decompositions, shared with the numpy
+                                      engine; see CorMat.cache.
+
+        Returns:
+            torch.Tensor: An N x N tensor of pairwise distances, or its condensed form, on the device.
+        """
+        if not batched.supports(distance):
+            raise ValueError(f"No block implementation exists for distance: {getattr(distance, '__name__', distance)}")
+        previousThreads = torch.get_num_threads()
+        if numThreads is not None:
+            torch.set_num_threads(numThreads)
+        tracker = progress.start(progress.totalPairs(len(Matrices), assumeDistIsSymmetric), reporter=reporter, silent=silent, profile=profile)
+        try:
+            feats = batched.prepare(Matrices, batched.requirements[distance], Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                    cacheDir=cacheDir)
+            numArrays = feats['mats'].shape[0]
+            if blockSize is None:
+                blockSize = cpuBatched.autoBlockSize(feats['mats'].shape[-1], copies=batched.pairIntermediates.get(distance, 3))
+            if outputFormat == "condensed" and not assumeDistIsSymmetric:
+                raise ValueError("The condensed output format requires assumeDistIsSymmetric=True.")
+            pairwiseDists = torch.zeros(storage.outputShape(numArrays, outputFormat), dtype=dtype, device=linalg.device)
+            progress.stage(tracker, 'pairs')
+            for rows, cols in cpuBatched.tiles(numArrays, blockSize, assumeDistIsSymmetric):
+                tileStart = time.perf_counter() if tracker is not None else None
+                block = batched.blockFunctions[distance](feats, rows, cols, fastMode=fastMode)
+                batched.writeTile(pairwiseDists, rows, cols, block, assumeDistIsSymmetric)
+                if tracker is not None:
+                    if profile and linalg.device.type == "cuda": # Kernels run asynchronously; wait for this tile's
+                        torch.cuda.synchronize()
+                    progress.update(tracker, progress.tilePairs(rows, cols, assumeDistIsSymmetric), rows, cols, time.perf_counter() - tileStart)
+        finally:
+            torch.set_num_threads(previousThreads)
+        progress.finish(tracker)
+        return pairwiseDists
@@ -7,8 +7,8 @@ class distances():
         """Recommended: Compute A^(1/2) (i.e. Ahalf) and pass that into the method. This will be faster for pairwise distance loops.
         For more, see Rajendra Bhatia, Tanvi Jain, Yongdo Lim.
         Paper Title: On the Bures-Wasserstein distance between positive definite matrices"""
-        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_matrix_power(A, 1/2)
-        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else linalg.fractional_matrix_power(B, 1/2)
+        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_mat_power(A, 1/2)
+        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else linalg.fractional_mat_power(B, 1/2)
         fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
         val = torch.trace(A) + torch.trace(B) - 2 * distances.faster_RootBuresFidelity(A, B, Ahalf=Ahalf, Bhalf=Bhalf, fastMode=fastMode)
         if val.real >= 0:
@@ -21,8 +21,8 @@ class distances():
             raise ValueError('Invalid value encountered in Bures distance.')
     
     def faster_RootBuresFidelity(A, B, *args, **kwargs):
-        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_matrix_power(A, 1/2)
-        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else linalg.fractional_matrix_power(B, 1/2)
+        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_mat_power(A, 1/2)
+        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else linalg.fractional_mat_power(B, 1/2)
         fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
         mat = Ahalf@Bhalf
         if not fastMode:
@@ -35,15 +35,15 @@ class distances():
         
     def BuresAngle(A, B, *args, **kwargs):
         """Only applicable to PSD matrices A, B with trace = 1, so that RootBuresFidelity is bounded in [-1,1]"""
-        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_matrix_power(A, 1/2)
-        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else linalg.fractional_matrix_power(B, 1/2)
+        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_mat_power(A, 1/2)
+        Bhalf = kwargs['Bhalf'] if 'Bhalf' in kwargs.keys() else linalg.fractional_mat_power(B, 1/2)
         fastMode = kwargs['fastMode'] if 'fastMode' in kwargs.keys() else False
         val = distances.faster_RootBuresFidelity(A, B, Ahalf=Ahalf, Bhalf=Bhalf, fastMode=fastMode)
         return torch.arccos(val).real
 
     def AffineInvariant(A, B, *args, **kwargs):
         "SPD, not SPSD"
-        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_matrix_power(A, 1/2)
+        Ahalf = kwargs['Ahalf'] if 'Ahalf' in kwargs.keys() else linalg.fractional_mat_power(A, 1/2)
         A_neghalf = kwargs['A_neghalf'] if 'A_neghalf' in kwargs.keys() else torch.linalg.inv(Ahalf)
         temp = A_neghalf @ B @ A_neghalf
         # TODO: Compare speed of SVD log on GPU with scipy log on cpu (which is worse, SVD or GPU/CPU back and forth?)
@@ -74,7 +74,7 @@ class distances():
     #     if Ahalf is None:
     #         Ahalf = linalg.fractional_mat_power(A, 1/2)
     #     val = torch.trace(linalg.fractional_mat_power(Ahalf@(B.to(torch.complex128))@Ahalf, 1/2))
-    #     # val = torch.trace(linalg.fractional_matrix_power(B@A, 1/2))
+    #     # val = torch.trace(linalg.fractional_mat_power(B@A, 1/2))
     #     return val
         
     # def BuresAngle(A, B, Ahalf=None, A_neghalf=None, featureDist=None):
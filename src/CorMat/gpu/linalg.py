@@ -1,17 +1,45 @@
 import torch
 
 class linalg():
-    
-    def fractional_mat_power(A, p):
-        if isinstance(A, torch.Tensor):
-            # Not as sophisticated as the scipy method, but it supports GPU computation
-            evals, evecs = torch.linalg.eig(A)
-            evals = evals
-            evpow = evals**(p)
-            return torch.matmul(evecs, torch.matmul (torch.diag(evpow), torch.inverse(evecs)))
-        else:
-            raise TypeError(f"Unsupported type found in fractional_mat_power: {type(A)}")
-        
-    def matrixLog(mat):
-        # TODO: implement this
-        raise NotImplementedError
\ No newline at end of file
+    """Matrix functions on torch tensors. Inputs may be single (d, d) matrices or stacks (..., d, d); symmetric matrices go
+    through one batched symmetric eigendecomposition (torch.linalg.eigh), which runs on the GPU or on all CPU threads."""
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu") # Where CorMat.gpu puts stacks and outputs; set to override
+
+    def eigh(A):
+        """Symmetric eigendecomposition of a matrix or stack of matrices, after symmetrizing to remove rounding asymmetry.
+
+        Returns:
+            (torch.Tensor, torch.Tensor): Eigenvalues (..., d) and eigenvectors (..., d, d).
+        """
+        if not isinstance(A, torch.Tensor):
+            raise TypeError(f"Unsupported type found in eigh: {type(A)}")
+        return torch.linalg.eigh((A + A.transpose(-1, -2)) / 2)
+
+    def eigenFunction(evals, evecs, func):
+        """Given (stacked) eigendecompositions, returns V @ diag(func(w)) @ V^T."""
+        return (evecs * func(evals).unsqueeze(-2)) @ evecs.transpose(-1, -2)
+
+    def fractional_mat_power(A, p, evals=None, evecs=None):
+        """A^p for symmetric PSD A (or a stack of them). For p > 0, negative eigenvalues (rounding error) are clipped to 0.
+        Supply either A, or a precomputed eigendecomposition (evals, evecs)."""
+        if evals is None:
+            if not isinstance(A, torch.Tensor):
+                raise TypeError(f"Unsupported type found in fractional_mat_power: {type(A)}")
+            evals, evecs = linalg.eigh(A)
+        if p > 0:
+            return linalg.eigenFunction(evals, evecs, lambda w: torch.clamp(w, min=0)**p)
+        if torch.any(evals <= 0):
+            raise ValueError('Negative powers require SPD matrices; found a non-positive eigenvalue.')
+        return linalg.eigenFunction(evals, evecs, lambda w: w**p)
+
+    def matrixLog(mat, evals=None, evecs=None):
+        """Principal matrix logarithm of a symmetric positive definite matrix (or a stack of them).
+        Supply either mat, or a precomputed eigendecomposition (evals, evecs)."""
+        if evals is None:
+            if not isinstance(mat, torch.Tensor):
+                raise TypeError(f"Unsupported type found in matrixLog: {type(mat)}")
+            evals, evecs = linalg.eigh(mat)
+        if torch.any(evals <= 0):
+            raise ValueError('Matrix logarithm requires SPD matrices; found a non-positive eigenvalue.')
+        return linalg.eigenFunction(evals, evecs, torch.log)
@@ -1,10 +1,12 @@
 # import os
+import time
 import torch
 from scipy import linalg as la
 from typing import Callable, Iterable
-
-
-device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+from CorMat.storage import storage
+from CorMat.progress import progress
+from CorMat.gpu.batched import batched
+from CorMat.gpu.linalg import linalg
 
 
 class utils():
@@ -13,31 +15,56 @@ class utils():
                                     Mats_half: Iterable = None, Mats_neghalf: Iterable = None, 
                                     DTWfeatureDist: bool = None, fastMode: bool = False,
                                     precomputeHalves: bool = False, precomputeNeghalves: bool = False, 
-                                    assumeDistIsSymmetric: bool = False, silent: bool = False):
-        """Calculates a matrix of pairwise distances between objects in an iterable."""
+                                    assumeDistIsSymmetric: bool = False, silent: bool = False,
+                                    outputFormat: str = "square", dtype: torch.dtype = torch.float64,
+                                    vectorize: bool = True, blockSize: int = None, numThreads: int = None,
+                                    reporter: Callable = None, profile: int = 0, cacheDir: str = None):
+        """Calculates a matrix of pairwise distances between objects in an iterable.
+        outputFormat and dtype behave as in CorMat.utils.calculatePairwiseDistances: "condensed" (which requires 
+        assumeDistIsSymmetric) returns a 1-D tensor in scipy's pdist layout; see CorMat.storage.
+        With vectorize (the default), distances in CorMat.gpu.batched.blockFunctions are evaluated a block of pairs at a time
+        by CorMat.gpu.batched.calculatePairwiseDistances (blockSize and numThreads are passed on); others use the pairwise loop.
+        reporter and profile report progress and the slowest pairs (or tiles) as in CorMat.utils.calculatePairwiseDistances.
+        cacheDir is the folder of the persistent cache of per-matrix decompositions, shared with the numpy engine (see
+        CorMat.cache); it is used by the vectorized path."""
         # TODO: Allow this to resume progress if interrupted?
+        if vectorize and batched.supports(distance):
+            return batched.calculatePairwiseDistances(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                                      fastMode=fastMode, assumeDistIsSymmetric=assumeDistIsSymmetric,
+                                                      blockSize=blockSize, silent=silent, outputFormat=outputFormat,
+                                                      dtype=dtype, numThreads=numThreads, reporter=reporter, profile=profile,
+                                                      cacheDir=cacheDir)
         if Mats_half is None and precomputeHalves == True:
             raise ValueError('Mats_half cannot be None if computeNeghalves is True. Alternatively, use CPU version of this function.')
         if Mats_neghalf is None and precomputeNeghalves == True:
             raise ValueError('Mats_neghalf cannot be None if computeNeghalves is True. Alternatively, use CPU version of this function.')
         
         numArrays = len(Matrices)
-        pairwiseDists = torch.zeros((numArrays, numArrays), dtype=float).to(device)
-        j=0
+        if outputFormat == "condensed" and not assumeDistIsSymmetric:
+            raise ValueError("The condensed output format requires assumeDistIsSymmetric=True.")
+        pairwiseDists = torch.zeros(storage.outputShape(numArrays, outputFormat), dtype=dtype).to(linalg.device)
+        tracker = progress.start(progress.totalPairs(numArrays, assumeDistIsSymmetric), reporter=reporter, silent=silent,
+                                 profile=profile, stage='pairs')
         for i in range(numArrays):
             innerLoopUpperIdx = i+1 if assumeDistIsSymmetric else numArrays # Loop over full rows or just lower triangle
-            if i%10 == 0 and not silent:
-                print("i =", i, "/", numArrays, "|", "j =", j, "          ", end="\r")
             A = Matrices[i]
             Ahalf = Mats_half[i] if Mats_half is not None else None
             A_neghalf = Mats_neghalf[i] if Mats_neghalf is not None else None
             for j in range(0,innerLoopUpperIdx):
-                if j%30 == 0 and not silent:
-                    print("i =", i, "/", numArrays, "|", "j =", j, "          ", end="\r")
                 B = Matrices[j]
                 Bhalf = Mats_half[j] if Mats_half is not None else None
+                pairStart = time.perf_counter() if profile else None
                 dist = distance(A, B, Ahalf=Ahalf, Bhalf=Bhalf, A_neghalf=A_neghalf, DTWfeatureDist=DTWfeatureDist, fastMode=fastMode)
+                if profile: # Per-pair bookkeeping only when profiling; otherwise progress is updated once per row
+                    progress.update(tracker, 1, i, j, time.perf_counter() - pairStart)
+                if outputFormat == "condensed":
+                    if j != i:
+                        pairwiseDists[storage.condensedIndex(i, j, numArrays)] = dist
+                    continue
                 pairwiseDists[i,j] = dist
                 if assumeDistIsSymmetric:
                     pairwiseDists[j,i] = dist
+            if tracker is not None and not profile:
+                progress.update(tracker, innerLoopUpperIdx)
+        progress.finish(tracker)
         return pairwiseDists
\ No newline at end of file
@@ -0,0 +1,175 @@
+import numpy as np
+from typing import Callable, Iterable
+from CorMat.batched import batched
+from CorMat.storage import storage
+from CorMat.progress import progress
+
+class landmarks():
+    """Approximate pairwise distances for cohorts too large for all N(N-1)/2 evaluations. A set of L landmark matrices is
+    chosen (at random, or by max-min farthest-point sampling under the distance itself), and only the N x L distances to
+    the landmarks are computed. Landmark MDS (de Silva & Tenenbaum, 2004) then places every matrix in a low-dimensional
+    Euclidean space; the embedding can be used directly, e.g. in place of MDS/Isomap coordinates, or Euclidean distances
+    between embedded points serve as a low-rank approximation of the full distance matrix. Since the quality of the
+    approximation depends on the data and the distance, errors are measured on a random sample of held-out pairs."""
+
+    def distancesTo(distance: Callable, feats: dict, landmark: int, fastMode: bool = False, DTWfeatureDist: Callable = None,
+                    blockSize: int = None) -> np.ndarray:
+        """Distances from every matrix to matrix <landmark>, a column of the pairwise matrix, evaluated in blocks of rows.
+        feats is as returned by batched.prepareFor."""
+        numArrays = len(feats['mats'])
+        blockSize = blockSize if blockSize is not None else batched.defaultBlockSize(distance, feats) ** 2 # As many pairs as one square tile
+        column = np.empty(numArrays)
+        for start in range(0, numArrays, blockSize):
+            rows = slice(start, min(start + blockSize, numArrays))
+            column[rows] = batched.evaluateTile(distance, feats, rows, slice(landmark, landmark + 1), fastMode=fastMode,
+                                                DTWfeatureDist=DTWfeatureDist)[:, 0]
+        return column
+
+    def selectLandmarks(Matrices: Iterable, distance: Callable, numLandmarks: int, method: str = "maxmin", seed: int = 0,
+                        feats: dict = None, fastMode: bool = False, DTWfeatureDist: Callable = None, silent: bool = False,
+                        reporter: Callable = None, tracker: dict = None):
+        """Chooses landmarks and computes the distances from every matrix to each of them.
+
+        Args:
+            method (str, optional): "random", or "maxmin": start from a random matrix, then repeatedly add the matrix whose
+                                    distance to its nearest landmark is largest, which spreads landmarks over the cohort
+                                    (including outliers). Both cost N distances per landmark. Defaults to "maxmin".
+            feats (dict, optional): Per-matrix inputs from batched.prepareFor; computed from Matrices if None.
+            reporter (Callable, optional): Receives progress reports, counting landmarks; see CorMat.progress.
+            tracker (dict, optional): A progress tracker to advance instead of starting (and finishing) one here.
+
+        Returns:
+            (np.ndarray, np.ndarray): Indices of the L landmarks, and the N x L distances to them.
+        """
+        feats = feats if feats is not None else batched.prepareFor(distance, Matrices)
+        numArrays = len(feats['mats'])
+        if not 1 < numLandmarks <= numArrays:
+            raise ValueError(f"numLandmarks must be between 2 and the number of matrices ({numArrays}); got {numLandmarks}.")
+        rng = np.random.default_rng(seed)
+        if method == "random":
+            indices = np.sort(rng.choice(numArrays, size=numLandmarks, replace=False))
+        elif method == "maxmin":
+            indices = np.empty(numLandmarks, dtype=int)
+            indices[0] = rng.integers(numArrays)
+        else:
+            raise ValueError(f"Unknown landmark method: {method}. Use 'random' or 'maxmin'.")
+        ownTracker = tracker is None
+        if ownTracker:
+            tracker = progress.start(numLandmarks, reporter=reporter, silent=silent, stage='landmarks', unit='landmarks')
+        landmarkDists = np.empty((numArrays, numLandmarks))
+        for k in range(numLandmarks):
+            landmarkDists[:, k] = landmarks.distancesTo(distance, feats, indices[k], fastMode=fastMode, DTWfeatureDist=DTWfeatureDist)
+            if method == "maxmin" and k + 1 < numLandmarks:
+                nearest = landmarkDists[:, :k + 1].min(axis=1)
+                nearest[indices[:k + 1]] = -np.inf
+                indices[k + 1] = np.argmax(nearest)
+            if tracker is not None:
+                progress.update(tracker, 1)
+        if ownTracker:
+            progress.finish(tracker)
+        return indices, landmarkDists
+
+    def landmarkMDS(landmarkDists: np.ndarray, indices: np.ndarray, numDims: int = None, tol: float = 10**-8) -> np.ndarray:
+        """Landmark MDS. Classical MDS of the landmarks' own distances gives their coordinates; every other matrix is then
+        placed by distance-based triangulation from its squared distances to the landmarks.
+
+        Args:
+            landmarkDists (np.ndarray): N x L distances to the landmarks, from selectLandmarks.
+            indices (np.ndarray): Indices of the landmarks.
+            numDims (int, optional): Embedding dimension. Defaults to every dimension with an eigenvalue above tol.
+            tol (float, optional): Eigenvalues below tol times the largest are treated as 0. Triangulation divides by the
+                                   square roots of the eigenvalues, so keeping rounding-level ones amplifies noise. Defaults to 1e-8.
+
+        Returns:
+            np.ndarray: N x numDims coordinates.
+        """
+        deltas = landmarkDists**2
+        landmarkDeltas = deltas[indices]
+        landmarkDeltas = (landmarkDeltas + landmarkDeltas.T) / 2
+        numLandmarks = len(indices)
+        centering = np.eye(numLandmarks) - 1 / numLandmarks
+        evals, evecs = np.linalg.eigh(-centering @ landmarkDeltas @ centering / 2)
+        evals, evecs = evals[::-1], evecs[:, ::-1]
+        positive = int(np.sum(evals > evals[0] * tol))
+        numDims = positive if numDims is None else numDims
+        if numDims > positive:
+            raise ValueError(f"Only {positive} dimensions have eigenvalues above tol; got numDims = {numDims}.")
+        pseudoinverse = evecs[:, :numDims] / np.sqrt(evals[:numDims]) # Transposed pseudoinverse of the landmark coordinates
+        return -(deltas - landmarkDeltas.mean(axis=0)) @ pseudoinverse / 2
+
+    def approximateDistances(coords: np.ndarray, outputFormat: str = "square", dtype=np.float64, filename: str = None,
+                             blockSize: int = 2048) -> np.ndarray:
+        """Low-rank approximation of the full distance matrix: Euclidean distances between embedded points, written tile by
+        tile in any layout of CorMat.storage (an .npy-backed np.memmap if filename is given)."""
+        numArrays = coords.shape[0]
+        flats = np.ascontiguousarray(coords, dtype=np.float64)
+        normsSq = np.sum(flats**2, axis=1)
+        out = storage.allocate(numArrays, outputFormat, dtype=dtype, filename=filename)
+        for rows, cols in batched.tiles(numArrays, blockSize, assumeDistIsSymmetric=True):
+            batched.writeTile(out, rows, cols, batched.GramDistanceBlock(flats, normsSq, rows, cols), assumeDistIsSymmetric=True)
+        return out
+
+    def heldOutError(distance: Callable, feats: dict, coords: np.ndarray, numPairs: int = 1000, seed: int = 0,
+                     fastMode: bool = False, DTWfeatureDist: Callable = None) -> dict:
+        """Compares approximate distances (between rows of coords) with exact ones on numPairs random pairs i != j.
+
+        Returns:
+            dict: 'pairs' (numPairs x 2 indices), 'exact' and 'approx' distances, 'meanAbsError', 'maxAbsError',
+            'relativeError' (root-mean-square error over root-mean-square exact distance) and 'correlation'.
+        """
+        numArrays = len(feats['mats'])
+        rng = np.random.default_rng(seed)
+        first = rng.integers(numArrays, size=numPairs)
+        second = (first + rng.integers(1, numArrays, size=numPairs)) % numArrays
+        exact = batched.evaluatePairs(distance, feats, first, second, fastMode=fastMode, DTWfeatureDist=DTWfeatureDist)
+        approx = np.linalg.norm(coords[first] - coords[second], axis=1)
+        err = approx - exact
+        return {'pairs': np.stack([first, second], axis=1), 'exact': exact, 'approx': approx,
+                'meanAbsError': float(np.mean(np.abs(err))), 'maxAbsError': float(np.max(np.abs(err))),
+                'relativeError': float(np.sqrt(np.mean(err**2) / np.mean(exact**2))),
+                'correlation': float(np.corrcoef(exact, approx)[0, 1])}
+
+    def calculateApproximateDistances(Matrices: Iterable, distance: Callable, numLandmarks: int, method: str = "maxmin",
+                                      output: str = "embedding", numDims: int = None, Mats_half: Iterable = None,
+                                      Mats_neghalf: Iterable = None, DTWfeatureDist: Callable = None, fastMode: bool = False,
+                                      numHeldOut: int = 1000, seed: int = 0, silent: bool = False,
+                                      outputFormat: str = "square", dtype=np.float64, filename: str = None,
+                                      reporter: Callable = None):
+        """Approximate counterpart of CorMat.utils.calculatePairwiseDistances, using N x L rather than N(N-1)/2 distance evaluations.
+
+        Args:
+            numLandmarks (int): Number of landmarks L.
+            method (str, optional): Landmark selection, "maxmin" or "random"; see selectLandmarks. Defaults to "maxmin".
+            output (str, optional): "embedding" for the N x numDims landmark MDS coordinates, or "matrix" for the approximate
+                                    N x N distances (in outputFormat and dtype, optionally memory-mapped to filename). Defaults to "embedding".
+            numDims (int, optional): Embedding dimension. Defaults to every dimension with a non-negligible eigenvalue, which
+                                     gives the closest approximation of the distances; see landmarkMDS.
+            numHeldOut (int, optional): Number of random pairs on which to measure the approximation error; 0 skips it. Defaults to 1000.
+            reporter (Callable, optional): Receives progress reports, counting landmarks; the final report also has the
+                                           held-out 'relativeError' and 'correlation' in its 'info'. See CorMat.progress.
+            Other inputs are as in CorMat.utils.calculatePairwiseDistances.
+
+        Returns:
+            (np.ndarray, dict): The embedding or approximate distance matrix, and a report with the landmark 'indices', the
+            N x L 'landmarkDists', the 'embedding', and the held-out 'error' (see heldOutError; None if numHeldOut is 0).
+        """
+        if output not in ("embedding", "matrix"):
+            raise ValueError(f"Unknown output: {output}. Use 'embedding' or 'matrix'.")
+        tracker = progress.start(numLandmarks, reporter=reporter, silent=silent, unit='landmarks')
+        feats = batched.prepareFor(distance, Matrices, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf)
+        progress.stage(tracker, 'landmarks')
+        indices, landmarkDists = landmarks.selectLandmarks(Matrices, distance, numLandmarks, method=method, seed=seed, feats=feats,
+                                                           fastMode=fastMode, DTWfeatureDist=DTWfeatureDist, silent=silent, tracker=tracker)
+        progress.stage(tracker, 'embedding')
+        coords = landmarks.landmarkMDS(landmarkDists, indices, numDims=numDims)
+        error = None
+        if numHeldOut > 0:
+            progress.stage(tracker, 'heldOut')
+            error = landmarks.heldOutError(distance, feats, coords, numPairs=numHeldOut, seed=seed + 1, fastMode=fastMode,
+                                           DTWfeatureDist=DTWfeatureDist)
+            progress.note(tracker, relativeError=error['relativeError'], correlation=error['correlation'])
+        progress.finish(tracker)
+        report = {'indices': indices, 'landmarkDists': landmarkDists, 'embedding': coords, 'error': error}
+        if output == "embedding":
+            return coords, report
+        return landmarks.approximateDistances(coords, outputFormat=outputFormat, dtype=dtype, filename=filename), report
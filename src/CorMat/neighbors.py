@@ -0,0 +1,184 @@
+import numpy as np
+from typing import Callable, Iterable
+from CorMat.distances import distances
+from CorMat.batched import batched
+from CorMat.storage import storage
+from CorMat.progress import progress
+
+class neighbors():
+    """Exact nearest-neighbor queries without the full pairwise matrix, using a vantage-point tree. Each internal node
+    holds a vantage matrix and the median distance from it to the matrices below; by the triangle inequality, a whole
+    subtree can be skipped when the query is far enough inside or outside that sphere. Leaves hold small buckets of
+    matrices whose distances to the query are evaluated together, with the block kernels of CorMat.batched where available.
+
+    This is only exact for true metrics. BuresDistance, AffineInvariant, LogFrobenius and Euclidean are metrics; BuresAngle
+    is one only on trace-1 matrices (it is NaN for correlation matrices), so it needs checkMetric=False and normalized inputs;
+    as in CorMat.batched, computed distances carry rounding error (up to about 1e-7 between nearly identical matrices for
+    Bures), so neighbors tied to within that error may be returned in either order."""
+
+    metrics = (distances.BuresDistance, distances.AffineInvariant, distances.LogFrobenius, distances.Euclidean)
+
+    def _subset(feats: dict, idx) -> dict:
+        """The per-matrix inputs of the matrices at positions idx."""
+        return {name: arr[idx] if isinstance(arr, np.ndarray) else [arr[i] for i in idx] for name, arr in feats.items()}
+
+    def _concatenate(first: dict, second: dict) -> dict:
+        return {name: np.concatenate([first[name], second[name]]) if isinstance(first[name], np.ndarray)
+                else list(first[name]) + list(second[name]) for name in first}
+
+    def _distances(index: dict, queryFeats: dict, targets: np.ndarray, queryIndex: int = None) -> np.ndarray:
+        """Distances from the query to the indexed matrices at positions targets, evaluated as one tile."""
+        if len(targets) == 0:
+            return np.empty(0)
+        index['evaluations'] += len(targets)
+        feats = neighbors._concatenate(queryFeats, neighbors._subset(index['feats'], targets))
+        dists = batched.evaluateTile(index['distance'], feats, slice(0, 1), slice(1, len(targets) + 1),
+                                     fastMode=index['fastMode'], DTWfeatureDist=index['DTWfeatureDist'])[0]
+        if queryIndex is not None:
+            dists[targets == queryIndex] = 0 # A matrix is at distance exactly 0 from itself
+        return dists
+
+    def _build(index: dict, members: np.ndarray, rng: np.random.Generator, leafSize: int) -> dict:
+        if len(members) <= leafSize:
+            return {'leaf': members}
+        vantage = members[rng.integers(len(members))]
+        others = members[members != vantage]
+        dists = neighbors._distances(index, neighbors._subset(index['feats'], [vantage]), others, queryIndex=vantage)
+        radius = np.median(dists)
+        # Queries rely on every member inside being within radius of the vantage point and every member outside being at
+        # least radius away, so members tied with the median may go to either side but no others may
+        inside = dists <= radius
+        if inside.all(): # Over half of the distances tie at the median; put the ties outside instead
+            inside = dists < radius
+        if not inside.any(): # Every distance equals radius, so any split keeps both sides consistent with it
+            inside = np.arange(len(others)) < len(others) // 2
+        return {'vantage': vantage, 'radius': radius,
+                'inside': neighbors._build(index, others[inside], rng, leafSize),
+                'outside': neighbors._build(index, others[~inside], rng, leafSize)}
+
+    def buildIndex(Matrices: Iterable, distance: Callable, Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                   DTWfeatureDist: Callable = None, fastMode: bool = False, leafSize: int = 32, seed: int = 0,
+                   checkMetric: bool = True) -> dict:
+        """Builds a vantage-point tree over Matrices. Construction takes about N log2(N / leafSize) distance evaluations.
+
+        Args:
+            Matrices (Iterable): The matrices to index.
+            distance (Callable): A metric from CorMat.distances (see neighbors.metrics), or any callable with the same signature.
+            leafSize (int, optional): Matrices per leaf bucket. Defaults to 32.
+            seed (int, optional): Seed for the choice of vantage points. Defaults to 0.
+            checkMetric (bool, optional): Raise for distances not listed in neighbors.metrics, since pruning assumes the
+                                          triangle inequality. Defaults to True.
+            Other inputs are as in CorMat.utils.calculatePairwiseDistances.
+
+        Returns:
+            dict: The tree ('root'), per-matrix inputs, settings, and the running count of distance 'evaluations'.
+        """
+        if checkMetric and distance not in neighbors.metrics:
+            raise ValueError(f"{getattr(distance, '__name__', distance)} is not known to be a metric; "
+                             "use checkMetric=False if it satisfies the triangle inequality.")
+        feats = batched.prepareFor(distance, Matrices, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf)
+        index = {'distance': distance, 'feats': feats, 'fastMode': fastMode, 'DTWfeatureDist': DTWfeatureDist,
+                 'numArrays': len(feats['mats']), 'evaluations': 0}
+        index['root'] = neighbors._build(index, np.arange(index['numArrays']), np.random.default_rng(seed), leafSize)
+        index['buildEvaluations'] = index['evaluations']
+        return index
+
+    def _queryFeats(index: dict, query, queryIndex: int) -> dict:
+        if (query is None) == (queryIndex is None):
+            raise ValueError("Give exactly one of query (a new matrix) or queryIndex (an indexed matrix).")
+        if queryIndex is not None:
+            return neighbors._subset(index['feats'], [queryIndex])
+        if batched.supports(index['distance']):
+            return batched.prepare([query], batched.requirements[index['distance']])
+        return {'mats': [query]}
+
+    def kNearest(index: dict, k: int, query=None, queryIndex: int = None):
+        """The k indexed matrices nearest to a new matrix (query) or to an indexed one (queryIndex, which is then its own
+        first neighbor, at distance 0).
+
+        Returns:
+            (np.ndarray, np.ndarray, int): Indices and distances of the neighbors, sorted by distance, and the number of
+            distance evaluations used (brute force would use N).
+        """
+        queryFeats = neighbors._queryFeats(index, query, queryIndex)
+        start = index['evaluations']
+        bestIdx, best = np.empty(0, dtype=int), np.empty(0)
+
+        def offer(candidates, dists):
+            nonlocal bestIdx, best
+            allIdx, allDists = np.concatenate([bestIdx, candidates]), np.concatenate([best, dists])
+            order = np.argsort(allDists, kind='stable')[:k]
+            bestIdx, best = allIdx[order], allDists[order]
+
+        def search(node):
+            if 'leaf' in node:
+                offer(node['leaf'], neighbors._distances(index, queryFeats, node['leaf'], queryIndex))
+                return
+            vantage = np.array([node['vantage']])
+            dist = neighbors._distances(index, queryFeats, vantage, queryIndex)
+            offer(vantage, dist)
+            dist = dist[0]
+            near, far = ('inside', 'outside') if dist <= node['radius'] else ('outside', 'inside')
+            search(node[near])
+            tau = best[-1] if len(best) == k else np.inf # Only a subtree that can hold something within tau is searched
+            if (far == 'outside' and dist + tau >= node['radius']) or (far == 'inside' and dist - tau <= node['radius']):
+                search(node[far])
+
+        search(index['root'])
+        return bestIdx, best, index['evaluations'] - start
+
+    def radiusNeighbors(index: dict, radius: float, query=None, queryIndex: int = None):
+        """All indexed matrices within radius of a new matrix (query) or of an indexed one (queryIndex).
+
+        Returns:
+            (np.ndarray, np.ndarray, int): Indices and distances of the neighbors, sorted by distance, and the number of
+            distance evaluations used (brute force would use N).
+        """
+        queryFeats = neighbors._queryFeats(index, query, queryIndex)
+        start = index['evaluations']
+        found, foundDists = [], []
+
+        def search(node):
+            if 'leaf' in node:
+                dists = neighbors._distances(index, queryFeats, node['leaf'], queryIndex)
+                found.append(node['leaf'][dists <= radius])
+                foundDists.append(dists[dists <= radius])
+                return
+            dist = neighbors._distances(index, queryFeats, np.array([node['vantage']]), queryIndex)[0]
+            if dist <= radius:
+                found.append(np.array([node['vantage']]))
+                foundDists.append(np.array([dist]))
+            if dist - radius <= node['radius']:
+                search(node['inside'])
+            if dist + radius >= node['radius']:
+                search(node['outside'])
+
+        search(index['root'])
+        found, foundDists = np.concatenate(found), np.concatenate(foundDists)
+        order = np.argsort(foundDists, kind='stable')
+        return found[order], foundDists[order], index['evaluations'] - start
+
+    def kNeighborsGraph(index: dict, k: int, silent: bool = False, reporter: Callable = None):
+        """Exact k-nearest-neighbor graph of the indexed matrices, in the format of CorMat.storage.kNeighborsGraph (each
+        matrix is included as its own neighbor, as an explicit 0), so it can be passed to sklearn or umap directly.
+        Progress, counting queries, goes to reporter (see CorMat.progress); by default it is printed unless silent.
+
+        Returns:
+            (scipy.sparse.csr_matrix, dict): The graph, and counts of distance 'evaluations' (including building the
+            index), 'bruteForce' (N(N-1)/2, as for a symmetric calculatePairwiseDistances) and their 'ratio'. For small
+            cohorts, building the index alone can take more evaluations than brute force, so the ratio can exceed 1.
+        """
+        numArrays = index['numArrays']
+        indices = np.empty((numArrays, min(k + 1, numArrays)), dtype=int)
+        knnDists = np.empty(indices.shape)
+        evaluations = index['buildEvaluations']
+        tracker = progress.start(numArrays, reporter=reporter, silent=silent, stage='queries', unit='queries')
+        for i in range(numArrays):
+            indices[i], knnDists[i], used = neighbors.kNearest(index, indices.shape[1], queryIndex=i)
+            evaluations += used
+            if tracker is not None:
+                progress.update(tracker, 1)
+        progress.finish(tracker)
+        bruteForce = numArrays * (numArrays - 1) // 2
+        stats = {'evaluations': evaluations, 'bruteForce': bruteForce, 'ratio': evaluations / max(bruteForce, 1)}
+        return storage.graphFromNeighbors(indices, knnDists), stats
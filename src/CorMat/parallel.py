@@ -0,0 +1,264 @@
+import os
+import mmap
+import time
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable
+from CorMat.batched import batched
+from CorMat.storage import storage
+from CorMat.progress import progress
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+class parallel():
+    """Multi-core scheduler for pairwise distances. The pairwise matrix (or its lower triangle) is split into the tiles of
+    CorMat.batched.tiles, and the tiles are evaluated concurrently with batched.evaluateTile, so any distance from
+    CorMat.distances (or any callable with the same signature) can be used.
+
+    Two backends are available. 'process' runs tiles on a process pool; the stacked input matrices, their precomputed
+    halves and the output matrix are placed in shared memory (or, if they are already np.memmap files, reopened from
+    disk), so workers attach to them rather than receiving pickled copies. 'thread' runs tiles on a thread pool in this process; numpy releases the GIL inside its batched LAPACK and
+    matmul calls, so this scales well for distances with a block implementation, but not for pure-Python per-pair callables."""
+
+    blasEnvVars = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+    _worker = {} # State of a pool worker process: attached shared arrays and the settings of the current computation
+
+    def toSharedMemory(arrays: dict):
+        """Copies each numpy array of a dict into its own SharedMemory block.
+
+        Returns:
+            (list, dict): The SharedMemory blocks (the caller must close and unlink them), and a picklable dict of
+            name -> (block name, shape, dtype) specs for fromSharedMemory.
+        """
+        blocks, specs = [], {}
+        for name, arr in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            specs[name] = (shm.name, arr.shape, arr.dtype.str)
+        return blocks, specs
+
+    def fromSharedMemory(specs: dict):
+        """Attaches to blocks made by toSharedMemory. Returns (blocks, arrays); keep the blocks referenced while arrays are in use."""
+        blocks, arrays = [], {}
+        for name, (shmName, shape, dtype) in specs.items():
+            shm = shared_memory.SharedMemory(name=shmName)
+            blocks.append(shm)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        return blocks, arrays
+
+    def limitBLASThreads(blasThreads: int):
+        """Limits the BLAS/OpenMP thread pools of the current process, if threadpoolctl is installed. Returns the limiter
+        (keep it referenced for the limit to stay in effect), or None."""
+        if blasThreads is None or threadpool_limits is None:
+            return None
+        return threadpool_limits(limits=blasThreads)
+
+    def isMemmapFile(arr) -> bool:
+        """True if arr is a whole file-backed np.memmap (not a view of one), so that toMemmapSpec describes it exactly."""
+        return isinstance(arr, np.memmap) and arr.filename is not None and isinstance(arr.base, mmap.mmap)
+
+    def toMemmapSpec(arr: np.memmap) -> tuple:
+        """Picklable (filename, shape, dtype, offset) description of a file-backed memmap, for fromMemmapSpec."""
+        return (arr.filename, arr.shape, arr.dtype.str, arr.offset)
+
+    def fromMemmapSpec(spec: tuple, mode: str = 'r') -> np.memmap:
+        """Reopens a memmap described by toMemmapSpec."""
+        filename, shape, dtype, offset = spec
+        return np.memmap(filename, dtype=np.dtype(dtype), mode=mode, shape=shape, offset=offset)
+
+    def _initWorker(specs: dict, fileSpecs: dict, localFeats: dict, outSpec: tuple, settings: dict, blasThreads: int):
+        """Pool initializer; runs once per worker process."""
+        blocks, arrays = parallel.fromSharedMemory(specs)
+        files = {name: parallel.fromMemmapSpec(spec) for name, spec in fileSpecs.items()}
+        parallel._worker['blocks'] = blocks
+        parallel._worker['feats'] = {**localFeats, **arrays, **files}
+        if outSpec[0] == 'memmap':
+            parallel._worker['out'] = parallel.fromMemmapSpec(outSpec[1], mode='r+')
+        else:
+            outBlocks, outArrays = parallel.fromSharedMemory({'out': outSpec[1]})
+            parallel._worker['blocks'] += outBlocks
+            parallel._worker['out'] = outArrays['out']
+        parallel._worker['settings'] = settings
+        parallel._worker['limiter'] = parallel.limitBLASThreads(blasThreads)
+
+    def _evaluateAndWrite(feats: dict, out: np.ndarray, rows: slice, cols: slice, settings: dict) -> float:
+        """Evaluates one tile and writes it into out (flushing it to disk if out is a memmap). Returns the seconds taken."""
+        tileStart = time.perf_counter()
+        block = batched.evaluateTile(settings['distance'], feats, rows, cols, fastMode=settings['fastMode'],
+                                     DTWfeatureDist=settings['DTWfeatureDist'], assumeDistIsSymmetric=settings['assumeDistIsSymmetric'])
+        batched.writeTile(out, rows, cols, block, settings['assumeDistIsSymmetric'])
+        if isinstance(out, np.memmap):
+            out.flush()
+        return time.perf_counter() - tileStart
+
+    def _runTile(rows: slice, cols: slice) -> float:
+        """Evaluates one tile in a worker process, writing it straight into the shared output."""
+        return parallel._evaluateAndWrite(parallel._worker['feats'], parallel._worker['out'], rows, cols, parallel._worker['settings'])
+
+    def _shareable(feats: dict):
+        """Splits per-matrix inputs into stackable arrays (to be placed in shared memory), specs of memmap files (reopened
+        by each worker) and everything else (sent to each worker once, when the pool starts)."""
+        arrays, files, others = {}, {}, {}
+        for name, val in feats.items():
+            if parallel.isMemmapFile(val):
+                files[name] = parallel.toMemmapSpec(val)
+                continue
+            if not isinstance(val, np.ndarray):
+                try:
+                    val = batched.stack(val)
+                except (ValueError, TypeError): # e.g. timeseries of different lengths
+                    pass
+            (arrays if isinstance(val, np.ndarray) else others)[name] = val
+        return arrays, files, others
+
+    def defaultBlockSize(distance: Callable, feats: dict, nWorkers: int) -> int:
+        """batched.defaultBlockSize, reduced if needed so that every worker has tiles to evaluate."""
+        return max(1, min(batched.defaultBlockSize(distance, feats), -(-len(feats['mats']) // max(1, nWorkers))))
+
+    def prepare(Matrices: Iterable, distance: Callable, Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                precomputeHalves: bool = False, precomputeNeghalves: bool = False, cacheDir: str = None) -> dict:
+        """batched.prepareFor, honouring the precompute flags of calculatePairwiseDistances for distances without a block
+        implementation. With cacheDir, decompositions come from the persistent cache (see batched.cachedDecompositions)."""
+        if not batched.supports(distance):
+            if cacheDir is not None and ((Mats_half is None and precomputeHalves) or (Mats_neghalf is None and precomputeNeghalves)):
+                cached = batched.cachedDecompositions(Matrices, [name for name, needed in (('half', Mats_half is None and precomputeHalves),
+                                                                                           ('neghalf', Mats_neghalf is None and precomputeNeghalves)) if needed], cacheDir)
+                Mats_half = cached['half'] if 'half' in cached else Mats_half
+                Mats_neghalf = cached['neghalf'] if 'neghalf' in cached else Mats_neghalf
+            if Mats_half is None and precomputeHalves == True:
+                Mats_half = batched.sqrtm(Matrices)
+            if Mats_neghalf is None and precomputeNeghalves == True:
+                Mats_neghalf = np.linalg.inv(batched.stack(Mats_half))
+        return batched.prepareFor(distance, Matrices, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf, cacheDir=cacheDir)
+
+    def runTiles(distance: Callable, feats: dict, tiles: list, out: np.ndarray,
+                 DTWfeatureDist: Callable = None, fastMode: bool = False, assumeDistIsSymmetric: bool = False,
+                 nWorkers: int = None, blasThreads: int = 1, backend: str = "process", startMethod: str = None,
+                 onTileDone: Callable = None, silent: bool = False, tracker: dict = None):
+        """Evaluates the given tiles of a pairwise matrix into out, which may be an np.memmap. Runs serially if nWorkers is 1,
+        otherwise on a pool as described in the class docstring. A memmap output is opened directly by each worker process
+        and flushed after every tile; any other output is placed in shared memory and copied back at the end.
+
+        Args:
+            feats (dict): Per-matrix inputs, from prepare.
+            tiles (list): (rows, cols) slices, as yielded by batched.tiles.
+            out (np.ndarray): The output, square or condensed (see CorMat.storage); tiles are written in place.
+            onTileDone (Callable, optional): Called in this process as onTileDone(rows, cols) once each tile has been written.
+            tracker (dict, optional): A CorMat.progress tracker to advance as tiles complete. If None, one that prints
+                                      progress is used unless silent.
+            Other inputs are as in calculatePairwiseDistances.
+        """
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown backend: {backend}. Use 'process' or 'thread'.")
+        nWorkers = nWorkers if nWorkers is not None else os.cpu_count()
+        settings = {'distance': distance, 'fastMode': fastMode, 'DTWfeatureDist': DTWfeatureDist, 'assumeDistIsSymmetric': assumeDistIsSymmetric}
+        ownTracker = tracker is None and not silent
+        if ownTracker:
+            tracker = progress.start(sum(progress.tilePairs(rows, cols, assumeDistIsSymmetric) for rows, cols in tiles), stage='pairs')
+        parallel._runTiles(feats, tiles, out, settings, nWorkers, blasThreads, backend, startMethod, onTileDone, tracker)
+        if ownTracker:
+            progress.finish(tracker)
+
+    def _runTiles(feats: dict, tiles: list, out: np.ndarray, settings: dict, nWorkers: int, blasThreads: int, backend: str,
+                  startMethod: str, onTileDone: Callable, tracker: dict):
+        """Body of runTiles, once settings are gathered and the progress tracker is chosen."""
+        if nWorkers <= 1 or backend == "thread":
+            limiter = parallel.limitBLASThreads(blasThreads) if nWorkers > 1 else None
+            with ThreadPoolExecutor(max_workers=max(1, nWorkers)) as pool:
+                futures = {pool.submit(parallel._evaluateAndWrite, feats, out, rows, cols, settings): (rows, cols) for rows, cols in tiles}
+                parallel._collect(futures, onTileDone, tracker, settings['assumeDistIsSymmetric'])
+            return
+
+        arrays, fileSpecs, others = parallel._shareable(feats)
+        blocks, specs = parallel.toSharedMemory(arrays)
+        del arrays
+        if parallel.isMemmapFile(out):
+            outSpec = ('memmap', parallel.toMemmapSpec(out))
+        else:
+            outBlocks, outSpecs = parallel.toSharedMemory({'out': out})
+            blocks += outBlocks
+            outSpec = ('shared', outSpecs['out'])
+        savedEnv = {var: os.environ.get(var) for var in parallel.blasEnvVars}
+        try:
+            if blasThreads is not None:
+                os.environ.update({var: str(blasThreads) for var in parallel.blasEnvVars})
+            context = mp.get_context(startMethod)
+            with ProcessPoolExecutor(max_workers=nWorkers, mp_context=context, initializer=parallel._initWorker,
+                                     initargs=(specs, fileSpecs, others, outSpec, settings, blasThreads)) as pool:
+                futures = {pool.submit(parallel._runTile, rows, cols): (rows, cols) for rows, cols in tiles}
+                parallel._collect(futures, onTileDone, tracker, settings['assumeDistIsSymmetric'])
+            if outSpec[0] == 'shared':
+                _, outArrays = parallel.fromSharedMemory({'out': outSpec[1]})
+                out[...] = outArrays['out']
+                del outArrays
+        finally:
+            for var, val in savedEnv.items():
+                if val is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = val
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def calculatePairwiseDistances(Matrices: Iterable, distance: Callable,
+                                   Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                                   DTWfeatureDist: Callable = None, fastMode: bool = False,
+                                   precomputeHalves: bool = False, precomputeNeghalves: bool = False,
+                                   assumeDistIsSymmetric: bool = False, silent: bool = False,
+                                   nWorkers: int = None, blockSize: int = None, blasThreads: int = 1,
+                                   backend: str = "process", startMethod: str = None,
+                                   outputFormat: str = "square", dtype=np.float64,
+                                   reporter: Callable = None, profile: int = 0, cacheDir: str = None) -> np.ndarray:
+        """Multi-core equivalent of CorMat.utils.calculatePairwiseDistances. Inputs shared with that function have the same meaning.
+
+        Args:
+            nWorkers (int, optional): Number of worker processes or threads. Defaults to os.cpu_count().
+            blockSize (int, optional): Rows/columns per tile. Defaults to parallel.defaultBlockSize.
+            blasThreads (int, optional): BLAS threads per worker, to avoid oversubscription; None leaves BLAS alone. Enforced with
+                                         threadpoolctl when installed; otherwise via environment variables, which only take
+                                         effect for workers started with the 'spawn' or 'forkserver' start methods. Defaults to 1.
+            backend (str, optional): 'process' or 'thread'; see the class docstring. Defaults to "process".
+            startMethod (str, optional): multiprocessing start method for the 'process' backend. Defaults to the platform default.
+                                         The distance (and DTWfeatureDist) must be picklable for this backend.
+            outputFormat (str, optional): "square", or "condensed" (requires assumeDistIsSymmetric); see CorMat.storage. Defaults to "square".
+            dtype (optional): dtype of the result, e.g. np.float32. Defaults to np.float64.
+            reporter (Callable, optional): Receives progress reports; see CorMat.progress. Defaults to printing unless silent.
+            profile (int, optional): Number of slowest tiles to record in the final report. Defaults to 0.
+            cacheDir (str, optional): Folder of the persistent cache of per-matrix decompositions; see CorMat.cache.
+
+        Returns:
+            np.ndarray: An N x N matrix of pairwise distances, or its condensed form.
+        """
+        tracker = progress.start(progress.totalPairs(len(Matrices), assumeDistIsSymmetric), reporter=reporter, silent=silent, profile=profile)
+        feats = parallel.prepare(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                 precomputeHalves=precomputeHalves, precomputeNeghalves=precomputeNeghalves, cacheDir=cacheDir)
+        numArrays = len(feats['mats'])
+        nWorkers = nWorkers if nWorkers is not None else os.cpu_count()
+        if blockSize is None:
+            blockSize = parallel.defaultBlockSize(distance, feats, nWorkers)
+        pairwiseDists = storage.allocate(numArrays, outputFormat, dtype=dtype, assumeDistIsSymmetric=assumeDistIsSymmetric)
+        progress.stage(tracker, 'pairs')
+        parallel.runTiles(distance, feats, list(batched.tiles(numArrays, blockSize, assumeDistIsSymmetric)), pairwiseDists,
+                          DTWfeatureDist=DTWfeatureDist, fastMode=fastMode, assumeDistIsSymmetric=assumeDistIsSymmetric,
+                          nWorkers=nWorkers, blasThreads=blasThreads, backend=backend, startMethod=startMethod, silent=True,
+                          tracker=tracker)
+        progress.finish(tracker)
+        return pairwiseDists
+
+    def _collect(futures: dict, onTileDone: Callable = None, tracker: dict = None, assumeDistIsSymmetric: bool = False):
+        """Waits for all tile futures (mapped to their (rows, cols)), re-raising the first worker error. Calls onTileDone for
+        each finished tile and advances the progress tracker, if any, with the tile's pairs and evaluation time."""
+        for future in as_completed(futures):
+            seconds = future.result()
+            rows, cols = futures[future]
+            if onTileDone is not None:
+                onTileDone(rows, cols)
+            if tracker is not None:
+                progress.update(tracker, progress.tilePairs(rows, cols, assumeDistIsSymmetric), rows, cols, seconds)
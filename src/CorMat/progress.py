@@ -0,0 +1,154 @@
+import time
+import heapq
+import logging
+from typing import Callable
+
+class progress():
+    """Progress, throughput and timing of pairwise computations. The pairwise functions create a tracker (a dict, from start)
+    and advance it as pairs or tiles complete; a reporter, any callable taking the report dict described in report, is
+    called at most once every interval seconds and once more when the computation finishes. Time is split between stages:
+    'precompute' (square roots, inverse square roots and logs of every matrix) and 'pairs' (pair evaluation), so the
+    throughput and ETA only reflect pair evaluation.
+
+    With silent=True, no reporter and no profiling, start returns None and the pairwise functions skip all bookkeeping.
+    With profile=k, the k slowest pairs are recorded, which usually points at ill-conditioned matrices; vectorized and
+    multi-core computations time whole tiles rather than pairs, so there the k slowest tiles are recorded instead.
+
+    Other long loops (over subjects, landmarks or queries) report the same way, counting in their own unit: the report
+    keys keep their names ('pairsDone', 'totalPairs', 'pairsPerSecond'), and 'unit' says what is counted."""
+
+    def totalPairs(numArrays: int, assumeDistIsSymmetric: bool = False) -> int:
+        """Pairs evaluated for a full pairwise matrix: N^2, or N(N+1)/2 (the lower triangle and diagonal) if symmetric."""
+        return numArrays * (numArrays + 1) // 2 if assumeDistIsSymmetric else numArrays**2
+
+    def tilePairs(rows: slice, cols: slice, assumeDistIsSymmetric: bool = False) -> int:
+        """Pairs covered by a tile, counted as in totalPairs."""
+        numRows, numCols = rows.stop - rows.start, cols.stop - cols.start
+        if assumeDistIsSymmetric and rows == cols:
+            return numRows * (numRows + 1) // 2
+        return numRows * numCols
+
+    def start(totalPairs: int, reporter: Callable = None, silent: bool = False, profile: int = 0, interval: float = 1.0,
+              stage: str = 'precompute', unit: str = 'pairs') -> dict:
+        """Starts a tracker, in the given stage.
+
+        Args:
+            totalPairs (int): Pairs (or other units) to be evaluated, for the ETA.
+            reporter (Callable, optional): Called with each report. Defaults to printReport, or to nothing if silent.
+            silent (bool, optional): Only report to an explicitly given reporter. Defaults to False.
+            profile (int, optional): Number of slowest pairs (or tiles) to record. Defaults to 0.
+            interval (float, optional): Minimum seconds between reports. Defaults to 1.0.
+            stage (str, optional): The first stage. Defaults to 'precompute'.
+            unit (str, optional): What is counted, e.g. 'subjects'. Throughput and ETA come from the time spent in the stage
+                                  of the same name. Defaults to 'pairs'.
+
+        Returns:
+            dict: The tracker, or None if there is nothing to report or record.
+        """
+        if reporter is None and silent and profile == 0:
+            return None
+        now = time.perf_counter()
+        return {'totalPairs': totalPairs, 'pairsDone': 0, 'start': now, 'stage': stage, 'stageStart': now, 'stages': {},
+                'reporter': reporter if reporter is not None or silent else progress.printReport,
+                'interval': interval, 'lastReport': now, 'profile': profile, 'slowest': [], 'count': 0,
+                'unit': unit, 'info': {}}
+
+    def setTotal(tracker: dict, totalPairs: int):
+        """Sets the number of pairs to be evaluated, once known. Does nothing for a None tracker."""
+        if tracker is not None:
+            tracker['totalPairs'] = totalPairs
+
+    def stage(tracker: dict, name: str):
+        """Ends the current stage and starts the named one. Does nothing for a None tracker."""
+        if tracker is None:
+            return
+        now = time.perf_counter()
+        tracker['stages'][tracker['stage']] = tracker['stages'].get(tracker['stage'], 0.0) + now - tracker['stageStart']
+        tracker['stage'], tracker['stageStart'] = name, now
+
+    def note(tracker: dict, **info):
+        """Attaches values (e.g. tiles resumed from a checkpoint, or the error of a result) to every later report.
+        Does nothing for a None tracker."""
+        if tracker is not None:
+            tracker['info'].update(info)
+
+    def update(tracker: dict, pairs: int, rows=None, cols=None, seconds: float = None):
+        """Records pairs as done. If profiling and seconds is given, rows and cols (indices of a pair, or slices of a tile)
+        are kept when they are among the slowest so far."""
+        tracker['pairsDone'] += pairs
+        if tracker['profile'] and seconds is not None:
+            if isinstance(rows, slice):
+                rows, cols = (rows.start, rows.stop), (cols.start, cols.stop)
+            tracker['count'] += 1 # Tie-breaker, so heap entries never compare rows or cols
+            entry = (seconds, tracker['count'], rows, cols)
+            if len(tracker['slowest']) < tracker['profile']:
+                heapq.heappush(tracker['slowest'], entry)
+            elif seconds > tracker['slowest'][0][0]:
+                heapq.heapreplace(tracker['slowest'], entry)
+        if tracker['reporter'] is not None:
+            now = time.perf_counter()
+            if now - tracker['lastReport'] >= tracker['interval']:
+                tracker['lastReport'] = now
+                tracker['reporter'](progress.report(tracker))
+
+    def report(tracker: dict, done: bool = False) -> dict:
+        """A snapshot of the tracker.
+
+        Returns:
+            dict: 'pairsDone', 'totalPairs', 'fraction', 'elapsed' (seconds since start), 'stages' (seconds per stage,
+            including the current one so far), 'pairsPerSecond' and 'eta' (seconds, from time spent in the 'pairs' stage,
+            or the stage named after the unit), 'slowest' (dicts of 'seconds', 'rows' and 'cols', slowest first), 'unit',
+            'info' (values from note) and 'done'.
+        """
+        now = time.perf_counter()
+        stages = dict(tracker['stages'])
+        stages[tracker['stage']] = stages.get(tracker['stage'], 0.0) + now - tracker['stageStart']
+        pairTime = stages.get(tracker['unit'], 0.0)
+        rate = tracker['pairsDone'] / pairTime if pairTime > 0 else 0.0
+        remaining = tracker['totalPairs'] - tracker['pairsDone']
+        return {'pairsDone': tracker['pairsDone'], 'totalPairs': tracker['totalPairs'],
+                'fraction': tracker['pairsDone'] / tracker['totalPairs'] if tracker['totalPairs'] else 1.0,
+                'elapsed': now - tracker['start'], 'stages': stages, 'pairsPerSecond': rate,
+                'eta': remaining / rate if rate > 0 else float('inf'),
+                'slowest': [{'seconds': seconds, 'rows': rows, 'cols': cols} for seconds, _, rows, cols in sorted(tracker['slowest'], reverse=True)],
+                'unit': tracker['unit'], 'info': dict(tracker['info']), 'done': done}
+
+    def finish(tracker: dict) -> dict:
+        """Ends the current stage and sends the final report. Does nothing (and returns None) for a None tracker."""
+        if tracker is None:
+            return None
+        progress.stage(tracker, None)
+        final = progress.report(tracker, done=True)
+        final['stages'].pop(None, None)
+        if tracker['reporter'] is not None:
+            tracker['reporter'](final)
+        return final
+
+    def formatReport(report: dict) -> str:
+        """One-line summary of a report."""
+        unit = report.get('unit', 'pairs')
+        line = f"{unit} = {report['pairsDone']} / {report['totalPairs']} ({100 * report['fraction']:.1f}%) | {report['pairsPerSecond']:.4g} {unit}/s"
+        if report.get('info'):
+            line += " | " + ", ".join(f"{name} {value:.4g}" if isinstance(value, float) else f"{name} {value}"
+                                      for name, value in report['info'].items())
+        if report['done']:
+            return line + " | " + ", ".join(f"{name} {seconds:.3g} s" for name, seconds in report['stages'].items())
+        return line + f" | ETA {report['eta']:.0f} s"
+
+    def printReport(report: dict):
+        """The default reporter: overwrites one line of the terminal, ending it when the computation finishes."""
+        print(progress.formatReport(report) + "          ", end="\n" if report['done'] else "\r")
+
+    def logReporter(logger: logging.Logger = None, level: int = logging.INFO) -> Callable:
+        """A reporter that sends each report to a logger (default: the 'CorMat' logger), for batch jobs."""
+        logger = logger if logger is not None else logging.getLogger("CorMat")
+        return lambda report: logger.log(level, progress.formatReport(report))
+
+    def recorder():
+        """A reporter that keeps every report.
+
+        Returns:
+            (Callable, list): The reporter, and the list it appends to; the last entry is the final report.
+        """
+        reports = []
+        return reports.append, reports
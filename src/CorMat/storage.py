@@ -0,0 +1,114 @@
+import numpy as np
+from scipy import sparse
+
+class storage():
+    """Layouts for pairwise distance results. Besides the usual square N x N matrix, symmetric results can be stored in
+    condensed form: the upper triangle (i < j) as a vector of length N(N-1)/2, in the same order as scipy.spatial.distance.pdist,
+    so scipy's squareform also reads it. Either layout may use a reduced-precision dtype such as float32, and may live in an
+    np.memmap. Helpers here convert between layouts a chunk of rows at a time, so neither side needs to fit in memory, and
+    produce the sparse k-nearest-neighbor inputs accepted by sklearn (metric="precomputed") and umap (precomputed_knn)."""
+
+    formats = ("square", "condensed")
+
+    def outputShape(numArrays: int, outputFormat: str = "square") -> tuple:
+        """Shape of a result in the given layout."""
+        if outputFormat == "square":
+            return (numArrays, numArrays)
+        elif outputFormat == "condensed":
+            return (numArrays * (numArrays - 1) // 2,)
+        raise ValueError(f"Unknown outputFormat: {outputFormat}. Use one of {storage.formats}.")
+
+    def allocate(numArrays: int, outputFormat: str = "square", dtype=np.float64, assumeDistIsSymmetric: bool = True,
+                 filename: str = None) -> np.ndarray:
+        """Zeroed output for calculatePairwiseDistances; an .npy-backed np.memmap if filename is given.
+        The condensed layout only holds symmetric results, so it requires assumeDistIsSymmetric."""
+        if outputFormat == "condensed" and not assumeDistIsSymmetric:
+            raise ValueError("The condensed output format requires assumeDistIsSymmetric=True.")
+        shape = storage.outputShape(numArrays, outputFormat)
+        if filename is not None:
+            return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+        return np.zeros(shape, dtype=dtype)
+
+    def numArraysFromCondensed(length: int) -> int:
+        """N such that N(N-1)/2 == length."""
+        numArrays = int(round((1 + np.sqrt(1 + 8 * length)) / 2))
+        if numArrays * (numArrays - 1) // 2 != length:
+            raise ValueError(f"Length {length} is not that of a condensed distance matrix.")
+        return numArrays
+
+    def condensedIndex(i, j, numArrays: int):
+        """Position of pair (i, j), i != j, in a condensed vector. Accepts integers or broadcastable integer arrays."""
+        a, b = np.minimum(i, j), np.maximum(i, j)
+        return numArrays * a - a * (a + 1) // 2 + b - a - 1
+
+    def writeCondensedTile(out: np.ndarray, rows: slice, cols: slice, block: np.ndarray):
+        """Stores the strictly-lower-triangular entries (i > j) of a tile in a condensed vector."""
+        numArrays = storage.numArraysFromCondensed(out.shape[0])
+        rowIdx, colIdx = np.arange(rows.start, rows.stop)[:, None], np.arange(cols.start, cols.stop)[None, :]
+        mask = rowIdx > colIdx
+        out[storage.condensedIndex(rowIdx, colIdx, numArrays)[mask]] = block[mask]
+
+    def squareRows(condensed: np.ndarray, rows: slice) -> np.ndarray:
+        """Rows of the square form of a condensed vector, without building the rest of the matrix."""
+        numArrays = storage.numArraysFromCondensed(condensed.shape[0])
+        rowIdx, colIdx = np.arange(rows.start, min(rows.stop, numArrays))[:, None], np.arange(numArrays)[None, :]
+        offDiag = rowIdx != colIdx
+        block = np.zeros(offDiag.shape, dtype=condensed.dtype)
+        block[offDiag] = condensed[storage.condensedIndex(rowIdx, colIdx, numArrays)[offDiag]]
+        return block
+
+    def iterRows(dists: np.ndarray, chunkRows: int = 256):
+        """Yields (rows, block) chunks of the square form of a square or condensed result."""
+        numArrays = dists.shape[0] if dists.ndim == 2 else storage.numArraysFromCondensed(dists.shape[0])
+        for start in range(0, numArrays, chunkRows):
+            rows = slice(start, min(start + chunkRows, numArrays))
+            yield rows, (np.asarray(dists[rows]) if dists.ndim == 2 else storage.squareRows(dists, rows))
+
+    def toSquare(condensed: np.ndarray, dtype=None, filename: str = None, chunkRows: int = 256) -> np.ndarray:
+        """Square form of a condensed vector, filled a chunk of rows at a time; an .npy-backed np.memmap if filename is given."""
+        numArrays = storage.numArraysFromCondensed(condensed.shape[0])
+        square = storage.allocate(numArrays, "square", dtype=dtype if dtype is not None else condensed.dtype, filename=filename)
+        for rows, block in storage.iterRows(condensed, chunkRows):
+            square[rows] = block
+        return square
+
+    def toCondensed(square: np.ndarray, dtype=None, filename: str = None, chunkRows: int = 256) -> np.ndarray:
+        """Condensed form of the upper triangle of a square matrix; an .npy-backed np.memmap if filename is given."""
+        numArrays = square.shape[0]
+        condensed = storage.allocate(numArrays, "condensed", dtype=dtype if dtype is not None else square.dtype, filename=filename)
+        for start in range(0, numArrays, chunkRows):
+            block = np.asarray(square[start:start + chunkRows])
+            for i in range(start, start + block.shape[0]):
+                begin = storage.condensedIndex(i, i + 1, numArrays) if i + 1 < numArrays else 0
+                condensed[begin:begin + numArrays - i - 1] = block[i - start, i + 1:]
+        return condensed
+
+    def kNearestNeighbors(dists: np.ndarray, k: int, chunkRows: int = 256):
+        """k nearest neighbors of every item, from a square or condensed result, each item being its own first neighbor.
+
+        Returns:
+            (np.ndarray, np.ndarray): (N, k) neighbor indices and distances, sorted by distance. This is the
+            (knn_indices, knn_dists) form used by umap's precomputed_knn argument.
+        """
+        indices, knnDists = [], []
+        for rows, block in storage.iterRows(dists, chunkRows):
+            block = np.array(block, dtype=np.float64)
+            block[np.arange(block.shape[0]), np.arange(rows.start, rows.stop)] = -np.inf # Self first, even with rounding-level diagonals
+            nearest = np.argpartition(block, k - 1, axis=1)[:, :k] if k < block.shape[1] else np.tile(np.arange(block.shape[1]), (block.shape[0], 1))
+            nearestDists = np.take_along_axis(block, nearest, axis=1)
+            order = np.argsort(nearestDists, axis=1)
+            indices.append(np.take_along_axis(nearest, order, axis=1))
+            knnDists.append(np.maximum(np.take_along_axis(nearestDists, order, axis=1), 0))
+        return np.concatenate(indices), np.concatenate(knnDists)
+
+    def kNeighborsGraph(dists: np.ndarray, k: int, chunkRows: int = 256) -> sparse.csr_matrix:
+        """Sparse N x N graph holding each item's k nearest neighbors, plus the item itself as an explicit 0, from a square
+        or condensed result. This matches the output of sklearn's KNeighborsTransformer, so it is accepted as input by sklearn
+        estimators with metric="precomputed" using up to k neighbors, e.g. Isomap, TSNE and DBSCAN."""
+        return storage.graphFromNeighbors(*storage.kNearestNeighbors(dists, k + 1, chunkRows))
+
+    def graphFromNeighbors(indices: np.ndarray, knnDists: np.ndarray) -> sparse.csr_matrix:
+        """Sparse N x N graph from (N, width) neighbor indices and distances, such as those from kNearestNeighbors."""
+        numArrays, width = indices.shape
+        indptr = np.arange(0, numArrays * width + 1, width)
+        return sparse.csr_matrix((knnDists.ravel(), indices.ravel(), indptr), shape=(numArrays, numArrays))
@@ -0,0 +1,138 @@
+import os
+import glob
+import numpy as np
+from typing import Callable, Iterable
+from CorMat.utils import utils
+from CorMat.batched import batched
+from CorMat.parallel import parallel
+from CorMat.storage import storage
+from CorMat.progress import progress
+
+class streaming():
+    """Out-of-core cohort pipeline, from a folder of timeseries files to a pairwise distance matrix. Timeseries are loaded
+    lazily and turned into correlation matrices a chunk at a time; the matrices and the per-matrix quantities needed by the
+    distance (square roots, etc.) are spilled to memory-mapped .npy stacks in a working folder, and the pairwise matrix is
+    then filled tile by tile from those stacks into a memory-mapped output. Peak memory is bounded by memoryBudget, apart
+    from the operating system's page cache.
+
+    Files in the working folder:
+        files.txt: The timeseries files, one per line, in the order of the rows of every stack.
+        matrices.npy, half.npy, ...: Stacks of correlation matrices and derived per-matrix quantities (see batched.prepare).
+        distances.npy: The pairwise distances, N x N or condensed (see CorMat.storage)."""
+
+    def listTimeseriesFiles(directory: str) -> list:
+        """Sorted list of the .npy and .npz files in a folder."""
+        return sorted(glob.glob(os.path.join(directory, "*.npy")) + glob.glob(os.path.join(directory, "*.npz")))
+
+    def loadTimeseries(path: str, key: str = None) -> np.ndarray:
+        """Loads one timeseries. .npy files are memory-mapped; for .npz files, the array named key (default: the first) is loaded."""
+        if path.endswith(".npz"):
+            with np.load(path) as archive:
+                return archive[key if key is not None else archive.files[0]]
+        return np.load(path, mmap_mode='r')
+
+    def iterTimeseries(source, key: str = None):
+        """Lazily yields timeseries from a folder, or from an iterable of .npy/.npz paths."""
+        files = streaming.listTimeseriesFiles(source) if isinstance(source, str) else source
+        for path in files:
+            yield streaming.loadTimeseries(path, key=key)
+
+    def buildStacks(source, workDir: str, required: Iterable = ('half',), preprocess: Callable = None, key: str = None,
+                    memoryBudget: int = 2**30, silent: bool = False, reporter: Callable = None, **preprocessKwargs) -> dict:
+        """Converts every timeseries to a correlation matrix and writes it, along with the per-matrix quantities named in
+        required (see batched.prepare), to memory-mapped stacks in workDir.
+
+        Args:
+            source (str or Iterable): A folder of .npy/.npz timeseries, or an iterable of file paths.
+            workDir (str): Folder for the stacks. Created if needed.
+            required (Iterable, optional): Per-matrix quantities to compute. Defaults to ('half',).
+            preprocess (Callable, optional): Maps a timeseries to a correlation matrix. Defaults to utils.rawTStoClippedCMat, 
+                                             applied a chunk at a time with utils.batchTStoCM.
+            key (str, optional): Array to read from .npz files. Defaults to the first array in each file.
+            memoryBudget (int, optional): Approximate peak bytes for one chunk of timeseries and matrices. Defaults to 2**30.
+            silent (bool, optional): Suppress progress printing. Defaults to False.
+            reporter (Callable, optional): Receives progress reports, counting subjects; see CorMat.progress.
+            **preprocessKwargs: Passed to preprocess, e.g. rowsToKeep, sampleRate, leadingClip, durationToKeep, keepAll.
+
+        Returns:
+            dict: Read-only np.memmap stacks, with the same keys as batched.prepare (e.g. 'mats', 'half').
+        """
+        if preprocess is None:
+            preprocessChunk = lambda chunk: utils.batchTStoCM(chunk, silent=True, **preprocessKwargs)
+        else:
+            preprocessChunk = lambda chunk: [preprocess(ts, **preprocessKwargs) for ts in chunk]
+        files = streaming.listTimeseriesFiles(source) if isinstance(source, str) else list(source)
+        if len(files) == 0:
+            raise ValueError(f"No timeseries files found in {source}.")
+        os.makedirs(workDir, exist_ok=True)
+        with open(os.path.join(workDir, "files.txt"), "w") as f:
+            f.write("\n".join(files) + "\n")
+
+        # Size chunks from the first subject: its timeseries plus every stacked quantity derived from it
+        firstTS = streaming.loadTimeseries(files[0], key=key)
+        firstFeats = batched.prepare(np.asarray(preprocessChunk([firstTS])), required)
+        bytesPerSubject = firstTS.nbytes + sum(arr[0].nbytes for arr in firstFeats.values())
+        chunkSize = max(1, int(memoryBudget // (3 * bytesPerSubject)))
+
+        stacks = {name: np.lib.format.open_memmap(os.path.join(workDir, ("matrices" if name == 'mats' else name) + ".npy"),
+                                                  mode='w+', dtype=arr.dtype, shape=(len(files),) + arr.shape[1:])
+                  for name, arr in firstFeats.items()}
+        tracker = progress.start(len(files), reporter=reporter, silent=silent, stage='subjects', unit='subjects')
+        for start in range(0, len(files), chunkSize):
+            chunk = preprocessChunk(list(streaming.iterTimeseries(files[start:start + chunkSize], key=key)))
+            chunkFeats = batched.prepare(chunk, required)
+            for name, arr in chunkFeats.items():
+                stacks[name][start:start + len(chunk)] = arr
+            if tracker is not None:
+                progress.update(tracker, len(chunk))
+            del chunk, chunkFeats
+        for arr in stacks.values():
+            arr.flush()
+        progress.finish(tracker)
+        return streaming.openStacks(workDir, names=stacks.keys())
+
+    def openStacks(workDir: str, names: Iterable = ('mats', 'half')) -> dict:
+        """Reopens stacks written by buildStacks, read-only."""
+        return {name: np.load(os.path.join(workDir, ("matrices" if name == 'mats' else name) + ".npy"), mmap_mode='r') for name in names}
+
+    def calculatePairwiseDistances(source, distance: Callable, workDir: str, preprocess: Callable = None, key: str = None,
+                                   fastMode: bool = False, assumeDistIsSymmetric: bool = False, memoryBudget: int = 2**30,
+                                   nWorkers: int = 1, blasThreads: int = 1, backend: str = "process", silent: bool = False,
+                                   outputFormat: str = "square", dtype=np.float64, reporter: Callable = None, profile: int = 0,
+                                   **preprocessKwargs) -> np.memmap:
+        """Streaming equivalent of CorMat.utils.calculatePairwiseDistances, starting from timeseries files rather than matrices.
+        Correlation matrices and their precomputations are built chunk by chunk with buildStacks, then tiles sized to fit
+        memoryBudget are evaluated from the on-disk stacks into workDir/distances.npy (optionally on several workers, as in
+        CorMat.parallel). Distances without a block implementation in CorMat.batched receive Ahalf/Bhalf but no A_neghalf.
+
+        Args:
+            source (str or Iterable): A folder of .npy/.npz timeseries, or an iterable of file paths.
+            distance (Callable): A distance from CorMat.distances, or any callable with the same signature.
+            workDir (str): Folder for the stacks and the output; see the class docstring.
+            memoryBudget (int, optional): Approximate peak bytes for preprocessing chunks and for the intermediates of one tile.
+            outputFormat (str, optional): "square", or "condensed" (requires assumeDistIsSymmetric); see CorMat.storage. Defaults to "square".
+            dtype (optional): dtype of the result, e.g. np.float32. Defaults to np.float64.
+            reporter (Callable, optional): Receives progress reports; see CorMat.progress. The 'precompute' stage includes
+                                           loading the timeseries and building the stacks.
+            profile (int, optional): Number of slowest tiles to record in the final report. Defaults to 0.
+            Other inputs are as in buildStacks and CorMat.parallel.calculatePairwiseDistances.
+
+        Returns:
+            np.memmap: The matrix of pairwise distances (or its condensed form), backed by workDir/distances.npy.
+        """
+        required = batched.requirements.get(distance, ('half',))
+        tracker = progress.start(0, reporter=reporter, silent=silent, profile=profile)
+        feats = streaming.buildStacks(source, workDir, required=required, preprocess=preprocess, key=key,
+                                      memoryBudget=memoryBudget, silent=silent, reporter=reporter, **preprocessKwargs)
+        numArrays = len(feats['mats'])
+        blockSize = batched.defaultBlockSize(distance, feats, memory=memoryBudget // (2 * max(1, nWorkers)))
+        out = storage.allocate(numArrays, outputFormat, dtype=dtype, assumeDistIsSymmetric=assumeDistIsSymmetric,
+                               filename=os.path.join(workDir, "distances.npy"))
+        progress.setTotal(tracker, progress.totalPairs(numArrays, assumeDistIsSymmetric))
+        progress.stage(tracker, 'pairs')
+        parallel.runTiles(distance, feats, list(batched.tiles(numArrays, blockSize, assumeDistIsSymmetric)), out,
+                          fastMode=fastMode, assumeDistIsSymmetric=assumeDistIsSymmetric, nWorkers=nWorkers,
+                          blasThreads=blasThreads, backend=backend, silent=True, tracker=tracker)
+        out.flush()
+        progress.finish(tracker)
+        return out
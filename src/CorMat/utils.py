@@ -1,7 +1,13 @@
 # import os
+import time
 import numpy as np
 from scipy import linalg as la
 from typing import Callable, Iterable
+from CorMat.batched import batched
+from CorMat.parallel import parallel
+from CorMat.checkpoint import checkpoint
+from CorMat.storage import storage
+from CorMat.progress import progress
 
 class utils():
 
@@ -19,35 +25,129 @@ class utils():
                                     Mats_half: Iterable = None, Mats_neghalf: Iterable = None, 
                                     DTWfeatureDist: bool = None, fastMode: bool = False,
                                     precomputeHalves: bool = False, precomputeNeghalves: bool = False, 
-                                    assumeDistIsSymmetric: bool = False, silent: bool = False):
-        """Calculates a matrix of pairwise distances between objects in an iterable."""
-        # TODO: Allow this to resume progress if interrupted?
+                                    assumeDistIsSymmetric: bool = False, silent: bool = False,
+                                    vectorize: bool = True, blockSize: int = None,
+                                    nWorkers: int = None, blasThreads: int = 1, backend: str = "process",
+                                    checkpointDir: str = None, outputFormat: str = "square", dtype=np.float64,
+                                    reporter: Callable = None, profile: int = 0,
+                                    Factors: Iterable = None, useFactors="auto", cacheDir: str = None):
+        """Calculates a matrix of pairwise distances between objects in an iterable.
+        If vectorize is True and the distance has a block implementation in CorMat.batched (see batched.supports), 
+        pairs are evaluated blockSize x blockSize at a time by batched.calculatePairwiseDistances instead of one at a time.
+        See CorMat.batched for the tolerance of this mode.
+        If nWorkers is greater than 1, tiles are instead evaluated concurrently by parallel.calculatePairwiseDistances,
+        using nWorkers processes (or threads, if backend="thread") with blasThreads BLAS threads each.
+        If checkpointDir is given, the result is written to a memmap in that folder by checkpoint.calculatePairwiseDistances,
+        and an interrupted run resumes where it left off when called again with the same inputs.
+        outputFormat="condensed" (which requires assumeDistIsSymmetric) returns only the upper triangle, in scipy's pdist
+        layout, and dtype sets the precision of the result (e.g. np.float32); see CorMat.storage for conversions.
+        Progress (pairs done, pairs/s, ETA, and time spent precomputing vs. evaluating pairs) is sent to reporter, a callable
+        taking the report dicts of CorMat.progress; by default it is printed unless silent. profile=k records the k slowest
+        pairs (or tiles, when vectorized or parallel) in the final report, e.g. to find ill-conditioned matrices.
+        For BuresDistance and BuresAngle, Factors (thin factors F with F @ F.T = A, e.g. from batchTStoFactors) can be given
+        instead of Matrices, and no square roots are computed; with vectorize, rank-deficient Matrices are factored
+        automatically unless useFactors=False. See batched.calculatePairwiseDistances.
+        With cacheDir, per-matrix eigendecompositions, square roots, inverse square roots and logarithms (including those
+        of precomputeHalves and precomputeNeghalves) are kept in a persistent cache in that folder and reused by later
+        runs on the same matrices, with any distance; see CorMat.cache."""
+        if Factors is not None and (checkpointDir is not None or (nWorkers is not None and nWorkers > 1)):
+            raise ValueError("Factors are only supported by the serial pairwise loop and vectorized engine.")
+        if checkpointDir is not None:
+            return checkpoint.calculatePairwiseDistances(Matrices, distance, checkpointDir, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                                         DTWfeatureDist=DTWfeatureDist, fastMode=fastMode,
+                                                         precomputeHalves=precomputeHalves, precomputeNeghalves=precomputeNeghalves,
+                                                         assumeDistIsSymmetric=assumeDistIsSymmetric, silent=silent, blockSize=blockSize,
+                                                         nWorkers=nWorkers if nWorkers is not None else 1, blasThreads=blasThreads, backend=backend,
+                                                         outputFormat=outputFormat, dtype=dtype, reporter=reporter, profile=profile,
+                                                         cacheDir=cacheDir)
+        if nWorkers is not None and nWorkers > 1:
+            return parallel.calculatePairwiseDistances(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                                       DTWfeatureDist=DTWfeatureDist, fastMode=fastMode,
+                                                       precomputeHalves=precomputeHalves, precomputeNeghalves=precomputeNeghalves,
+                                                       assumeDistIsSymmetric=assumeDistIsSymmetric, silent=silent, nWorkers=nWorkers,
+                                                       blockSize=blockSize, blasThreads=blasThreads, backend=backend,
+                                                       outputFormat=outputFormat, dtype=dtype, reporter=reporter, profile=profile,
+                                                       cacheDir=cacheDir)
+        if vectorize and batched.supports(distance):
+            return batched.calculatePairwiseDistances(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf, fastMode=fastMode,
+                                                      assumeDistIsSymmetric=assumeDistIsSymmetric, blockSize=blockSize, silent=silent,
+                                                      outputFormat=outputFormat, dtype=dtype, reporter=reporter, profile=profile,
+                                                      Factors=Factors, useFactors=useFactors, cacheDir=cacheDir)
+        numArrays = len(Factors) if Factors is not None else len(Matrices)
+        tracker = progress.start(progress.totalPairs(numArrays, assumeDistIsSymmetric), reporter=reporter, silent=silent, profile=profile)
+        if cacheDir is not None and ((Mats_half is None and precomputeHalves) or (Mats_neghalf is None and precomputeNeghalves)):
+            cached = batched.cachedDecompositions(Matrices, [name for name, needed in (('half', Mats_half is None and precomputeHalves),
+                                                                                       ('neghalf', Mats_neghalf is None and precomputeNeghalves)) if needed], cacheDir)
+            Mats_half = cached['half'] if 'half' in cached else Mats_half
+            Mats_neghalf = cached['neghalf'] if 'neghalf' in cached else Mats_neghalf
         if Mats_half is None and precomputeHalves == True:
             Mats_half = [la.fractional_matrix_power(mat, 1/2) for mat in Matrices]
         if Mats_neghalf is None and precomputeNeghalves == True:
             Mats_neghalf = [np.linalg.inv(mat) for mat in Mats_half]
         
-        numArrays = len(Matrices)
-        pairwiseDists = np.zeros((numArrays, numArrays), dtype=float)
-        j=0
+        pairwiseDists = storage.allocate(numArrays, outputFormat, dtype=dtype, assumeDistIsSymmetric=assumeDistIsSymmetric)
+        progress.stage(tracker, 'pairs')
         for i in range(numArrays):
             innerLoopUpperIdx = i+1 if assumeDistIsSymmetric else numArrays # Loop over full rows or just lower triangle
-            if i%10 == 0 and not silent:
-                print("i =", i, "/", numArrays, "|", "j =", j, "          ", end="\r")
-            A = Matrices[i]
+            A = Matrices[i] if Matrices is not None else None
             Ahalf = Mats_half[i] if Mats_half is not None else None
             A_neghalf = Mats_neghalf[i] if Mats_neghalf is not None else None
+            factorKwargs = {} if Factors is None else {'Afactor': Factors[i]}
             for j in range(0,innerLoopUpperIdx):
-                if j%30 == 0 and not silent:
-                    print("i =", i, "/", numArrays, "|", "j =", j, "          ", end="\r")
-                B = Matrices[j]
+                B = Matrices[j] if Matrices is not None else None
                 Bhalf = Mats_half[j] if Mats_half is not None else None
-                dist = distance(A, B, Ahalf=Ahalf, Bhalf=Bhalf, A_neghalf=A_neghalf, DTWfeatureDist=DTWfeatureDist, fastMode=fastMode)
+                if Factors is not None:
+                    factorKwargs['Bfactor'] = Factors[j]
+                pairStart = time.perf_counter() if profile else None
+                dist = distance(A, B, Ahalf=Ahalf, Bhalf=Bhalf, A_neghalf=A_neghalf, DTWfeatureDist=DTWfeatureDist, fastMode=fastMode,
+                                **factorKwargs)
+                if profile: # Per-pair bookkeeping only when profiling; otherwise progress is updated once per row
+                    progress.update(tracker, 1, i, j, time.perf_counter() - pairStart)
+                if outputFormat == "condensed":
+                    if j != i:
+                        pairwiseDists[storage.condensedIndex(i, j, numArrays)] = dist
+                    continue
                 pairwiseDists[i,j] = dist
                 if assumeDistIsSymmetric:
                     pairwiseDists[j,i] = dist
+            if tracker is not None and not profile:
+                progress.update(tracker, innerLoopUpperIdx)
+        progress.finish(tracker)
         return pairwiseDists
 
+    def calculateMultiplePairwiseDistances(Matrices: Iterable, distanceList: Iterable,
+                                           Mats_half: Iterable = None, Mats_neghalf: Iterable = None,
+                                           DTWfeatureDist: bool = None, fastMode: bool = False,
+                                           assumeDistIsSymmetric: bool = False, silent: bool = False, blockSize: int = None,
+                                           outputFormat: str = "square", dtype=np.float64,
+                                           reporter: Callable = None, profile: int = 0,
+                                           useFactors="auto", cacheDir: str = None) -> dict:
+        """Calculates the matrix of pairwise distances for each distance in distanceList, e.g. to compare embeddings of a cohort.
+        Distances with a block implementation in CorMat.batched are computed together, in a single pass over the pairs by
+        batched.calculateMultiplePairwiseDistances, from one eigendecomposition of each matrix; any others are computed
+        one after another by calculatePairwiseDistances. Inputs are as in calculatePairwiseDistances.
+
+        Returns:
+            dict: The pairwise matrix (or its condensed form) of each distance, keyed by distance.
+        """
+        distanceList = list(dict.fromkeys(distanceList))
+        vectorized = [distance for distance in distanceList if batched.supports(distance)]
+        results = {}
+        if vectorized:
+            results.update(batched.calculateMultiplePairwiseDistances(Matrices, vectorized, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                                                      fastMode=fastMode, assumeDistIsSymmetric=assumeDistIsSymmetric,
+                                                                      blockSize=blockSize, silent=silent, outputFormat=outputFormat,
+                                                                      dtype=dtype, reporter=reporter, profile=profile,
+                                                                      useFactors=useFactors, cacheDir=cacheDir))
+        for distance in distanceList:
+            if distance not in results:
+                results[distance] = utils.calculatePairwiseDistances(Matrices, distance, Mats_half=Mats_half, Mats_neghalf=Mats_neghalf,
+                                                                     DTWfeatureDist=DTWfeatureDist, fastMode=fastMode,
+                                                                     assumeDistIsSymmetric=assumeDistIsSymmetric, silent=silent,
+                                                                     blockSize=blockSize, outputFormat=outputFormat, dtype=dtype,
+                                                                     reporter=reporter, profile=profile, cacheDir=cacheDir)
+        return {distance: results[distance] for distance in distanceList}
+
     def TStoCM(timeseries: np.array) -> np.array:
         """Accepts a numpy array containing timeseries data and returns a correlation matrix. Note that numpy's corrcoef() method calculates Pearson's coefficient. 
         This method also symmetrizes to eliminate rounding-based asymmetry.
@@ -61,6 +161,66 @@ class utils():
         matrix = np.corrcoef(timeseries)
         return (matrix + np.transpose(matrix)) / 2
 
+    def iterSlidingTStoCM(timeseries: np.array, windowLength: int, stride: int = 1, reanchorEvery: int = 1000):
+        """Lazily yields TStoCM of every window of windowLength samples, stepping by stride samples. Instead of recomputing
+        each window, running sums and cross-products are updated with the samples entering and leaving the window, so each
+        step costs O(regions^2 * stride) rather than O(regions^2 * windowLength). Sums are taken about the mean of the last
+        anchor window, and recomputed from scratch every reanchorEvery windows so rounding errors cannot accumulate.
+
+        Args:
+            timeseries (np.array): An m by n array; rows are variables and columns are samples, as in TStoCM.
+            windowLength (int): Samples per window.
+            stride (int, optional): Samples between the starts of consecutive windows. Defaults to 1.
+            reanchorEvery (int, optional): Windows between recomputations from scratch; None never recomputes. Defaults to 1000.
+
+        Yields:
+            np.array: The m by m correlation matrix of each window, in order.
+        """
+        timeseries = np.asarray(timeseries, dtype=np.float64)
+        numSamples = timeseries.shape[1]
+        if windowLength < 2 or windowLength > numSamples:
+            raise ValueError(f"windowLength must be between 2 and the number of samples ({numSamples}); got {windowLength}.")
+        if stride < 1:
+            raise ValueError(f"stride must be at least 1; got {stride}.")
+        if reanchorEvery is not None and reanchorEvery < 1:
+            raise ValueError(f"reanchorEvery must be at least 1 or None; got {reanchorEvery}.")
+        for count, start in enumerate(range(0, numSamples - windowLength + 1, stride)):
+            window = timeseries[:, start:start + windowLength]
+            if count == 0 or stride >= windowLength or (reanchorEvery is not None and count % reanchorEvery == 0):
+                shift = window.mean(axis=1)
+                centered = window - shift[:, None]
+                sums, crossProducts = centered.sum(axis=1), centered @ centered.T
+            else:
+                entering = timeseries[:, start + windowLength - stride:start + windowLength] - shift[:, None]
+                leaving = timeseries[:, start - stride:start] - shift[:, None]
+                sums += entering.sum(axis=1) - leaving.sum(axis=1)
+                crossProducts += entering @ entering.T
+                crossProducts -= leaving @ leaving.T
+            matrix = crossProducts - np.outer(sums, sums) / windowLength
+            with np.errstate(invalid='ignore', divide='ignore'): # Constant variables give nan, as in np.corrcoef
+                scale = 1 / np.sqrt(np.diag(matrix))
+            matrix *= np.outer(scale, scale) # Every update is symmetric, so no symmetrization is needed
+            yield np.clip(matrix, -1, 1, out=matrix)
+
+    def slidingTStoCM(timeseries: np.array, windowLength: int, stride: int = 1, reanchorEvery: int = 1000, out: np.ndarray = None) -> np.ndarray:
+        """Stack of the correlation matrices yielded by iterSlidingTStoCM.
+
+        Args:
+            out (np.ndarray, optional): Preallocated (windows x m x m) array, e.g. an np.memmap or float32 array, to fill.
+
+        Returns:
+            np.ndarray: A (windows x m x m) stack of correlation matrices; out if it was given.
+        """
+        numWindows = (np.shape(timeseries)[1] - windowLength) // stride + 1
+        numVars = np.shape(timeseries)[0]
+        if out is None:
+            out = np.empty((max(numWindows, 0), numVars, numVars))
+        elif out.shape != (numWindows, numVars, numVars):
+            raise ValueError(f"out has shape {out.shape}; expected {(numWindows, numVars, numVars)}.")
+        for i, matrix in enumerate(utils.iterSlidingTStoCM(timeseries, windowLength, stride=stride, reanchorEvery=reanchorEvery)):
+            out[i] = matrix
+        return out
+
     def getNumericalRank(matrix: np.array, tol: float = 10**-13) -> int:
         """Finds the number of eigenvalues of the input matrix which have absolute value greater than tolerance.
 
@@ -103,19 +263,125 @@ class utils():
         else: 
             return utils.TStoCM(utils.clipTS(timeseries[:rowsToKeep, :], sampleRate, leadingClip, durationToKeep))
         
-    def reinterpolate_TS(TS, desired_len):
+    def batchTStoCM(timeseries, rowsToKeep: int = 90, sampleRate: float = .5, leadingClip: float = 30.0, durationToKeep: float = 300.0,
+                    keepAll: bool = True, resampleTo: int = None, dtype=np.float64, chunkSize: int = None, memoryBudget: int = 2**30,
+                    filename: str = None, silent: bool = True, reporter: Callable = None) -> np.ndarray:
+        """Correlation matrices for a whole cohort, equivalent to calling rawTStoClippedCMat on every subject. Each chunk of
+        subjects is clipped, optionally resampled, and standardized (centered, scaled to unit norm) in a few array operations,
+        and all of its correlation matrices come from one batched matrix product of the standardized data.
+
+        Args:
+            timeseries (np.ndarray or Iterable): A (subjects x regions x samples) stack, possibly an np.memmap, or a sequence of 
+                                                 (regions x samples) timeseries whose lengths may differ.
+            rowsToKeep, sampleRate, leadingClip, durationToKeep, keepAll: As in rawTStoClippedCMat.
+            resampleTo (int, optional): Resample every (clipped) timeseries to this many samples, as in reinterpolate_TS. 
+                                        Defaults to None (no resampling).
+            dtype (optional): dtype of the result; np.float32 also runs the matrix products in single precision. Defaults to np.float64.
+            chunkSize (int, optional): Subjects per chunk. Defaults to as many as fit in memoryBudget.
+            memoryBudget (int, optional): Approximate peak bytes for one chunk, used when chunkSize is None. Defaults to 2**30.
+            filename (str, optional): Write the result to this .npy file as an np.memmap, so it need not fit in memory.
+            silent (bool, optional): Suppress progress printing. Defaults to True.
+            reporter (Callable, optional): Receives progress reports, counting subjects; see CorMat.progress.
+
+        Returns:
+            np.ndarray: A (subjects x regions x regions) stack of correlation matrices (an np.memmap if filename is given).
+        """
+        def clip(TS):
+            return TS if keepAll else utils.clipTS(TS[:rowsToKeep, :], sampleRate, leadingClip, durationToKeep)
+        numSubjects = len(timeseries)
+        if numSubjects == 0:
+            raise ValueError("No timeseries given.")
+        first = clip(np.asarray(timeseries[0]))
+        numRegions = first.shape[0]
+        numSamples = resampleTo if resampleTo is not None else first.shape[1]
+        if chunkSize is None:
+            chunkSize = max(1, int(memoryBudget // (8 * numRegions * (3 * numSamples + numRegions))))
+        if filename is not None:
+            out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(numSubjects, numRegions, numRegions))
+        else:
+            out = np.empty((numSubjects, numRegions, numRegions), dtype=dtype)
+
+        tracker = progress.start(numSubjects, reporter=reporter, silent=silent, stage='subjects', unit='subjects')
+        for start in range(0, numSubjects, chunkSize):
+            if isinstance(timeseries, np.ndarray) and timeseries.ndim == 3: # Clip the stack directly, without per-subject copies
+                stack = timeseries[start:start + chunkSize]
+                if not keepAll:
+                    clipStart = int(leadingClip * sampleRate)
+                    stack = stack[:, :rowsToKeep, clipStart:clipStart + int(durationToKeep * sampleRate)]
+                chunk, groups = [stack], {stack.shape: None}
+            else: # Subjects with equal shapes are processed together
+                chunk, groups = [clip(np.asarray(TS)) for TS in timeseries[start:start + chunkSize]], {}
+                for i, TS in enumerate(chunk):
+                    groups.setdefault(TS.shape, []).append(i)
+            for members in groups.values():
+                X = chunk[0] if members is None else np.array([chunk[i] for i in members])
+                if resampleTo is not None:
+                    X = utils.reinterpolate_TS(X, resampleTo, axis=2)
+                if X.shape[1] != numRegions:
+                    raise ValueError(f"Found timeseries with {X.shape[1]} regions after clipping; expected {numRegions}.")
+                # Correlations are inner products of the centered timeseries, divided by their norms from the diagonal
+                Z = np.subtract(X, X.mean(axis=2, keepdims=True), dtype=np.float64).astype(dtype, copy=False)
+                C = np.matmul(Z, Z.transpose(0, 2, 1))
+                with np.errstate(invalid='ignore', divide='ignore'): # Constant regions give nan, as in np.corrcoef
+                    norms = np.sqrt(np.diagonal(C, axis1=1, axis2=2))
+                    C /= norms[:, :, None]
+                    C /= norms[:, None, :]
+                C += C.transpose(0, 2, 1).copy()
+                C /= 2
+                np.clip(C, -1, 1, out=C)
+                if members is None:
+                    out[start:start + C.shape[0]] = C
+                else:
+                    out[start + np.array(members)] = C
+            if tracker is not None:
+                progress.update(tracker, min(chunkSize, numSubjects - start))
+        if filename is not None:
+            out.flush()
+        progress.finish(tracker)
+        return out
+
+    def batchTStoFactors(timeseries, rowsToKeep: int = 90, sampleRate: float = .5, leadingClip: float = 30.0, durationToKeep: float = 300.0,
+                         keepAll: bool = True, resampleTo: int = None, dtype=np.float64) -> np.ndarray:
+        """Thin factors of the correlation matrices of batchTStoCM: every (clipped, optionally resampled) timeseries, centered
+        and with each row scaled to unit norm, so that F @ F.T is its correlation matrix. When there are fewer samples than
+        regions, these are smaller than the matrices, and BuresDistance and BuresAngle can be computed from them directly
+        (Factors in calculatePairwiseDistances) without square roots.
+
+        Args:
+            timeseries (np.ndarray or Iterable): A (subjects x regions x samples) stack, or a sequence of (regions x samples)
+                                                 timeseries whose lengths may differ.
+            Other inputs are as in batchTStoCM.
+
+        Returns:
+            np.ndarray: A (subjects x regions x samples) stack of factors; shorter timeseries are padded with zero columns.
+        """
+        if len(timeseries) == 0:
+            raise ValueError("No timeseries given.")
+        chunk = [np.asarray(TS) if keepAll else utils.clipTS(np.asarray(TS)[:rowsToKeep, :], sampleRate, leadingClip, durationToKeep)
+                 for TS in timeseries]
+        if resampleTo is not None:
+            chunk = [utils.reinterpolate_TS(TS, resampleTo, axis=1) for TS in chunk]
+        numRegions = chunk[0].shape[0]
+        out = np.zeros((len(chunk), numRegions, max(TS.shape[1] for TS in chunk)), dtype=dtype)
+        for i, TS in enumerate(chunk):
+            if TS.shape[0] != numRegions:
+                raise ValueError(f"Found timeseries with {TS.shape[0]} regions after clipping; expected {numRegions}.")
+            Z = TS - TS.mean(axis=1, keepdims=True)
+            with np.errstate(invalid='ignore', divide='ignore'): # Constant regions give nan, as in np.corrcoef
+                out[i, :, :Z.shape[1]] = Z / np.linalg.norm(Z, axis=1, keepdims=True)
+        return out
+
+    def reinterpolate_TS(TS, desired_len, axis: int = 0):
         """Given an input time series TS, constructs a piecewise linear interpolation in time, then samples that interpolation at <desired_len> points.
-            The result is an upsampled or downsampled time series based on linear. Assumes time is first axis of TS (i.e. reinterpolates on first axis)."""
-        if TS.shape[0] == desired_len:
+            The result is an upsampled or downsampled time series based on linear. Assumes time is the given axis of TS (default: first axis).
+            Every channel is interpolated at once, from the two neighboring samples of each new time point."""
+        if TS.shape[axis] == desired_len:
             return TS
-        else:
-            current_len = TS.shape[0]
-            xnew = np.linspace(0, current_len-1, desired_len)
-            if len(TS.shape) == 1:
-                interp = np.interp(xnew, range(len(TS)), TS)
-                return interp
-            else:
-                toReturn = np.zeros((desired_len, TS.shape[1]))
-                for i in range(TS.shape[1]):
-                    toReturn[:,i] = np.interp(xnew, range(len(TS[:,i])), TS[:,i])
-                return toReturn
\ No newline at end of file
+        TS = np.moveaxis(np.asarray(TS), axis, 0)
+        current_len = TS.shape[0]
+        xnew = np.linspace(0, current_len-1, desired_len)
+        left = np.minimum(np.floor(xnew).astype(int), max(current_len - 2, 0))
+        right = np.minimum(left + 1, current_len - 1)
+        weight = (xnew - left).reshape((-1,) + (1,) * (TS.ndim - 1))
+        interp = TS[left] * (1 - weight) + TS[right] * weight
+        return np.moveaxis(interp, 0, axis)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+
+def correlationMatrices(numArrays, dim, samples, seed=0):
+    """Correlation matrices of random timeseries, divided by their trace (dim) so that BuresAngle is defined."""
+    rng = np.random.default_rng(seed)
+    return np.stack([np.corrcoef(rng.standard_normal((dim, samples))) / dim for _ in range(numArrays)])
+
+
+@pytest.fixture
+def cohort():
+    """Full-rank (SPD) matrices, as needed by AffineInvariant and LogFrobenius."""
+    return correlationMatrices(8, 5, 40)
+
+
+@pytest.fixture
+def perPair():
+    """The pairwise matrix of a CorMat.distances function, calling it once per pair without any precomputation."""
+    def pairwise(distance, mats, **kwargs):
+        return np.array([[distance(A, B, **kwargs) for B in mats] for A in mats], dtype=float)
+    return pairwise
+
+
+def offDiagonal(pairwiseDists):
+    """Entries off the diagonal; BuresAngle of a matrix with itself is arccos of a value rounded to either side of 1."""
+    return np.asarray(pairwiseDists)[~np.eye(len(pairwiseDists), dtype=bool)]
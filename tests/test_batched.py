@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+import scipy.linalg as la
+from conftest import correlationMatrices, offDiagonal
+from CorMat import batched, distances, utils
+
+
+@pytest.mark.filterwarnings("ignore:invalid value encountered in arccos")
+@pytest.mark.parametrize("distance", [distances.BuresDistance, distances.BuresAngle])
+@pytest.mark.parametrize("fastMode", [False, True])
+def test_bures(cohort, perPair, distance, fastMode):
+    result = batched.calculatePairwiseDistances(cohort, distance, fastMode=fastMode, blockSize=3, silent=True)
+    reference = perPair(distance, cohort, fastMode=fastMode)
+    np.testing.assert_allclose(offDiagonal(result), offDiagonal(reference), atol=1e-7)
+
+
+def test_bures_symmetric_dispatch(cohort, perPair):
+    result = utils.calculatePairwiseDistances(cohort, distances.BuresDistance, assumeDistIsSymmetric=True, silent=True)
+    np.testing.assert_allclose(result, perPair(distances.BuresDistance, cohort), atol=1e-7)
+    np.testing.assert_array_equal(result, result.T)
+
+
+@pytest.mark.parametrize("distance", [distances.LogFrobenius, distances.Euclidean])
+def test_gram_distances(cohort, perPair, distance):
+    result = batched.calculatePairwiseDistances(cohort, distance, blockSize=3, silent=True)
+    np.testing.assert_allclose(result, perPair(distance, cohort), atol=1e-7)
+    assert np.all(np.diag(result) == 0)
+
+
+def test_logs_from_shared_eigh(cohort):
+    feats = batched.prepare(cohort, batched.requirements[distances.LogFrobenius])
+    logs = feats['logFlat'].reshape(cohort.shape)
+    np.testing.assert_allclose(logs, np.stack([la.logm(mat) for mat in cohort]), atol=1e-10)
+
+
+def test_affine_invariant(cohort, perPair):
+    result = batched.calculatePairwiseDistances(cohort, distances.AffineInvariant, blockSize=3, silent=True)
+    np.testing.assert_allclose(result, perPair(distances.AffineInvariant, cohort), atol=1e-7)
+
+
+def test_affine_invariant_rejects_singular():
+    singular = correlationMatrices(2, 6, 4) # Fewer samples than regions
+    with pytest.raises(ValueError):
+        batched.calculatePairwiseDistances(singular, distances.AffineInvariant, silent=True)
+
+
+@pytest.fixture
+def shortTimeseries():
+    """Timeseries with fewer samples than regions, whose correlation matrices are rank-deficient."""
+    return np.random.default_rng(1).standard_normal((6, 10, 4))
+
+
+def test_factors_from_timeseries(shortTimeseries, perPair):
+    factors = utils.batchTStoFactors(shortTimeseries)
+    mats = np.stack([np.corrcoef(TS) for TS in shortTimeseries])
+    np.testing.assert_allclose(factors @ np.swapaxes(factors, 1, 2), mats, atol=1e-12)
+    result = batched.calculatePairwiseDistances(None, distances.BuresDistance, Factors=factors, blockSize=4, silent=True)
+    # scipy's square roots of singular matrices are only accurate to ~1e-6 (e.g. on the diagonal); the factors are exact
+    np.testing.assert_allclose(offDiagonal(result), offDiagonal(perPair(distances.BuresDistance, mats)), atol=1e-6)
+    assert np.all(np.abs(np.diag(result)) < 1e-7)
+    perFactor = np.array([[distances.BuresDistance(None, None, Afactor=F, Bfactor=G) for G in factors] for F in factors])
+    np.testing.assert_allclose(result, perFactor, atol=1e-10)
+
+
+@pytest.mark.filterwarnings("ignore:invalid value encountered in arccos")
+@pytest.mark.parametrize("distance", [distances.BuresDistance, distances.BuresAngle])
+def test_factored_matrices_match_square_roots(shortTimeseries, distance):
+    mats = np.stack([np.corrcoef(TS) for TS in shortTimeseries]) / shortTimeseries.shape[1]
+    assert 'factor' in batched.prepare(mats, batched.requirements[distance], useFactors="auto")
+    factored = batched.calculatePairwiseDistances(mats, distance, useFactors="auto", silent=True)
+    squareRoots = batched.calculatePairwiseDistances(mats, distance, useFactors=False, silent=True)
+    np.testing.assert_allclose(offDiagonal(factored), offDiagonal(squareRoots), atol=1e-6)
+
+
+@pytest.mark.filterwarnings("ignore:invalid value encountered in arccos")
+def test_multiple_distances_in_one_pass(cohort, perPair):
+    distanceList = [distances.BuresDistance, distances.BuresAngle, distances.AffineInvariant, distances.LogFrobenius,
+                    distances.Euclidean]
+    results = batched.calculateMultiplePairwiseDistances(cohort, distanceList, blockSize=3, silent=True)
+    assert list(results) == distanceList
+    for distance in distanceList:
+        np.testing.assert_allclose(offDiagonal(results[distance]), offDiagonal(perPair(distance, cohort)), atol=1e-7)
+
+
+def test_multiple_distances_with_fallback(cohort, perPair):
+    def frobenius(A, B, **kwargs):
+        return np.linalg.norm(A - B)
+    results = utils.calculateMultiplePairwiseDistances(cohort, [frobenius, distances.BuresDistance], assumeDistIsSymmetric=True,
+                                                       silent=True)
+    assert list(results) == [frobenius, distances.BuresDistance]
+    np.testing.assert_allclose(results[frobenius], perPair(distances.Euclidean, cohort), atol=1e-12)
+    np.testing.assert_allclose(results[distances.BuresDistance], perPair(distances.BuresDistance, cohort), atol=1e-7)
+    with pytest.raises(ValueError):
+        batched.calculateMultiplePairwiseDistances(cohort, [frobenius], silent=True)
+
+
+@pytest.mark.parametrize("outputFormat, symmetric", [("square", True), ("square", False), ("condensed", True)])
+@pytest.mark.parametrize("distance", [distances.BuresDistance, distances.LogFrobenius])
+def test_append_matches_full_recompute(outputFormat, symmetric, distance):
+    mats = correlationMatrices(9, 5, 40)
+    old, new = mats[:6], mats[6:]
+    kwargs = dict(assumeDistIsSymmetric=symmetric, outputFormat=outputFormat, blockSize=4, silent=True)
+    existing = batched.calculatePairwiseDistances(old, distance, **kwargs)
+    feats = batched.prepare(old, batched.requirements[distance])
+    grown, grownFeats = batched.appendPairwiseDistances(existing, old, new, distance, feats=feats, assumeDistIsSymmetric=symmetric,
+                                                        blockSize=4, silent=True)
+    np.testing.assert_allclose(grown, batched.calculatePairwiseDistances(mats, distance, **kwargs), atol=1e-7)
+    assert grown.shape == ((9, 9) if outputFormat == "square" else (36,))
+    assert all(len(arr) == len(mats) for arr in grownFeats.values())
+
+
+def test_append_rejects_mismatched_features():
+    mats = correlationMatrices(6, 5, 40)
+    existing = batched.calculatePairwiseDistances(mats[:4], distances.BuresDistance, silent=True)
+    otherFeats = batched.prepare(correlationMatrices(4, 5, 40, seed=1), batched.requirements[distances.BuresDistance])
+    with pytest.raises(ValueError):
+        batched.appendPairwiseDistances(existing, mats[:4], mats[4:], distances.BuresDistance, feats=otherFeats, silent=True)
+    with pytest.raises(ValueError): # Stored quantities for the wrong number of matrices
+        batched.appendPairwiseDistances(existing, mats[:4], mats[4:], distances.BuresDistance,
+                                        feats={name: arr[:3] for name, arr in otherFeats.items()}, silent=True)
+
+
+@pytest.mark.filterwarnings("ignore:invalid value encountered in arccos")
+@pytest.mark.parametrize("distance", list(batched.blockFunctions) + [lambda A, B, **kwargs: np.abs(A - B).sum()])
+def test_scattered_pairs_match_tile(cohort, distance):
+    feats = batched.prepareFor(distance, cohort)
+    rng = np.random.default_rng(0)
+    first, second = rng.integers(len(cohort), size=30), rng.integers(len(cohort), size=30)
+    tile = batched.evaluateTile(distance, feats, slice(0, len(cohort)), slice(0, len(cohort)))
+    pairs = batched.evaluatePairs(distance, feats, first, second, blockSize=7)
+    np.testing.assert_allclose(pairs[first != second], tile[first, second][first != second], atol=1e-12)
+    np.testing.assert_allclose(pairs, tile[first, second], atol=1e-6) # Including self-pairs, e.g. nan for BuresAngle
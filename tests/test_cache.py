@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import pytest
+from conftest import correlationMatrices
+from CorMat import batched, cache, distances
+
+
+@pytest.mark.parametrize("distance", [distances.BuresDistance, distances.AffineInvariant, distances.LogFrobenius])
+def test_cached_runs_match_uncached(cohort, tmp_path, distance):
+    reference = batched.calculatePairwiseDistances(cohort, distance, silent=True)
+    for _ in range(2): # Cold, then warm
+        result = batched.calculatePairwiseDistances(cohort, distance, silent=True, cacheDir=str(tmp_path))
+        np.testing.assert_allclose(result, reference, atol=1e-12)
+    assert len(cache.entries(str(tmp_path))) == len(cohort)
+
+
+def test_prepare_hashes_each_matrix_once(cohort, tmp_path, monkeypatch):
+    calls = []
+    key = cache.key
+    monkeypatch.setattr(cache, "key", lambda matrix: calls.append(1) or key(matrix))
+    batched.prepare(cohort, ('half', 'neghalf', 'logFlat'), cacheDir=str(tmp_path))
+    assert len(calls) == len(cohort)
+
+
+def test_factors_skip_square_roots(tmp_path):
+    mats = correlationMatrices(5, 10, 4) # Rank-deficient, so "auto" uses thin factors
+    feats = batched.prepare(mats, batched.requirements[distances.BuresDistance], useFactors="auto", cacheDir=str(tmp_path))
+    assert 'factor' in feats and 'half' not in feats
+    stored = {name for _, _, path in cache.entries(str(tmp_path)) for name in os.listdir(path)}
+    assert stored == {'evals.npy', 'evecs.npy'}
+
+
+def test_eviction(cohort, tmp_path):
+    batched.prepare(cohort, ('half',), cacheDir=str(tmp_path))
+    perEntry = cache.size(str(tmp_path)) // len(cohort)
+    assert cache.evict(str(tmp_path), limit=3 * perEntry) == len(cohort) - 3
+    cache.clear(str(tmp_path))
+    assert cache.entries(str(tmp_path)) == []
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pytest
+from conftest import correlationMatrices
+from CorMat import batched, checkpoint, distances, storage
+
+
+@pytest.mark.parametrize("outputFormat", ["square", "condensed"])
+def test_resumed_run_matches_uninterrupted(tmp_path, outputFormat):
+    mats = correlationMatrices(10, 5, 40)
+    checkpointDir = str(tmp_path)
+    kwargs = dict(assumeDistIsSymmetric=True, blockSize=3, outputFormat=outputFormat, silent=True)
+    checkpoint.calculatePairwiseDistances(mats, distances.BuresDistance, checkpointDir, **kwargs)
+
+    # Simulate an interruption: keep the first half of the log (plus a partially written line) and spoil the rest of the output
+    logPath = os.path.join(checkpointDir, checkpoint.logFile)
+    with open(logPath) as f:
+        lines = f.readlines()
+    kept = lines[:len(lines) // 2]
+    with open(logPath, "w") as f:
+        f.writelines(kept + ["9 "])
+    shape = storage.outputShape(len(mats), outputFormat)
+    out = np.memmap(os.path.join(checkpointDir, checkpoint.dataFile), dtype=np.float64, mode='r+', shape=shape)
+    keptTiles = {tuple(map(int, line.split())) for line in kept}
+    for rows, cols in batched.tiles(len(mats), 3, assumeDistIsSymmetric=True):
+        if (rows.start, cols.start) not in keptTiles:
+            batched.writeTile(out, rows, cols, np.full((rows.stop - rows.start, cols.stop - cols.start), -1.0), True)
+    out.flush()
+    del out
+
+    resumed = checkpoint.calculatePairwiseDistances(mats, distances.BuresDistance, checkpointDir, **kwargs)
+    np.testing.assert_allclose(resumed, batched.calculatePairwiseDistances(mats, distances.BuresDistance, **kwargs), atol=1e-12)
+    assert len(checkpoint.readCompleted(checkpointDir)) == len(lines)
+
+
+def test_changed_inputs_are_rejected(tmp_path):
+    mats = correlationMatrices(6, 5, 40)
+    checkpoint.calculatePairwiseDistances(mats, distances.Euclidean, str(tmp_path), blockSize=3, silent=True)
+    changed = mats.copy()
+    changed[2] = correlationMatrices(1, 5, 40, seed=7)[0]
+    with pytest.raises(ValueError):
+        checkpoint.calculatePairwiseDistances(changed, distances.Euclidean, str(tmp_path), blockSize=3, silent=True)
+    with pytest.raises(ValueError):
+        checkpoint.calculatePairwiseDistances(mats, distances.LogFrobenius, str(tmp_path), blockSize=3, silent=True)
+    result = checkpoint.calculatePairwiseDistances(changed, distances.Euclidean, str(tmp_path), blockSize=3, silent=True, overwrite=True)
+    np.testing.assert_allclose(result, batched.calculatePairwiseDistances(changed, distances.Euclidean, silent=True), atol=1e-12)
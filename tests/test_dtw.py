@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from scipy.spatial import distance
+from CorMat.dtw import dtw
+
+
+def bruteForceDTW(X, Y, window=None, windowSize=None, featureDist=distance.euclidean):
+    """DTW by the textbook recursion over the full cost matrix, with cells outside the window masked to inf."""
+    C = np.array([[featureDist(x, y) for y in Y] for x in X])
+    lo, hi = dtw.window_bounds(len(X), len(Y), window=window, windowSize=windowSize)
+    for n in range(len(X)):
+        C[n, :lo[n]] = np.inf
+        C[n, hi[n] + 1:] = np.inf
+    D = np.full((len(X) + 1, len(Y) + 1), np.inf)
+    D[0, 0] = 0
+    for n in range(len(X)):
+        for m in range(len(Y)):
+            D[n+1, m+1] = C[n, m] + min(D[n, m+1], D[n+1, m], D[n, m])
+    return D[-1, -1]
+
+
+def randomWalks(count, length, features=2, seed=0):
+    rng = np.random.default_rng(seed)
+    return [np.cumsum(rng.standard_normal((length, features)), axis=0) for _ in range(count)]
+
+
+@pytest.mark.parametrize("window,windowSize", [(None, None), ("sakoe-chiba", 3), ("sakoe-chiba", 7), ("itakura", 2.0),
+                                               ("itakura", 3.0)])
+@pytest.mark.parametrize("lengths", [(20, 20), (17, 23)])
+def test_windowed_dtw_matches_brute_force(window, windowSize, lengths):
+    X, Y = randomWalks(1, lengths[0], seed=1)[0], randomWalks(1, lengths[1], seed=2)[0]
+    expected = bruteForceDTW(X, Y, window=window, windowSize=windowSize)
+    assert np.isfinite(expected)
+    assert dtw.dtw_distance(X, Y, window=window, windowSize=windowSize) == pytest.approx(expected, rel=1e-12)
+    assert dtw.dtw_distance(X, Y, DTWfeatureDist=lambda x, y: np.linalg.norm(x - y), window=window,
+                            windowSize=windowSize) == pytest.approx(expected, rel=1e-12)
+
+
+def test_narrower_window_never_decreases_distance():
+    X, Y = randomWalks(2, 30, seed=3)
+    sizes = [None, 10, 4, 1]
+    results = [dtw.dtw_distance(X, Y, window=None if size is None else "sakoe-chiba", windowSize=size) for size in sizes]
+    assert np.all(np.diff(results) >= -1e-12)
+
+
+@pytest.mark.parametrize("window,windowSize", [(None, None), ("sakoe-chiba", 4)])
+@pytest.mark.parametrize("DTWfeatureDist", ["euclidean", lambda x, y: np.linalg.norm(x - y)])
+def test_cutoff_abandons_only_below_the_distance(window, windowSize, DTWfeatureDist):
+    X, Y = randomWalks(2, 25, seed=4)
+    exact = bruteForceDTW(X, Y, window=window, windowSize=windowSize)
+    assert np.isinf(dtw.dtw_distance(X, Y, DTWfeatureDist=DTWfeatureDist, window=window, windowSize=windowSize, cutoff=0.5 * exact))
+    assert np.isinf(dtw.dtw_distance(X, Y, DTWfeatureDist=DTWfeatureDist, window=window, windowSize=windowSize, cutoff=0.999 * exact))
+    assert dtw.dtw_distance(X, Y, DTWfeatureDist=DTWfeatureDist, window=window, windowSize=windowSize,
+                            cutoff=1.001 * exact) == pytest.approx(exact, rel=1e-12)
+
+
+@pytest.mark.parametrize("DTWfeatureDist,featureDist,window,windowSize", [
+    ("euclidean", distance.euclidean, None, None), ("euclidean", distance.euclidean, "sakoe-chiba", 4),
+    ("manhattan", distance.cityblock, "itakura", 2.0), ("cosine", distance.cosine, None, None),
+    (distance.chebyshev, distance.chebyshev, None, None)])
+@pytest.mark.parametrize("k", [1, 3])
+def test_knn_search_matches_brute_force(DTWfeatureDist, featureDist, window, windowSize, k):
+    references, queries = randomWalks(15, 20, seed=5), randomWalks(4, 20, seed=6)
+    index = dtw.build_index(references, DTWfeatureDist=DTWfeatureDist, window=window, windowSize=windowSize)
+    for query in queries:
+        exact = np.array([bruteForceDTW(query, ref, window=window, windowSize=windowSize, featureDist=featureDist)
+                          for ref in references])
+        neighbors, dists, stats = dtw.knn_search(query, index, k=k)
+        np.testing.assert_array_equal(neighbors, np.argsort(exact, kind='stable')[:k])
+        np.testing.assert_allclose(dists, np.sort(exact)[:k], rtol=1e-9)
+        assert stats['pruned_kim'] + stats['pruned_keogh'] + stats['abandoned'] + stats['full_dtw'] == len(references)
+
+
+@pytest.mark.parametrize("name,featureDist", [("euclidean", distance.euclidean), ("sqeuclidean", distance.sqeuclidean),
+                                              ("manhattan", distance.cityblock), ("cityblock", distance.cityblock),
+                                              ("cosine", distance.cosine), ("correlation", distance.correlation)])
+def test_compiled_feature_metrics_match_callables(name, featureDist):
+    X, Y = randomWalks(2, 18, features=3, seed=7)
+    Y = Y[:13]
+    np.testing.assert_allclose(dtw.compute_cost_matrix(X, Y, DTWfeatureDist=name),
+                               dtw.compute_cost_matrix(X, Y, DTWfeatureDist=featureDist), rtol=1e-10, atol=1e-12)
+    assert dtw.dtw_distance(X, Y, DTWfeatureDist=name) == pytest.approx(dtw.dtw_distance(X, Y, DTWfeatureDist=featureDist), rel=1e-10)
+    assert dtw.dtw_distance(X, Y, DTWfeatureDist=name, window="itakura") == pytest.approx(
+        dtw.dtw_distance(X, Y, DTWfeatureDist=featureDist, window="itakura"), rel=1e-10)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import scipy.linalg as la
+from scipy.spatial.distance import squareform
+from conftest import offDiagonal
+from CorMat import distances
+
+torch = pytest.importorskip("torch")
+import CorMat.gpu as gpu
+
+
+@pytest.fixture(autouse=True)
+def cpuDevice(monkeypatch):
+    """Runs the torch engine on the CPU device, as on machines without a GPU."""
+    monkeypatch.setattr(gpu.linalg, "device", torch.device("cpu"))
+
+
+@pytest.mark.parametrize("p", [1/2, -1/2])
+def test_fractional_mat_power(cohort, p):
+    powers = gpu.linalg.fractional_mat_power(torch.as_tensor(cohort), p)
+    assert powers.device.type == "cpu"
+    for mat, power in zip(cohort, powers):
+        np.testing.assert_allclose(power.numpy(), np.real(la.fractional_matrix_power(mat, p)), atol=1e-10)
+
+
+def test_matrixLog(cohort):
+    logs = gpu.linalg.matrixLog(torch.as_tensor(cohort))
+    for mat, log in zip(cohort, logs):
+        np.testing.assert_allclose(log.numpy(), la.logm(mat), atol=1e-10)
+    np.testing.assert_allclose(gpu.linalg.matrixLog(torch.as_tensor(cohort[0])).numpy(), la.logm(cohort[0]), atol=1e-10)
+
+
+def test_matrixLog_rejects_singular():
+    with pytest.raises(ValueError):
+        gpu.linalg.matrixLog(torch.zeros(3, 3, dtype=torch.float64))
+
+
+@pytest.mark.filterwarnings("ignore:invalid value encountered in arccos")
+@pytest.mark.parametrize("name", ["BuresDistance", "BuresAngle", "AffineInvariant", "LogFrobenius", "Euclidean"])
+def test_block_engine_matches_numpy(cohort, perPair, name):
+    tensors = [torch.as_tensor(mat) for mat in cohort]
+    result = gpu.batched.calculatePairwiseDistances(tensors, getattr(gpu.distances, name), blockSize=3, silent=True)
+    assert result.device.type == "cpu"
+    reference = perPair(getattr(distances, name), cohort)
+    np.testing.assert_allclose(offDiagonal(result.numpy()), offDiagonal(reference), atol=1e-7)
+
+
+def test_utils_dispatches_to_block_engine(cohort, perPair):
+    tensors = [torch.as_tensor(mat) for mat in cohort]
+    result = gpu.utils.calculatePairwiseDistances(tensors, gpu.distances.BuresDistance, assumeDistIsSymmetric=True, silent=True)
+    np.testing.assert_allclose(result.numpy(), perPair(distances.BuresDistance, cohort), atol=1e-7)
+
+
+@pytest.mark.parametrize("vectorize", [True, False])
+def test_condensed_float32(cohort, vectorize):
+    tensors = [torch.as_tensor(mat) for mat in cohort]
+    result = gpu.utils.calculatePairwiseDistances(tensors, gpu.distances.Euclidean, assumeDistIsSymmetric=True, vectorize=vectorize,
+                                                  outputFormat="condensed", dtype=torch.float32, silent=True)
+    assert result.dtype == torch.float32 and result.shape == (len(cohort) * (len(cohort) - 1) // 2,)
+    reference = squareform(np.array([[np.linalg.norm(A - B) for B in cohort] for A in cohort]), checks=False)
+    np.testing.assert_allclose(result.numpy(), reference, rtol=1e-6)
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+import CorMat
+
+
+def run(code):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(CorMat.__file__)))
+    return subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout.split()
+
+
+def test_import_skips_heavy_dependencies():
+    loaded = run("import sys, CorMat; print(*[name for name in ('torch', 'numba', 'matplotlib') if name in sys.modules])")
+    assert loaded == []
+
+
+def test_classes_survive_submodule_imports():
+    # Importing the submodule (as distances.dtw_distance does) binds CorMat.dtw to it, which must not hide the class
+    result = run("import CorMat, CorMat.dtw; from CorMat.dtw import dtw; "
+                 "print(CorMat.DTW is dtw, CorMat.dtw.dtw is dtw, 'numba' in __import__('sys').modules)")
+    assert result == ["True", "True", "True"]
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from conftest import correlationMatrices
+from CorMat import batched, distances, landmarks
+
+
+@pytest.fixture
+def mats():
+    return correlationMatrices(24, 5, 40)
+
+
+@pytest.mark.parametrize("distance", [distances.Euclidean, distances.LogFrobenius])
+def test_all_landmarks_reproduce_euclidean_distances(mats, distance):
+    approx, report = landmarks.calculateApproximateDistances(mats, distance, len(mats), output="matrix", numHeldOut=200, silent=True)
+    exact = batched.calculatePairwiseDistances(mats, distance, silent=True)
+    np.testing.assert_allclose(approx, exact, atol=1e-8)
+    assert report['error']['maxAbsError'] < 1e-8
+    np.testing.assert_allclose(report['error']['exact'], exact[tuple(report['error']['pairs'].T)], atol=1e-12)
+
+
+@pytest.mark.parametrize("method", ["maxmin", "random"])
+def test_error_falls_with_more_landmarks(mats, method):
+    errors = [landmarks.calculateApproximateDistances(mats, distances.Euclidean, numLandmarks, method=method, numHeldOut=500,
+                                                      silent=True)[1]['error']['relativeError'] for numLandmarks in (3, 6, 12, 24)]
+    assert errors[0] > errors[1] > errors[2] > errors[3]
+    assert errors[-1] < 1e-8
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from CorMat import distances, neighbors, utils
+
+
+def tiedCohort(seed):
+    """Correlation matrices where most of the cohort is copies of a few matrices, so many distances tie."""
+    rng = np.random.default_rng(seed)
+    distinct = [np.corrcoef(rng.standard_normal((6, 40))) for _ in range(4)]
+    return [distinct[i] for i in rng.integers(0, len(distinct), size=40)] + distinct
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_queries_exact_with_ties(seed):
+    mats = tiedCohort(seed)
+    full = utils.calculatePairwiseDistances(mats, distances.Euclidean, silent=True, vectorize=False)
+    index = neighbors.buildIndex(mats, distances.Euclidean, leafSize=2, seed=seed)
+    k = 5
+    for i in range(len(mats)):
+        _, knnDists, _ = neighbors.kNearest(index, k, queryIndex=i)
+        np.testing.assert_allclose(knnDists, np.sort(full[i])[:k], atol=1e-6) # Block distances are exact to ~1e-7
+        levels = np.unique(np.round(full[i], 6))
+        radius = (levels[0] + levels[1]) / 2 # Between the copies of matrix i and the next nearest, away from rounding error
+        found, _, _ = neighbors.radiusNeighbors(index, radius, queryIndex=i)
+        np.testing.assert_array_equal(np.sort(found), np.flatnonzero(full[i] <= radius))
+
+
+def test_buresAngle_not_a_metric():
+    mats = tiedCohort(0)
+    with pytest.raises(ValueError):
+        neighbors.buildIndex(mats, distances.BuresAngle)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from conftest import correlationMatrices
+from CorMat import batched, distances, parallel, utils
+
+
+def asymmetricDistance(A, B, **kwargs):
+    """A non-symmetric callable with no block implementation, so tiles fall back to the per-pair loop."""
+    return np.linalg.norm(A - B) + A[0, 1]
+
+
+@pytest.fixture
+def mats():
+    return correlationMatrices(11, 5, 40)
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_vectorized_distance_matches_serial(mats, backend, symmetric):
+    result = parallel.calculatePairwiseDistances(mats, distances.BuresDistance, nWorkers=2, blockSize=3, backend=backend,
+                                                 assumeDistIsSymmetric=symmetric, silent=True)
+    serial = batched.calculatePairwiseDistances(mats, distances.BuresDistance, assumeDistIsSymmetric=symmetric, silent=True)
+    np.testing.assert_allclose(result, serial, atol=1e-12)
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_per_pair_fallback_matches_serial(mats, backend):
+    result = parallel.calculatePairwiseDistances(mats, asymmetricDistance, nWorkers=2, blockSize=4, backend=backend, silent=True)
+    serial = utils.calculatePairwiseDistances(mats, asymmetricDistance, silent=True)
+    np.testing.assert_allclose(result, serial, atol=1e-12)
+    assert not np.allclose(result, result.T)
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_condensed_float32(mats, backend):
+    result = utils.calculatePairwiseDistances(mats, distances.LogFrobenius, nWorkers=2, blockSize=3, backend=backend,
+                                              assumeDistIsSymmetric=True, outputFormat="condensed", dtype=np.float32, silent=True)
+    serial = batched.calculatePairwiseDistances(mats, distances.LogFrobenius, assumeDistIsSymmetric=True, outputFormat="condensed",
+                                                silent=True)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, serial, rtol=1e-6)
+
+
+def test_limitBLASThreads():
+    assert parallel.limitBLASThreads(None) is None
+    threadpoolctl = pytest.importorskip("threadpoolctl")
+    limiter = parallel.limitBLASThreads(1)
+    assert limiter is not None
+    assert all(pool['num_threads'] == 1 for pool in threadpoolctl.threadpool_info())
+    limiter.restore_original_limits()
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from CorMat import distances, landmarks, neighbors, progress, utils
+
+
+@pytest.fixture
+def timeseries():
+    return np.random.default_rng(0).standard_normal((12, 5, 40))
+
+
+def test_silent_prints_nothing(timeseries, capsys):
+    mats = utils.batchTStoCM(timeseries, silent=True)
+    utils.calculatePairwiseDistances(mats, distances.BuresDistance, silent=True)
+    landmarks.calculateApproximateDistances(mats, distances.Euclidean, 3, numHeldOut=10, silent=True)
+    neighbors.kNeighborsGraph(neighbors.buildIndex(mats, distances.Euclidean), 2, silent=True)
+    assert capsys.readouterr().out == ""
+
+
+def test_reporters_count_their_unit(timeseries, capsys):
+    reporter, reports = progress.recorder()
+    mats = utils.batchTStoCM(timeseries, chunkSize=5, reporter=reporter)
+    assert (reports[-1]['unit'], reports[-1]['pairsDone'], reports[-1]['totalPairs']) == ('subjects', 12, 12)
+
+    reporter, reports = progress.recorder()
+    _, report = landmarks.calculateApproximateDistances(mats, distances.Euclidean, 4, numHeldOut=10, silent=True, reporter=reporter)
+    assert (reports[-1]['unit'], reports[-1]['pairsDone']) == ('landmarks', 4)
+    assert reports[-1]['info']['relativeError'] == report['error']['relativeError']
+
+    reporter, reports = progress.recorder()
+    neighbors.kNeighborsGraph(neighbors.buildIndex(mats, distances.Euclidean), 2, reporter=reporter)
+    assert (reports[-1]['unit'], reports[-1]['pairsDone']) == ('queries', 12)
+    assert capsys.readouterr().out == ""
+
+
+def test_checkpoint_reports_resumed_tiles(timeseries, tmp_path):
+    mats = utils.batchTStoCM(timeseries)
+    utils.calculatePairwiseDistances(mats, distances.Euclidean, checkpointDir=str(tmp_path), blockSize=4, silent=True)
+    reporter, reports = progress.recorder()
+    utils.calculatePairwiseDistances(mats, distances.Euclidean, checkpointDir=str(tmp_path), blockSize=4, reporter=reporter)
+    assert reports[-1]['info']['resumedTiles'] == 9
+    assert "resumedTiles 9" in progress.formatReport(reports[-1])
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import pdist, squareform
+from conftest import correlationMatrices
+from CorMat import distances, storage, utils
+
+
+@pytest.fixture
+def square():
+    points = np.random.default_rng(0).standard_normal((13, 3))
+    return squareform(pdist(points))
+
+
+def test_condensed_layout_matches_scipy(square):
+    condensed = squareform(square, checks=False)
+    numArrays = len(square)
+    assert storage.numArraysFromCondensed(len(condensed)) == numArrays
+    i, j = np.triu_indices(numArrays, 1)
+    np.testing.assert_array_equal(condensed[storage.condensedIndex(i, j, numArrays)], square[i, j])
+    np.testing.assert_array_equal(condensed[storage.condensedIndex(j, i, numArrays)], square[i, j])
+
+
+@pytest.mark.parametrize("chunkRows", [4, 256])
+def test_round_trip(square, tmp_path, chunkRows):
+    condensed = storage.toCondensed(square, chunkRows=chunkRows)
+    np.testing.assert_array_equal(condensed, squareform(square, checks=False))
+    np.testing.assert_array_equal(storage.toSquare(condensed, chunkRows=chunkRows), square)
+    onDisk = storage.toSquare(condensed, dtype=np.float32, filename=str(tmp_path / "square.npy"), chunkRows=chunkRows)
+    assert isinstance(onDisk, np.memmap) and onDisk.dtype == np.float32
+    np.testing.assert_allclose(onDisk, square, rtol=1e-6)
+
+
+@pytest.mark.parametrize("layout", ["square", "condensed"])
+def test_nearest_neighbors(square, layout):
+    dists = square if layout == "square" else squareform(square, checks=False)
+    indices, knnDists = storage.kNearestNeighbors(dists, 4, chunkRows=5)
+    expected = np.argsort(square, axis=1, kind='stable')[:, :4]
+    np.testing.assert_array_equal(indices[:, 0], np.arange(len(square)))
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(expected, axis=1))
+    np.testing.assert_allclose(knnDists, np.take_along_axis(square, expected, axis=1))
+    graph = storage.kNeighborsGraph(dists, 3)
+    assert graph.shape == square.shape and graph.nnz == 4 * len(square) # Self included, as an explicit 0
+    np.testing.assert_array_equal(graph.diagonal(), 0)
+
+
+def test_condensed_float32_through_entry_points(tmp_path):
+    mats = correlationMatrices(9, 5, 40)
+    reference = utils.calculatePairwiseDistances(mats, distances.BuresDistance, assumeDistIsSymmetric=True, silent=True)
+    kwargs = dict(assumeDistIsSymmetric=True, outputFormat="condensed", dtype=np.float32, silent=True)
+    results = {'vectorized': utils.calculatePairwiseDistances(mats, distances.BuresDistance, **kwargs),
+               'loop': utils.calculatePairwiseDistances(mats, distances.BuresDistance, vectorize=False, precomputeHalves=True, **kwargs),
+               'checkpoint': utils.calculatePairwiseDistances(mats, distances.BuresDistance, checkpointDir=str(tmp_path), **kwargs)}
+    for name, result in results.items():
+        assert result.dtype == np.float32 and result.shape == (36,), name
+        np.testing.assert_allclose(storage.toSquare(result), reference, rtol=1e-6, atol=1e-6, err_msg=name)
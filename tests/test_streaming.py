@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import squareform
+from conftest import offDiagonal
+from CorMat import batched, distances, streaming, utils
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    """Nine timeseries of differing lengths, alternately saved as .npy and .npz, and their correlation matrices."""
+    rng = np.random.default_rng(0)
+    timeseries = [rng.standard_normal((5, 30 + 3 * i)) for i in range(9)]
+    source = tmp_path / "timeseries"
+    source.mkdir()
+    for i, ts in enumerate(timeseries):
+        if i % 2:
+            np.savez(source / f"subject{i}.npz", ts=ts)
+        else:
+            np.save(source / f"subject{i}.npy", ts)
+    return str(source), np.stack([utils.TStoCM(ts) for ts in timeseries])
+
+
+@pytest.mark.filterwarnings("ignore:invalid value encountered in arccos")
+@pytest.mark.parametrize("distance", [distances.BuresDistance, distances.BuresAngle, distances.LogFrobenius, distances.Euclidean, distances.AffineInvariant])
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_matches_in_memory(cohort, tmp_path, distance, symmetric):
+    source, mats = cohort
+    result = streaming.calculatePairwiseDistances(source, distance, str(tmp_path / "work"), assumeDistIsSymmetric=symmetric,
+                                                  memoryBudget=2**13, silent=True)
+    expected = batched.calculatePairwiseDistances(mats, distance, assumeDistIsSymmetric=symmetric, silent=True)
+    np.testing.assert_allclose(offDiagonal(result), offDiagonal(expected), atol=1e-10)
+    np.testing.assert_allclose(np.diag(result), np.diag(expected), atol=1e-6)
+    np.testing.assert_allclose(streaming.openStacks(str(tmp_path / "work"), names=('mats',))['mats'], mats, atol=1e-12)
+
+
+def test_condensed_float32_on_workers(cohort, tmp_path):
+    source, mats = cohort
+    result = streaming.calculatePairwiseDistances(source, distances.BuresDistance, str(tmp_path / "work"), assumeDistIsSymmetric=True,
+                                                  memoryBudget=2**13, nWorkers=2, backend="thread", outputFormat="condensed",
+                                                  dtype=np.float32, silent=True)
+    expected = batched.calculatePairwiseDistances(mats, distances.BuresDistance, assumeDistIsSymmetric=True, silent=True)
+    assert result.dtype == np.float32 and result.shape == (36,)
+    np.testing.assert_allclose(squareform(result, checks=False), expected, atol=1e-6)
+
+
+def test_custom_preprocess(cohort, tmp_path):
+    source, mats = cohort
+    result = streaming.calculatePairwiseDistances(source, distances.Euclidean, str(tmp_path / "work"), preprocess=utils.TStoCM,
+                                                  silent=True)
+    np.testing.assert_allclose(result, batched.calculatePairwiseDistances(mats, distances.Euclidean, silent=True), atol=1e-12)
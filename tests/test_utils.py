@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from CorMat import utils
+
+
+@pytest.fixture
+def timeseries():
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.standard_normal((6, 120)), axis=1) + 50
+
+
+@pytest.mark.parametrize("windowLength,stride,reanchorEvery", [(20, 1, 1000), (20, 3, 7), (20, 1, 1), (15, 4, None), (10, 12, 5)])
+def test_sliding_windows_match_TStoCM(timeseries, windowLength, stride, reanchorEvery):
+    starts = range(0, timeseries.shape[1] - windowLength + 1, stride)
+    windows = list(utils.iterSlidingTStoCM(timeseries, windowLength, stride=stride, reanchorEvery=reanchorEvery))
+    assert len(windows) == len(starts)
+    for start, matrix in zip(starts, windows):
+        np.testing.assert_allclose(matrix, utils.TStoCM(timeseries[:, start:start + windowLength]), atol=1e-10)
+    np.testing.assert_array_equal(utils.slidingTStoCM(timeseries, windowLength, stride=stride, reanchorEvery=reanchorEvery),
+                                  np.stack(windows))
+
+
+@pytest.mark.parametrize("reanchorEvery", [0, -3])
+def test_invalid_reanchorEvery(timeseries, reanchorEvery):
+    with pytest.raises(ValueError, match="reanchorEvery"):
+        next(utils.iterSlidingTStoCM(timeseries, 20, reanchorEvery=reanchorEvery))
+    with pytest.raises(ValueError, match="reanchorEvery"):
+        utils.slidingTStoCM(timeseries, 20, reanchorEvery=reanchorEvery)
+
+
+@pytest.mark.parametrize("resampleTo", [None, 40, 100])
+@pytest.mark.parametrize("chunkSize", [None, 2])
+def test_batch_matches_per_subject_for_ragged_lengths(resampleTo, chunkSize):
+    rng = np.random.default_rng(1)
+    cohort = [rng.standard_normal((5, length)) for length in (50, 80, 50, 65, 80, 71, 50)]
+    expected = [utils.TStoCM(ts if resampleTo is None else utils.reinterpolate_TS(ts, resampleTo, axis=1)) for ts in cohort]
+    result = utils.batchTStoCM(cohort, resampleTo=resampleTo, chunkSize=chunkSize)
+    np.testing.assert_allclose(result, np.stack(expected), atol=1e-12)
+
+
+def test_batch_matches_clipped_per_subject():
+    rng = np.random.default_rng(2)
+    cohort = [rng.standard_normal((8, length)) for length in (60, 75, 60)]
+    options = dict(rowsToKeep=6, sampleRate=0.5, leadingClip=10.0, durationToKeep=80.0, keepAll=False)
+    expected = [utils.rawTStoClippedCMat(ts, **options) for ts in cohort]
+    np.testing.assert_allclose(utils.batchTStoCM(cohort, **options), np.stack(expected), atol=1e-12)
+    np.testing.assert_allclose(utils.batchTStoCM(np.stack([ts[:, :60] for ts in cohort]), **options),
+                               np.stack([utils.rawTStoClippedCMat(ts[:, :60], **options) for ts in cohort]), atol=1e-12)